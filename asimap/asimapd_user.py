@@ -61,6 +61,55 @@ Environment Variables:
                      MH command-line clients are actively modifying the same
                      mail store concurrently.
 
+  WATCH_FOLDERS      Set to 'false', 'no', or '0' to poll the mail folders for
+                     changes instead of watching them with inotify. Folders
+                     are watched by default where inotify is available
+                     (Linux.)
+
+  MSG_CACHE_BYTES    The size, in bytes, of the cache of parsed messages that
+                     each active mailbox keeps. Measured by the size of the
+                     message files on disk. Defaults to 16mb. Set to 0 to
+                     disable the cache.
+
+  SEARCH_TEXT_CACHE_BYTES  The size, in characters of text, of the cache of
+                     the decoded text of messages that SEARCH BODY and TEXT
+                     look in, that each active mailbox keeps. Defaults to
+                     8mb. Set to 0 to disable the cache.
+
+  FETCH_THREADS      The number of threads FETCH's read and render messages
+                     on, to keep the event loop free for other clients.
+                     Defaults to 2. Set to 0 to render messages on the event
+                     loop.
+
+  PARSE_PROCESSES    The number of processes that FETCH threads hand parsing
+                     messages off to. Defaults to 0 (messages are parsed in
+                     the FETCH thread.)
+
+  FETCH_RENDER_PROCESSES  The number of processes that large FETCH's (ie: a
+                     new client syncing an entire mailbox) are rendered in,
+                     spreading the work over several cores. Set to `auto` to
+                     use one per CPU but one. Defaults to 0 (FETCH's are
+                     rendered by the user server.)
+
+  SEARCH_PROCESSES   The number of processes that SEARCH's that have to look
+                     at the text of a large number of messages (ie: a
+                     SEARCH BODY not answered by the text index) are split
+                     up between. Set to `auto` to use one per CPU but one.
+                     Defaults to 0 (SEARCH's are run by the user server.)
+
+  SEARCH_PROCESS_CHUNK_SIZE  The number of messages in each chunk of a
+                     SEARCH handed to a SEARCH process. Defaults to 250.
+
+  SEARCH_PROCESS_MIN_MSGS  The number of messages a SEARCH has to look at
+                     before it is split up between the SEARCH processes.
+                     Defaults to 1000.
+
+  TEXT_INDEX_BYTES   The maximum size, in bytes of text, of the full text
+                     index that SEARCH BODY and TEXT are answered from. The
+                     index is built in the background. Defaults to 0 (no
+                     text index.) Send the user server SIGUSR2 to rebuild
+                     the index from scratch.
+
 XXX We communicate with the server via localhost TCP sockets. We REALLY should
     set up some sort of authentication key that the server must use when
     connecting to us. Perhaps we will use stdin for that in the
@@ -83,7 +132,12 @@ from dotenv import load_dotenv
 
 # Application imports
 #
+import asimap.executor
+import asimap.folder_watcher
 import asimap.mh
+import asimap.msg_cache
+import asimap.msg_files
+import asimap.text_index
 import asimap.trace
 from asimap import __version__ as VERSION
 from asimap.user_server import IMAPUserServer
@@ -98,14 +152,19 @@ logger = logging.getLogger("asimap.asimapd_user")
 
 #############################################################################
 #
-async def create_and_start_user_server(maildir: Path, debug: bool) -> None:
+async def create_and_start_user_server(
+    maildir: Path, debug: bool, render_processes: int = 0
+) -> None:
     """Create and run an IMAP user server for the given mail directory.
 
     Args:
         maildir: Path to the user's MH mail directory.
         debug: When ``True``, enable debug-level logging.
+        render_processes: The number of FETCH render processes.
     """
-    server = await IMAPUserServer.new(maildir, debug=debug)
+    server = await IMAPUserServer.new(
+        maildir, debug=debug, render_processes=render_processes
+    )
     await server.run()
 
 
@@ -152,8 +211,54 @@ def main() -> None:
     ):
         asimap.mh.set_file_locking(True)
 
+    if os.environ.get("WATCH_FOLDERS", "").lower() in ("0", "false", "no"):
+        asimap.folder_watcher.set_watch_folders(False)
+
+    if msg_cache_bytes := os.environ.get("MSG_CACHE_BYTES"):
+        asimap.msg_cache.set_msg_cache_bytes(int(msg_cache_bytes))
+    if search_text_cache_bytes := os.environ.get("SEARCH_TEXT_CACHE_BYTES"):
+        asimap.msg_files.set_search_text_cache_bytes(
+            int(search_text_cache_bytes)
+        )
+
+    fetch_threads = os.environ.get("FETCH_THREADS")
+    parse_processes = os.environ.get("PARSE_PROCESSES")
+    if fetch_threads or parse_processes:
+        asimap.executor.set_executor_workers(
+            threads=int(fetch_threads) if fetch_threads else None,
+            processes=int(parse_processes) if parse_processes else None,
+        )
+
+    search_processes = os.environ.get("SEARCH_PROCESSES")
+    search_chunk_size = os.environ.get("SEARCH_PROCESS_CHUNK_SIZE")
+    search_min_msgs = os.environ.get("SEARCH_PROCESS_MIN_MSGS")
+    if search_processes or search_chunk_size or search_min_msgs:
+        processes: int | None = None
+        if search_processes:
+            if search_processes.lower() == "auto":
+                processes = asimap.executor.default_render_processes()
+            else:
+                processes = int(search_processes)
+        asimap.executor.set_search_processes(
+            processes=processes,
+            chunk_size=int(search_chunk_size) if search_chunk_size else None,
+            min_msgs=int(search_min_msgs) if search_min_msgs else None,
+        )
+
+    if text_index_bytes := os.environ.get("TEXT_INDEX_BYTES"):
+        asimap.text_index.set_text_index_bytes(int(text_index_bytes))
+
+    render_processes = 0
+    if fetch_render_processes := os.environ.get("FETCH_RENDER_PROCESSES"):
+        if fetch_render_processes.lower() == "auto":
+            render_processes = asimap.executor.default_render_processes()
+        else:
+            render_processes = int(fetch_render_processes)
+
     try:
-        asyncio.run(create_and_start_user_server(maildir, debug))
+        asyncio.run(
+            create_and_start_user_server(maildir, debug, render_processes)
+        )
     except KeyboardInterrupt:
         logger.warning("Keyboard interrupt, exiting, user: %s", username)
     except Exception as e:
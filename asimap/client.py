@@ -10,7 +10,7 @@ import logging
 import sys
 from enum import StrEnum
 from itertools import count, groupby
-from typing import TYPE_CHECKING, Union
+from typing import TYPE_CHECKING, Union, cast
 
 # asimapd imports
 #
@@ -19,15 +19,18 @@ from asimap import __version__
 from .auth import PWUser, authenticate
 from .constants import SPECIAL_USE_ATTR_VALUES
 from .exceptions import AuthenticationException, Bad, MailboxInconsistency, No
+from .fetch import FetchLiteral
 from .mbox import Mailbox, NoSuchMailbox
 from .parse import (
     IMAPClientCommand,
     IMAPCommand,
     ListReturnOpt,
     ListSelectOpt,
+    SearchReturnOpt,
     StatusAtt,
 )
 from .throttle import check_allow, login_failed
+from .utils import SavedResult, compact_sequence
 
 # Allow circular imports for annotations
 #
@@ -52,6 +55,8 @@ CAPABILITIES = (
     "LIST-STATUS",
     "NAMESPACE",
     "SPECIAL-USE",
+    "ESEARCH",
+    "SEARCHRES",
 )
 SERVER_ID = {
     "name": "asimapd",
@@ -690,6 +695,8 @@ class Authenticated(BaseClientHandler):
     that the IMAP client is going to do.
     """
 
+    client: "IMAPClientProxy"
+
     ##################################################################
     #
     def __init__(
@@ -728,6 +735,25 @@ class Authenticated(BaseClientHandler):
         #
         self.select_while_selected_count = 0
 
+        # The result of this client's last `SEARCH RETURN (SAVE)` (rfc5182),
+        # referred to as `$` in place of a message set. It is the empty set
+        # whenever a mailbox is selected or unselected.
+        #
+        self.saved_result = SavedResult()
+
+    ##################################################################
+    #
+    async def command(self, imap_command: IMAPClientCommand) -> None:
+        """
+        Fill in what `$` refers to before running the command.
+
+        Args:
+            imap_command: An instance parse.IMAPClientCommand
+        """
+        if imap_command.saved_result is not None:
+            imap_command.saved_result.replace(self.saved_result)
+        await super().command(imap_command)
+
     #########################################################################
     #
     async def do_authenticate(self, cmd: IMAPClientCommand) -> None:
@@ -760,6 +786,7 @@ class Authenticated(BaseClientHandler):
         # deselects any already selected mailbox.
         #
         self.pending_notifications = []
+        self.saved_result = SavedResult()
         self.idling = False
         if self.state == ClientState.SELECTED:
             self.state = ClientState.AUTHENTICATED
@@ -832,6 +859,7 @@ class Authenticated(BaseClientHandler):
             self.mbox.unselected(self.client.name)
             self.mbox = None
         self.pending_notifications = []
+        self.saved_result = SavedResult()
         self.idling = False
         self.state = ClientState.AUTHENTICATED
 
@@ -1272,6 +1300,7 @@ class Authenticated(BaseClientHandler):
         # operation.
         #
         self.pending_notifications = []
+        self.saved_result = SavedResult()
         self.state = ClientState.AUTHENTICATED
 
         if not self.mbox:
@@ -1386,6 +1415,9 @@ class Authenticated(BaseClientHandler):
 
         async with cmd.ready_and_okay(self.mbox):
             try:
+                if cmd.search_return_opts is not None:
+                    await self._esearch(cmd)
+                    return
                 results = await self.mbox.search(
                     cmd.search_key, cmd.uid_command, cmd.timeout_cm
                 )
@@ -1397,6 +1429,89 @@ class Authenticated(BaseClientHandler):
                 self.full_search = True
                 logger.warning("Mailbox '%s': %s", self.mbox.name, str(e))
 
+    ##################################################################
+    #
+    async def _esearch(self, cmd: IMAPClientCommand) -> None:
+        """
+        Send the untagged ESEARCH response (rfc4731) for a SEARCH with
+        RETURN options. Matching messages are returned as a sequence set
+        instead of a list of every number. If only MIN, MAX, and/or COUNT are
+        asked for the list of matching messages is never built.
+
+        RETURN (SAVE) (rfc5182) saves the result as `$`. If it is the only
+        option no ESEARCH response is sent.
+
+        Args:
+            cmd: The IMAP SEARCH command we are executing
+        """
+        assert self.mbox
+        assert cmd.search_return_opts is not None
+        opts = cmd.search_return_opts
+
+        # If SAVE is given with only MIN and/or MAX then only those messages
+        # are saved. Otherwise every matching message is.
+        #
+        save = SearchReturnOpt.SAVE in opts
+        save_all = save and (
+            SearchReturnOpt.ALL in opts
+            or SearchReturnOpt.COUNT in opts
+            or not opts & {SearchReturnOpt.MIN, SearchReturnOpt.MAX}
+        )
+
+        # If the search fails `$` is the empty set.
+        #
+        if save:
+            self.saved_result = SavedResult()
+
+        results: list[int] = []
+        if SearchReturnOpt.ALL in opts or save_all:
+            results = await self.mbox.search(
+                cmd.search_key, cmd.uid_command, cmd.timeout_cm
+            )
+            first = results[0] if results else None
+            last = results[-1] if results else None
+            num = len(results)
+        else:
+            first, last, num = await self.mbox.search_summary(
+                cmd.search_key, cmd.uid_command, cmd.timeout_cm
+            )
+
+        # The saved result is kept as UIDs.
+        #
+        if save:
+            if save_all:
+                saved = results
+            else:
+                saved = [
+                    x
+                    for opt, x in (
+                        (SearchReturnOpt.MIN, first),
+                        (SearchReturnOpt.MAX, last),
+                    )
+                    if opt in opts and x is not None
+                ]
+            if not cmd.uid_command:
+                saved = [self.mbox.uids[x - 1] for x in saved]
+            self.saved_result = SavedResult(saved)
+            if not opts - {SearchReturnOpt.SAVE}:
+                return
+
+        # MIN, MAX, and ALL are left out of the response if nothing matched.
+        #
+        response = [f'* ESEARCH (TAG "{cmd.tag}")']
+        if cmd.uid_command:
+            response.append("UID")
+        if SearchReturnOpt.MIN in opts and first is not None:
+            response.append(f"MIN {first}")
+        if SearchReturnOpt.MAX in opts and last is not None:
+            response.append(f"MAX {last}")
+        if SearchReturnOpt.COUNT in opts:
+            response.append(f"COUNT {num}")
+        if SearchReturnOpt.ALL in opts and results:
+            seq_set = compact_sequence(results).replace("-", ":")
+            response.append(f"ALL {seq_set}")
+        await self.client.push(" ".join(response) + "\r\n")
+
     ##################################################################
     #
     async def do_fetch(self, cmd: IMAPClientCommand) -> None:
@@ -1452,11 +1567,18 @@ class Authenticated(BaseClientHandler):
                     sorted(cmd.msg_set_as_set) if cmd.msg_set_as_set else []
                 )
                 async for idx, results in self.mbox.fetch(
-                    msg_set, cmd.fetch_atts, cmd.uid_command, cmd.timeout_cm
+                    msg_set,
+                    cmd.fetch_atts,
+                    cmd.uid_command,
+                    cmd.timeout_cm,
+                    stream_literals=True,
                 ):
+                    if any(isinstance(x, FetchLiteral) for x in results):
+                        await self._push_streamed_fetch(cmd, idx, results)
+                        continue
                     msg = b"* %(idx)d FETCH (%(results)b)\r\n" % {
                         b"idx": idx,
-                        b"results": b" ".join(results),
+                        b"results": b" ".join(cast(list[bytes], results)),
                     }
                     await self.client.push(msg)
         except MailboxInconsistency as exc:
@@ -1476,6 +1598,45 @@ class Authenticated(BaseClientHandler):
         #
         await self.send_pending_notifications()
 
+    ##################################################################
+    #
+    async def _push_streamed_fetch(
+        self,
+        cmd: IMAPClientCommand,
+        idx: int,
+        results: list[bytes | FetchLiteral],
+    ) -> None:
+        """
+        Send a FETCH response that has one or more large literals in it.
+        The literals are streamed to the client from their message files
+        instead of building the entire response in memory.
+
+        Args:
+            cmd: The IMAP command we are executing
+            idx: The message sequence number of the FETCH response
+            results: The results of the FETCH attributes for the message
+        """
+        pending = [b"* %d FETCH (" % idx]
+        for i, result in enumerate(results):
+            if i:
+                pending.append(b" ")
+            if isinstance(result, FetchLiteral):
+                await self.client.push(b"".join(pending))
+                await self.client.push_literal(result, cmd.timeout_cm)
+                pending = []
+
+                # The message file changed while we were sending it. What
+                # the client got was padded or truncated to keep the
+                # connection in sync. Make sure we resync before the next
+                # command.
+                #
+                if result.inconsistent and self.mbox:
+                    self.mbox.optional_resync = False
+            else:
+                pending.append(result)
+        pending.append(b")\r\n")
+        await self.client.push(b"".join(pending))
+
     ##################################################################
     #
     async def do_store(self, cmd: IMAPClientCommand) -> None:
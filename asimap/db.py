@@ -173,7 +173,7 @@ class Database:
             await migration(self.conn)
             await self.execute(
                 "insert into versions (version) values (?)",
-                str(idx),
+                (idx,),
                 commit=True,
             )
 
@@ -372,6 +372,105 @@ async def add_msg_keys_to_mbox(c: aiosqlite.Connection) -> None:
     await c.execute("alter table mailboxes add column msg_keys text default ''")
 
 
+####################################################################
+#
+async def add_msg_metadata_table(c: aiosqlite.Connection) -> None:
+    """
+    A table of per-message metadata: the RFC822.SIZE, INTERNALDATE, and the
+    encoded ENVELOPE, BODY, and BODYSTRUCTURE FETCH responses for a message.
+
+    These are expensive to compute (they require parsing the message) and
+    never change for a given message so we compute them once and store them
+    here. Rows are keyed by mailbox id and UID. The uid_vv is recorded so that
+    rows from before a mailbox's uid_vv changed are ignored.
+
+    Any of the metadata columns may be NULL, meaning we have not computed that
+    value yet.
+    """
+    await c.execute(
+        "create table msg_metadata (mailbox_id integer, uid_vv integer, "
+        "uid integer, size integer, internaldate real, envelope blob, "
+        "body blob, bodystructure blob, primary key (mailbox_id, uid))"
+    )
+
+
+####################################################################
+#
+async def add_msg_headers_table(c: aiosqlite.Connection) -> None:
+    """
+    A table that indexes the headers clients search on the most (see
+    `asimap.header_index`): the decoded, lowercased From, To, Cc, Bcc,
+    Subject, Message-ID, In-Reply-To and References headers of each
+    message. A column is NULL if the message does not have that header.
+
+    Like `msg_metadata` rows are keyed by mailbox id and UID, and rows
+    from before a mailbox's uid_vv changed are ignored.
+    """
+    await c.execute(
+        "create table msg_headers (mailbox_id integer, uid_vv integer, "
+        "uid integer, from_addr text, to_addr text, cc_addr text, "
+        "bcc_addr text, subject text, message_id text, in_reply_to text, "
+        "refs text, primary key (mailbox_id, uid))"
+    )
+
+
+####################################################################
+#
+async def add_msg_text_table(c: aiosqlite.Connection) -> None:
+    """
+    A table of the messages in the full text index of BODY and TEXT (see
+    `asimap.text_index`) and the size of the text of each. The text itself
+    is in the `msg_text_fts` FTS5 table, whose rowid is this table's id.
+    That table is created by the text index when it is enabled, since not
+    every sqlite has FTS5.
+    """
+    await c.execute(
+        "create table msg_text (id integer primary key, mailbox_id integer, "
+        "uid_vv integer, uid integer, size integer)"
+    )
+    await c.execute(
+        "create unique index msg_text_mbox_uid on msg_text (mailbox_id, uid)"
+    )
+
+
+####################################################################
+#
+async def add_sentdate_to_msg_metadata(c: aiosqlite.Connection) -> None:
+    """
+    Adds the day of a message's Date: header, as a date ordinal, to its
+    metadata for the SENTBEFORE, SENTON and SENTSINCE searches (see
+    `asimap.msg_columns`). 0 means the message has no (parsable) Date:
+    header, NULL that we have not looked yet.
+    """
+    await c.execute("alter table msg_metadata add column sentdate integer")
+
+
+####################################################################
+#
+async def reindex_msg_text_with_mime_headers(c: aiosqlite.Connection) -> None:
+    """
+    The text index now has the headers of every MIME part of a message, not
+    just its top level headers. Empty it so that every message is indexed
+    again.
+    """
+    await c.execute("delete from msg_text")
+    await c.execute("drop table if exists msg_text_fts")
+
+
+####################################################################
+#
+async def add_file_stamp_to_msg_metadata(c: aiosqlite.Connection) -> None:
+    """
+    Adds the mtime (in ns) and size of the message file a message's
+    metadata was computed from. MH tools (ie: `anno`) rewrite messages in
+    place without changing their UID, so metadata is only used if the
+    message file still matches. Rows from before this have NULL and are
+    computed again.
+    """
+    await c.execute("alter table msg_metadata add column mtime_ns integer")
+    await c.execute("alter table msg_metadata add column file_size integer")
+
+
 # The list of migrations we have so far. These are executed in order. They are
 # executed only once. They are executed when the database is opened. We track
 # which ones have been executed and new ones are executed when the database is
@@ -385,4 +484,10 @@ MIGRATIONS = [
     get_rid_of_root_folder,
     add_msg_keys_to_mbox,
     get_rid_of_root_folder,  # For real this time.
+    add_msg_metadata_table,
+    add_msg_headers_table,
+    add_msg_text_table,
+    add_sentdate_to_msg_metadata,
+    reindex_msg_text_with_mime_headers,
+    add_file_stamp_to_msg_metadata,
 ]
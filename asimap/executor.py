@@ -0,0 +1,383 @@
+"""
+Run the blocking parts of answering IMAP commands (reading, parsing and
+rendering messages) off of the user server's event loop.
+
+All of the IMAP clients of a user share one user server process and one
+event loop. Parsing and rendering a message is synchronous, so while one
+client FETCH's a large range of messages, IDLE notifications and every other
+client's commands wait behind it.
+
+There are two pools:
+
+- A thread pool that the per-message work of a FETCH runs on. The FETCH still
+  handles its messages one at a time, in order, so responses go out in the
+  same order as they always have. The event loop is free to serve other
+  clients while a message is being read and rendered.
+
+- An optional process pool that messages are parsed in. Parsing is mostly
+  pure python, so in a thread it still holds the GIL. A worker thread hands
+  the parse to a process and waits for the parsed message to come back,
+  letting the event loop (and other threads) run. Pickling the parsed
+  message back costs something, so this only pays for large messages and
+  busy servers, and is off by default.
+
+Separately, a server can opt in to a pool of FETCH render processes. Large
+FETCH's (a new client syncing an entire mailbox) hand batches of messages to
+them so the rendering is spread over several cores (see
+`asimap.fetch_worker`), and to a pool of SEARCH processes. SEARCH's that
+have to look at the text of a large number of messages hand chunks of them
+to it (see `asimap.search_worker`)
+
+The `LoopLagMonitor` measures how late the event loop is in running its
+callbacks so the effect of these can be seen in the user server's metrics.
+"""
+
+# system imports
+#
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import Counter
+from collections.abc import Callable, Sequence
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+logger = logging.getLogger("asimap.executor")
+
+# The number of threads that the per-message work of FETCH's is run on. 0
+# means messages are read and rendered on the event loop itself. Can be
+# changed via `set_executor_workers()`.
+#
+FETCH_THREADS: int = 2
+
+# The number of processes messages are parsed in. 0 means messages are
+# parsed in the thread that needs them. Can be changed via
+# `set_executor_workers()`.
+#
+PARSE_PROCESSES: int = 0
+
+# FETCH's of at least this many messages are rendered by the FETCH render
+# processes, if the server has any, in batches of this many messages. Each
+# render process has at most this many batches in flight at once, so a
+# client that reads its responses slowly does not make us render the whole
+# mailbox ahead of it.
+#
+FETCH_RENDER_MIN_MSGS = 100
+FETCH_RENDER_BATCH_SIZE = 25
+FETCH_RENDER_WINDOW = 2
+
+# The number of SEARCH processes. 0 means SEARCH's are run by the user
+# server. SEARCH's that look at the text of messages and have at least
+# `SEARCH_PROCESS_MIN_MSGS` messages to look at are split in to chunks of
+# `SEARCH_PROCESS_CHUNK_SIZE` messages that are matched in the SEARCH
+# processes. Each SEARCH process has at most `SEARCH_PROCESS_WINDOW` chunks
+# in flight at once. Can be changed via `set_search_processes()`.
+#
+SEARCH_PROCESSES: int = 0
+SEARCH_PROCESS_MIN_MSGS: int = 1000
+SEARCH_PROCESS_CHUNK_SIZE: int = 250
+SEARCH_PROCESS_WINDOW = 2
+
+# How often the `LoopLagMonitor` samples the event loop, and how late (in
+# seconds) a sample has to be to count as a stall of the event loop.
+#
+LOOP_LAG_INTERVAL = 0.1
+LOOP_LAG_STALL = 0.1
+
+# Counts of the work done by our pools: "thread" for per-message work run on
+# the thread pool, "process" for messages parsed in the process pool,
+# "render" for messages rendered by the FETCH render processes, and "search"
+# for messages matched by the SEARCH processes. Logged and cleared by the
+# user server when it dumps its metrics.
+#
+EXECUTOR_COUNTS: Counter[str] = Counter()
+
+_pool_lock = threading.Lock()
+_thread_pool: ThreadPoolExecutor | None = None
+_process_pool: ProcessPoolExecutor | None = None
+_render_pool: ProcessPoolExecutor | None = None
+_search_pool: ProcessPoolExecutor | None = None
+
+# Set in the threads of our thread pool so `run_in_process()` knows it is not
+# on the event loop.
+#
+_worker = threading.local()
+
+
+####################################################################
+#
+def set_executor_workers(
+    threads: int | None = None, processes: int | None = None
+) -> None:
+    """
+    Set the size of the thread and process pools. Existing pools are shut
+    down so the new sizes take effect the next time they are used.
+
+    Arguments:
+    - `threads`: The number of FETCH threads. 0 runs FETCH's on the event
+      loop. None leaves it as it is.
+    - `processes`: The number of parsing processes. 0 disables the process
+      pool. None leaves it as it is.
+    """
+    global FETCH_THREADS, PARSE_PROCESSES
+    if threads is not None:
+        FETCH_THREADS = threads
+    if processes is not None:
+        PARSE_PROCESSES = processes
+    shutdown_executors()
+
+
+####################################################################
+#
+def set_search_processes(
+    processes: int | None = None,
+    chunk_size: int | None = None,
+    min_msgs: int | None = None,
+) -> None:
+    """
+    Set the number of SEARCH processes, and how SEARCH's are split up
+    between them. The existing pool of SEARCH processes is shut down so the
+    new size takes effect the next time it is used.
+
+    Arguments:
+    - `processes`: The number of SEARCH processes. 0 runs all SEARCH's in
+      the user server. None leaves it as it is.
+    - `chunk_size`: The number of messages in each chunk of a SEARCH handed
+      to a SEARCH process. None leaves it as it is.
+    - `min_msgs`: The number of messages a SEARCH has to look at before it
+      is split up between the SEARCH processes. None leaves it as it is.
+    """
+    global SEARCH_PROCESSES, SEARCH_PROCESS_CHUNK_SIZE, SEARCH_PROCESS_MIN_MSGS
+    global _search_pool
+    if processes is not None:
+        SEARCH_PROCESSES = processes
+    if chunk_size is not None:
+        SEARCH_PROCESS_CHUNK_SIZE = max(chunk_size, 1)
+    if min_msgs is not None:
+        SEARCH_PROCESS_MIN_MSGS = min_msgs
+    with _pool_lock:
+        search_pool, _search_pool = _search_pool, None
+    if search_pool is not None:
+        search_pool.shutdown(wait=False, cancel_futures=True)
+
+
+####################################################################
+#
+def shutdown_executors() -> None:
+    """
+    Shutdown the thread and process pools, if they have been started.
+    """
+    global _thread_pool, _process_pool, _render_pool, _search_pool
+    with _pool_lock:
+        thread_pool, _thread_pool = _thread_pool, None
+        process_pool, _process_pool = _process_pool, None
+        render_pool, _render_pool = _render_pool, None
+        search_pool, _search_pool = _search_pool, None
+    for pool in (thread_pool, process_pool, render_pool, search_pool):
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+####################################################################
+#
+def default_render_processes() -> int:
+    """
+    The number of FETCH render (or SEARCH) processes to use when a server
+    asks for them to be sized by the machine: one for every CPU we can run on
+    but one, which is left for the user server itself.
+    """
+    return max((os.process_cpu_count() or 1) - 1, 1)
+
+
+####################################################################
+#
+def render_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    The pool of FETCH render processes, started with `workers` processes
+    the first time it is asked for.
+    """
+    global _render_pool
+    with _pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _render_pool
+
+
+####################################################################
+#
+def search_chunks(indices: Sequence[int]) -> list[Sequence[int]] | None:
+    """
+    The chunks a SEARCH that has to look at the messages in `indices` is
+    split in to, to be matched by the SEARCH processes. None if there are no
+    SEARCH processes or too few messages for it to be worth it.
+    """
+    if SEARCH_PROCESSES <= 0 or len(indices) < SEARCH_PROCESS_MIN_MSGS:
+        return None
+    return [
+        indices[i : i + SEARCH_PROCESS_CHUNK_SIZE]
+        for i in range(0, len(indices), SEARCH_PROCESS_CHUNK_SIZE)
+    ]
+
+
+####################################################################
+#
+def search_pool() -> tuple[ProcessPoolExecutor, int]:
+    """
+    The pool of SEARCH processes, started the first time it is asked for,
+    and how many chunks of a SEARCH may be in flight in it at once.
+    """
+    global _search_pool
+    with _pool_lock:
+        if _search_pool is None:
+            _search_pool = ProcessPoolExecutor(
+                max_workers=max(SEARCH_PROCESSES, 1),
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        return _search_pool, max(SEARCH_PROCESSES, 1) * SEARCH_PROCESS_WINDOW
+
+
+####################################################################
+#
+def offloading() -> bool:
+    """
+    True if FETCH's run their per-message work on the thread pool.
+    """
+    return FETCH_THREADS > 0
+
+
+####################################################################
+#
+def _mark_worker() -> None:
+    _worker.active = True
+
+
+####################################################################
+#
+async def run_in_thread[T](fn: Callable[..., T], *args: object) -> T:
+    """
+    Run `fn(*args)` on the thread pool and return its result. If the thread
+    pool is disabled `fn` is called on the event loop.
+
+    `fn` must not touch state that the event loop may be changing while it
+    runs.
+    """
+    global _thread_pool
+    if FETCH_THREADS <= 0:
+        return fn(*args)
+
+    with _pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(
+                max_workers=FETCH_THREADS,
+                thread_name_prefix="asimap-fetch",
+                initializer=_mark_worker,
+            )
+        pool = _thread_pool
+    EXECUTOR_COUNTS["thread"] += 1
+    return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+
+
+####################################################################
+#
+def can_run_in_process() -> bool:
+    """
+    True if `run_in_process()` will actually hand its work to the process
+    pool: there is one, and we are on one of our FETCH threads.
+    """
+    return PARSE_PROCESSES > 0 and getattr(_worker, "active", False)
+
+
+####################################################################
+#
+def run_in_process[T](fn: Callable[..., T], *args: object) -> T:
+    """
+    Run `fn(*args)` in the process pool and wait for its result. `fn` and
+    its arguments and result must be picklable.
+
+    Only threads from our thread pool hand work to the process pool. Called
+    anywhere else (ie: on the event loop, where waiting on a process blocks
+    the loop just as much as doing the work does), or if the process pool is
+    disabled, `fn` is just called.
+    """
+    global _process_pool
+    if not can_run_in_process():
+        return fn(*args)
+
+    with _pool_lock:
+        if _process_pool is None:
+            # Forking a process with threads running is not safe, so the
+            # workers are started by a fork server.
+            #
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context("forkserver"),
+            )
+        pool = _process_pool
+    EXECUTOR_COUNTS["process"] += 1
+    return pool.submit(fn, *args).result()
+
+
+########################################################################
+########################################################################
+#
+class LoopLagMonitor:
+    """
+    Measure how late the event loop runs a callback that was scheduled to run
+    every `interval` seconds. Anything that blocks the event loop shows up as
+    lag.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        """
+        Arguments:
+        - `interval`: How often, in seconds, to sample the event loop's lag.
+        """
+        self.interval = interval
+
+        # Counters for our metrics. These are reset by `reset_stats()`
+        #
+        self.num_samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.num_stalls = 0
+
+    ####################################################################
+    #
+    async def run(self) -> None:
+        """
+        Sample the event loop's lag until cancelled.
+        """
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self.record(max(time.monotonic() - expected, 0.0))
+
+    ####################################################################
+    #
+    def record(self, lag: float) -> None:
+        """
+        Record one sample of the event loop's lag, in seconds.
+        """
+        self.num_samples += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag >= LOOP_LAG_STALL:
+            self.num_stalls += 1
+
+    ####################################################################
+    #
+    def reset_stats(self) -> None:
+        """
+        Reset the counters.
+        """
+        self.num_samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.num_stalls = 0
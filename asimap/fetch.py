@@ -10,10 +10,12 @@ query and generate the body of the `FETCH` response IMAP message.
 #
 import email.utils
 import logging
+from collections import Counter
+from collections.abc import AsyncIterator, Iterator
 from email.header import Header
 from email.message import EmailMessage, Message
-from enum import StrEnum
-from typing import TYPE_CHECKING
+from enum import IntEnum, StrEnum
+from typing import TYPE_CHECKING, Any
 
 # asimap imports
 #
@@ -21,13 +23,34 @@ from .constants import seq_to_flag
 from .exceptions import Bad
 
 if TYPE_CHECKING:
+    from pathlib import Path
+
     from .search import SearchContext
 
 # from .generator import msg_as_string, msg_headers_as_string
-from .generator import msg_as_bytes, msg_headers_as_bytes
+from .generator import RawMsgIndex, msg_as_bytes, msg_headers_as_bytes
 
 logger = logging.getLogger("asimap.fetch")
 
+# Counts of which path was used to generate the response for FETCH's of
+# entire messages: "raw" (the message file sent as is) or "generator" (the
+# message is parsed and rendered.) Logged and cleared by the user server when
+# it dumps its metrics.
+#
+FETCH_BODY_PATHS: Counter[str] = Counter()
+
+# Counts of FETCH commands by the kind of their `FetchPlan` (how much of the
+# messages they needed to look at.) Logged and cleared by the user server
+# when it dumps its metrics.
+#
+FETCH_PLAN_KINDS: Counter[str] = Counter()
+
+# FETCH's of entire messages whose message file is at least this large are
+# sent to the client as a stream of chunks read from the message file instead
+# of being built in memory (see `FetchAtt.stream()`)
+#
+STREAM_LITERAL_THRESHOLD = 1024 * 1024
+
 # A section in a message that can be fetched.
 # XXX `None` indicates the entire message? Or should `Optional` be removed?
 #
@@ -44,6 +67,82 @@ class BadSection(Bad):
         return f"BadSection: {self.value}"
 
 
+########################################################################
+########################################################################
+#
+class FetchLiteral:
+    """
+    The result of a FETCH attribute whose value is a literal too large to
+    build in memory: the attribute name and literal length (ie:
+    `BODY[] {25165824}\\r\\n`) followed by `length` octets that are read
+    from the message file as they are sent to the client.
+    """
+
+    __slots__ = ("prefix", "length", "inconsistent", "_chunks")
+
+    ####################################################################
+    #
+    def __init__(self, prefix: bytes, length: int, chunks: Iterator[bytes]):
+        """
+        Arguments:
+        - `prefix`: The FETCH attribute and literal length
+        - `length`: The number of octets in the literal
+        - `chunks`: Yields the octets of the literal
+        """
+        self.prefix = prefix
+        self.length = length
+        self._chunks = chunks
+
+        # Set if the message file did not give us exactly `length` octets
+        # (it changed out from under us) so the mailbox can be resynced.
+        #
+        self.inconsistent = False
+
+    ####################################################################
+    #
+    def __len__(self) -> int:
+        return len(self.prefix) + self.length
+
+    ####################################################################
+    #
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """
+        Yield exactly `length` octets, the number we promised the client
+        in the literal's prefix.
+
+        If the message file changed out from under us (or went away) there
+        is no way to take back the promise and the client would otherwise
+        read whatever we send next as part of the literal. So what we send
+        is truncated, or padded with spaces, to `length` octets and the
+        literal is marked `inconsistent`.
+        """
+        sent = 0
+        try:
+            for chunk in self._chunks:
+                if sent + len(chunk) > self.length:
+                    chunk = chunk[: self.length - sent]
+                    self.inconsistent = True
+                sent += len(chunk)
+                if chunk:
+                    yield chunk
+                if sent == self.length and self.inconsistent:
+                    break
+        except OSError as exc:
+            logger.warning("Problem reading streamed literal: %s", exc)
+            self.inconsistent = True
+
+        if sent < self.length:
+            self.inconsistent = True
+            yield b" " * (self.length - sent)
+        if self.inconsistent:
+            logger.warning(
+                "Streamed literal did not match the %d octets promised, "
+                "%s sent in its place",
+                self.length,
+                "truncated" if sent == self.length else "padded",
+            )
+
+
 ####################################################################
 #
 def header_or_nil(msg: Message, field: str) -> bytes:
@@ -186,6 +285,19 @@ class FetchAtt:
             f"{__name__}.{self.__class__.__name__}.{actual_command}"
         )
 
+    #######################################################################
+    #
+    def __getstate__(self) -> dict[str, Any]:
+        """
+        FetchAtt's are sent to FETCH worker processes (see
+        `asimap.fetch_worker`.) The context of the last message we fetched
+        refers to its mailbox, which can not be, and does not need to be,
+        pickled.
+        """
+        state = self.__dict__.copy()
+        state.pop("ctx", None)
+        return state
+
     #######################################################################
     #
     def __repr__(self) -> str:
@@ -255,18 +367,47 @@ class FetchAtt:
         """
         self.ctx = ctx
 
+        # ENVELOPE, BODY, and BODYSTRUCTURE do not change unless the message
+        # file does. If they are in the message's persisted metadata (which
+        # is only loaded if the file still matches) we do not need to even
+        # open the message file.
+        #
+        # (RFC822.SIZE and INTERNALDATE are served from the metadata by the
+        # SearchContext.)
+        #
+        metadata = ctx.metadata
+        metadata_attr = self.metadata_attr()
+        if metadata and self.attribute in (
+            FetchOp.ENVELOPE,
+            FetchOp.BODYSTRUCTURE,
+        ):
+            cached = getattr(metadata, metadata_attr)  # type: ignore[arg-type]
+            if cached is not None:
+                return bytes(self) + b" " + cached
+
         # Based on the operation figure out what subroutine does the rest
         # of the work.
         #
         result: bytes | int
         match self.attribute:
-            case (
-                FetchOp.BODY
-                | FetchOp.BODYSTRUCTURE
-                | FetchOp.ENVELOPE
-                | FetchOp.RFC822_SIZE
-            ):
-                msg = self.ctx.msg()
+            case FetchOp.BODY if self.partial:
+                result = self._partial_body()
+            case FetchOp.BODY if not self.section:
+                # A FETCH of the entire message. If the message file passes
+                # our checks we send it as is, otherwise we parse and render
+                # it.
+                #
+                raw_msg = ctx.raw_msg()
+                if raw_msg is not None:
+                    path = "raw"
+                    result = self._literal(raw_msg)
+                else:
+                    path = "generator"
+                    result = self.body(self.ctx.msg(), self.section)
+                FETCH_BODY_PATHS[path] += 1
+                self.log.debug("%s: %s path", ctx, path)
+            case FetchOp.BODY | FetchOp.BODYSTRUCTURE | FetchOp.ENVELOPE:
+                msg = self._section_msg()
                 try:
                     match self.attribute:
                         case FetchOp.BODY:
@@ -278,8 +419,6 @@ class FetchAtt:
                             result = self.bodystructure(msg)
                         case FetchOp.ENVELOPE:
                             result = self.envelope(msg)
-                        case FetchOp.RFC822_SIZE:
-                            result = str(ctx.msg_size()).encode("latin-1")
                 except UnicodeEncodeError as e:
                     logger.error(
                         (
@@ -291,6 +430,10 @@ class FetchAtt:
                         e,
                     )
                     raise
+                if metadata and metadata_attr:
+                    metadata.set(metadata_attr, result)
+            case FetchOp.RFC822_SIZE:
+                result = str(ctx.msg_size()).encode("latin-1")
             case FetchOp.FLAGS:
                 flags = " ".join([seq_to_flag(x) for x in self.ctx.sequences])
                 result = f"({flags})".encode("latin-1")
@@ -314,6 +457,24 @@ class FetchAtt:
 
         return bytes(self) + b" " + result
 
+    ####################################################################
+    #
+    def metadata_attr(self) -> str | None:
+        """
+        The name of the `MsgMetadata` attribute the result of this fetch is
+        stored in, or None if the result of this fetch is not persisted.
+        """
+        match self.attribute:
+            case FetchOp.ENVELOPE:
+                return "envelope"
+            case FetchOp.BODYSTRUCTURE:
+                return "bodystructure" if self.ext_data else "body"
+            case FetchOp.RFC822_SIZE:
+                return "size"
+            case FetchOp.INTERNALDATE:
+                return "internaldate"
+        return None
+
     ####################################################################
     #
     def _single_section(
@@ -448,8 +609,181 @@ class FetchAtt:
         Fetch the appropriate section of the message, flatten into a string
         and return it to the user.
         """
-        msg_text = self._body(msg, section)
+        return self._literal(self._body(msg, section))
+
+    ####################################################################
+    #
+    def stream(self, ctx: "SearchContext") -> FetchLiteral | None:
+        """
+        If this is a FETCH of an entire message that is large enough (see
+        `STREAM_LITERAL_THRESHOLD`) and can be sent as is, return it as a
+        `FetchLiteral` whose octets are read from the message file as they
+        are sent. Otherwise return None and the caller should use
+        `fetch()`.
+        """
+        if (
+            self.attribute != FetchOp.BODY
+            or self.section
+            or self.partial
+            or ctx.path.stat().st_size < STREAM_LITERAL_THRESHOLD
+        ):
+            return None
+
+        self.ctx = ctx
+        raw_index = ctx.raw_index()
+        if not raw_index.valid:
+            return None
+
+        FETCH_BODY_PATHS["streamed"] += 1
+        self.log.debug("%s: streamed path, %d octets", ctx, raw_index.size)
+        prefix = bytes(self) + b" {%d}\r\n" % raw_index.size
+        return FetchLiteral(
+            prefix, raw_index.size, self._stream_chunks(ctx.path, raw_index)
+        )
+
+    ####################################################################
+    #
+    @staticmethod
+    def _stream_chunks(path: "Path", raw_index: RawMsgIndex) -> Iterator[bytes]:
+        """
+        Yield the entire message file, with its line endings converted, in
+        chunks. The file is only opened once we start sending it.
+        """
+        with open(path, "rb") as f:
+            yield from raw_index.iter_range(f, 0, raw_index.size)
+
+    ####################################################################
+    #
+    def _section_msg(self) -> EmailMessage:
+        """
+        The message to fetch our attribute from. ENVELOPE and the top level
+        header sections (`HEADER`, `HEADER.FIELDS`, `HEADER.FIELDS.NOT`) only
+        need the message's headers, so for them we avoid parsing the body
+        (see `SearchContext.headers()`). Everything else gets the entire
+        parsed message.
+        """
+        if self.attribute == FetchOp.ENVELOPE:
+            return self.ctx.headers()
+
+        if self.header_section():
+            headers = self.ctx.headers()
+            # The HEADER of a message/rfc822 message is the headers of the
+            # message it contains, so we need to parse the body.
+            #
+            if (
+                isinstance(self.section[0], str)  # type: ignore[index]
+                and headers.get_content_type() == "message/rfc822"
+            ):
+                return self.ctx.msg()
+            return headers
+
+        return self.ctx.msg()
+
+    ####################################################################
+    #
+    def header_section(self) -> bool:
+        """
+        True if this is a FETCH of one of the top level header sections:
+        `HEADER`, `HEADER.FIELDS`, or `HEADER.FIELDS.NOT`.
+        """
+        if self.attribute != FetchOp.BODY or len(self.section or []) != 1:
+            return False
+        section = self.section[0]  # type: ignore[index]
+        if isinstance(section, list | tuple):
+            return section[0].upper() in ("HEADER.FIELDS", "HEADER.FIELDS.NOT")
+        return isinstance(section, str) and section.upper() == "HEADER"
+
+    ####################################################################
+    #
+    def plan_kind(self) -> "FetchPlanKind":
+        """
+        What this FETCH attribute needs to look at to be answered (see
+        `FetchPlan`)
+        """
+        match self.attribute:
+            case FetchOp.FLAGS | FetchOp.UID:
+                return FetchPlanKind.FLAGS_UID
+            case (
+                FetchOp.RFC822_SIZE
+                | FetchOp.INTERNALDATE
+                | FetchOp.ENVELOPE
+                | FetchOp.BODYSTRUCTURE
+            ):
+                return FetchPlanKind.METADATA
+        if self.header_section():
+            return FetchPlanKind.HEADERS
+        return FetchPlanKind.BODY
+
+    ####################################################################
+    #
+    def fetch_or_stream(
+        self, ctx: "SearchContext", stream_literals: bool = False
+    ) -> bytes | FetchLiteral:
+        """
+        `fetch()` this attribute, unless `stream_literals` is set and it is a
+        FETCH that `stream()` returns a literal for.
+        """
+        literal = self.stream(ctx) if stream_literals else None
+        return self.fetch(ctx) if literal is None else literal
+
+    ####################################################################
+    #
+    def fetch_from_state(self, uid: int, sequences: list[str]) -> bytes:
+        """
+        Answer a FLAGS or UID FETCH from the mailbox's in-memory state: the
+        message's UID and the sequences it is in. No SearchContext needed.
+        """
+        match self.attribute:
+            case FetchOp.FLAGS:
+                flags = " ".join([seq_to_flag(x) for x in sequences])
+                result = f"({flags})".encode("latin-1")
+            case FetchOp.UID:
+                result = str(uid).encode("latin-1")
+            case _:
+                raise ValueError(f"{self} can not be answered from state")
+        return bytes(self) + b" " + result
+
+    ####################################################################
+    #
+    def _partial_body(self) -> bytes:
+        """
+        Fetch a piece (`<start.length>`) of a message or message section.
+
+        Clients fetch large messages and attachments as a series of these,
+        so each piece should only cost its own length, not the length of
+        the entire message:
+
+        - a piece of the entire message is read from the message file via
+          its `RawMsgIndex`, if the message can be sent as is.
+        - otherwise the section is rendered once and kept in the mailbox's
+          section cache for the following pieces.
+        """
+        assert self.partial
+        ctx = self.ctx
+        if not self.section:
+            raw_index = ctx.raw_index()
+            path = "raw" if raw_index.valid else "generator"
+            FETCH_BODY_PATHS[path] += 1
+            self.log.debug("%s: %s path, partial: %s", ctx, path, self.partial)
+            if raw_index.valid:
+                with open(ctx.path, "rb") as f:
+                    msg_text = raw_index.read_range(f, *self.partial)
+                return (f"{{{len(msg_text)}}}\r\n").encode("latin-1") + msg_text
+
+        msg_text = ctx.mailbox.get_rendered_section(
+            ctx.msg_key,
+            repr(self.section),
+            lambda: self._body(self._section_msg(), self.section),
+        )
+        return self._literal(msg_text)
 
+    ####################################################################
+    #
+    def _literal(self, msg_text: bytes) -> bytes:
+        """
+        Make sure the text ends with a CRLF, apply any partial, and return
+        it as an IMAP literal.
+        """
         # We need to always terminate with crlf.
         #
         msg_text = (
@@ -839,3 +1173,94 @@ class FetchAtt:
             result.append(x)
 
         return b"(" + b" ".join(result) + b")"
+
+
+########################################################################
+########################################################################
+#
+class FetchPlanKind(IntEnum):
+    """
+    What a FETCH needs to look at, from cheapest to most expensive. A FETCH
+    command is as expensive as the most expensive of its attributes.
+    """
+
+    # Answered from the mailbox's in-memory uids and sequences
+    #
+    FLAGS_UID = 0
+    # Answered from the persisted message metadata (computed once per
+    # message)
+    #
+    METADATA = 1
+    # Needs the message's header block
+    #
+    HEADERS = 2
+    # Needs the message's body
+    #
+    BODY = 3
+
+
+########################################################################
+########################################################################
+#
+class FetchPlan:
+    """
+    The analysis of the FETCH attributes of a FETCH command, done once per
+    command and used for every message the command fetches.
+
+    Client sync loops issue `UID FETCH 1:* (FLAGS)` constantly. A FETCH
+    that only asks for FLAGS and UID's is answered straight from the
+    mailbox's in-memory state, without building a `SearchContext`, or
+    touching a message file.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, fetch_ops: list[FetchAtt], uid_cmd: bool = False):
+        """
+        Arguments:
+        - `fetch_ops`: The FETCH attributes of the command
+        - `uid_cmd`: If this is a UID FETCH. The response to a UID FETCH
+          always includes the message's UID, whether it was asked for or not.
+        """
+        self.fetch_ops = list(fetch_ops)
+        if uid_cmd and not any(
+            op.attribute == FetchOp.UID for op in self.fetch_ops
+        ):
+            self.fetch_ops.append(FetchAtt(FetchOp.UID))
+
+        self.kind = max(
+            (op.plan_kind() for op in self.fetch_ops),
+            default=FetchPlanKind.FLAGS_UID,
+        )
+
+        # A FETCH of FLAGS removes the `\Recent` flag, and a FETCH of a
+        # BODY (but not a BODY.PEEK) sets the `\Seen` flag.
+        #
+        self.fetches_flags = any(
+            op.attribute == FetchOp.FLAGS for op in self.fetch_ops
+        )
+        self.marks_seen = any(
+            op.attribute == FetchOp.BODY and not op.peek
+            for op in self.fetch_ops
+        )
+        self.needs_metadata = any(op.metadata_attr() for op in self.fetch_ops)
+
+    ####################################################################
+    #
+    def fetch(
+        self, ctx: "SearchContext", stream_literals: bool = False
+    ) -> list[bytes | FetchLiteral]:
+        """
+        Fetch all of the attributes for the message `ctx` refers to. This
+        blocks, and is what FETCH's run on a FETCH thread (see
+        `asimap.executor`)
+        """
+        return [
+            op.fetch_or_stream(ctx, stream_literals) for op in self.fetch_ops
+        ]
+
+    ####################################################################
+    #
+    def __str__(self) -> str:
+        ops = " ".join(op.dbg(show_peek=True) for op in self.fetch_ops)
+        return f"<FetchPlan {self.kind.name}: {ops}>"
@@ -0,0 +1,153 @@
+"""
+Rendering FETCH responses in worker processes.
+
+A new client syncing a large mailbox (ie: `FETCH 1:* (BODY.PEEK[])`) keeps
+the user server busy on one core parsing and rendering messages. When a
+server has FETCH render processes (see `executor.render_pool()`), large
+FETCH's send batches of messages, along with the FETCH's `FetchPlan`, to
+them. A worker reads and renders the messages in a batch and sends back the
+FETCH results for each one. The user server sends them on to the client in
+message sequence order (see `Mailbox.fetch()`)
+
+Everything sent to and from a worker is pickled, so a batch carries what
+the worker needs from the mailbox's in-memory state: each message's UID and
+the sequences it is in.
+"""
+
+# system imports
+#
+import email.policy
+import logging
+from email import message_from_binary_file
+
+# Project imports
+#
+from .fetch import FetchPlan
+from .mh import MH
+from .msg_files import MessageFiles
+from .search import MsgMetadata, SearchContext
+
+logger = logging.getLogger("asimap.fetch_worker")
+
+# A FETCH of one message: its message sequence number, message key, UID,
+# the sequences it is in, and its persisted metadata (if the FETCH uses it.)
+#
+type FetchJob = tuple[int, int, int, list[str], MsgMetadata | None]
+
+# The result of a FetchJob: the message sequence number, the FETCH results
+# (in the order of the plan's attributes) and the message's metadata with
+# anything we computed filled in. A result is None if it is a literal the
+# user server should stream to the client itself (see `FetchAtt.stream()`)
+#
+type FetchJobResult = tuple[int, list[bytes | None], MsgMetadata | None]
+
+# The folders this worker has rendered (or searched) messages from, by path.
+# Kept so their caches live from one batch to the next.
+#
+_FOLDERS: dict[str, "WorkerFolder"] = {}
+
+
+########################################################################
+########################################################################
+#
+class WorkerFolder(MessageFiles):
+    """
+    The message files of a mailbox as seen by a worker process. The UID's
+    and sequences of the messages come with each batch.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, path: str, name: str):
+        """
+        Arguments:
+        - `path`: The path to the mailbox's MH folder
+        - `name`: The name of the mailbox
+        """
+        folder = MH(
+            path,
+            factory=lambda f: message_from_binary_file(
+                f, policy=email.policy.default
+            ),
+            create=False,
+        )
+        super().__init__(folder, name)
+        self.uid_vv = 0
+        self.uids: dict[int, int] = {}
+        self.seqs: dict[int, list[str]] = {}
+
+    ####################################################################
+    #
+    def get_uid_from_msg(self, msg_key: int) -> tuple[int | None, int | None]:
+        """
+        The (uid_vv, uid) of the message, from the current batch.
+        """
+        return (self.uid_vv, self.uids.get(msg_key))
+
+    ####################################################################
+    #
+    def msg_sequences(self, msg_key: int) -> list[str]:
+        """
+        The sequences the message is in, from the current batch.
+        """
+        return self.seqs.get(msg_key, [])
+
+
+####################################################################
+#
+def worker_folder(path: str, name: str) -> WorkerFolder:
+    """
+    The WorkerFolder for the mailbox at `path`, made the first time this
+    worker is asked for it.
+    """
+    folder = _FOLDERS.get(path)
+    if folder is None:
+        folder = _FOLDERS[path] = WorkerFolder(path, name)
+    return folder
+
+
+####################################################################
+#
+def render_fetch_batch(
+    path: str,
+    name: str,
+    uid_vv: int,
+    seq_max: int,
+    uid_max: int,
+    plan: FetchPlan,
+    jobs: list[FetchJob],
+    stream_literals: bool,
+) -> list[FetchJobResult]:
+    """
+    Run in a worker process: FETCH the attributes in `plan` for each of the
+    messages in `jobs`.
+
+    Arguments:
+    - `path`: The path to the mailbox's MH folder
+    - `name`: The name of the mailbox
+    - `uid_vv`: The mailbox's UID validity value
+    - `seq_max`: The largest message sequence number in the mailbox
+    - `uid_max`: The largest UID in the mailbox
+    - `plan`: What to FETCH
+    - `jobs`: The messages to FETCH
+    - `stream_literals`: If True, literals that the user server would stream
+      to the client are left for it to stream (their result is None)
+    """
+    folder = worker_folder(path, name)
+    folder.uid_vv = uid_vv
+    folder.uids = {msg_key: uid for _, msg_key, uid, _, _ in jobs}
+    folder.seqs = {msg_key: seqs for _, msg_key, _, seqs, _ in jobs}
+
+    results: list[FetchJobResult] = []
+    for msg_seq_num, msg_key, _, _, metadata in jobs:
+        ctx = SearchContext(
+            folder, msg_key, msg_seq_num, seq_max, uid_max, metadata=metadata
+        )
+        fetched: list[bytes | None] = []
+        for op in plan.fetch_ops:
+            if stream_literals and op.stream(ctx) is not None:
+                fetched.append(None)
+            else:
+                fetched.append(op.fetch(ctx))
+        results.append((msg_seq_num, fetched, metadata))
+    return results
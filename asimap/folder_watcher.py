@@ -0,0 +1,322 @@
+"""
+Noticing changes to MH folders as they happen, with Linux's inotify.
+
+Without it every active mailbox's management task stats its folder every
+few seconds, whether anything has changed or not, and new mail only shows
+up in IDLE when the next poll comes around. The `FolderWatcher` watches the
+directory of each folder (which also covers the `.mh_sequences` file in it)
+and tells the user server which folders had messages or sequences added,
+changed, or removed. A burst of events (a sync tool dropping thousands of
+messages in a folder) is collapsed in to a single report per folder.
+
+inotify is used through ctypes so there is nothing to install. On systems
+without it (or if we run out of inotify watches) the mailboxes that are not
+being watched poll as they always have.
+"""
+
+# system imports
+#
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+from collections import Counter
+from collections.abc import Callable
+from pathlib import Path
+
+logger = logging.getLogger("asimap.folder_watcher")
+
+# Watch folders with inotify if we can. Can be changed via
+# `set_watch_folders()`.
+#
+WATCH_FOLDERS = True
+
+# How long, in seconds, to wait after the first event on a folder for more
+# events before reporting the folder as changed.
+#
+WATCH_DEBOUNCE = 0.05
+
+# Counts of what the folder watchers have seen: "events" read from inotify,
+# "reports" of changed folders, and "overflows" of inotify's event queue
+# (after which every watched folder is reported as changed.) Logged and
+# cleared by the user server when it dumps its metrics.
+#
+WATCHER_COUNTS: Counter[str] = Counter()
+
+# From <sys/inotify.h>
+#
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Messages being added (written, linked, or renamed in to place), removed,
+# and the `.mh_sequences` file being rewritten. And the folder itself going
+# away.
+#
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+)
+
+_EVENT = struct.Struct("iIII")
+
+_libc: ctypes.CDLL | None = None
+
+
+####################################################################
+#
+def set_watch_folders(enabled: bool) -> None:
+    """
+    Turn watching folders with inotify on or off. Only affects watchers
+    that have not been started yet.
+    """
+    global WATCH_FOLDERS
+    WATCH_FOLDERS = enabled
+
+
+####################################################################
+#
+def _inotify() -> ctypes.CDLL | None:
+    """
+    The C library, if it has inotify. None if it does not.
+    """
+    global _libc
+    if _libc is None and sys.platform.startswith("linux"):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            libc.inotify_init1.argtypes = [ctypes.c_int]
+            libc.inotify_add_watch.argtypes = [
+                ctypes.c_int,
+                ctypes.c_char_p,
+                ctypes.c_uint32,
+            ]
+            libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+            _libc = libc
+        except (OSError, AttributeError) as e:
+            logger.info("inotify is not available: %s", e)
+    return _libc
+
+
+########################################################################
+########################################################################
+#
+class FolderWatcher:
+    """
+    Watch the MH folders under a mail directory and report, through a
+    callback, the names of the folders that changed.
+    """
+
+    ####################################################################
+    #
+    def __init__(
+        self,
+        maildir: Path,
+        on_change: Callable[[set[str]], None],
+        debounce: float = WATCH_DEBOUNCE,
+    ):
+        """
+        Arguments:
+        - `maildir`: The MH mail directory the folders are in
+        - `on_change`: Called with the names of the folders that changed
+        - `debounce`: How long to wait for more events before calling
+          `on_change`
+        """
+        self.maildir = maildir
+        self.on_change = on_change
+        self.debounce = debounce
+        self.fd: int | None = None
+        self.wds: dict[int, str] = {}
+        self.names: dict[str, int] = {}
+        self.changed: set[str] = set()
+        self._report_handle: asyncio.TimerHandle | None = None
+
+    ####################################################################
+    #
+    @property
+    def enabled(self) -> bool:
+        """
+        True if we are watching folders with inotify.
+        """
+        return self.fd is not None
+
+    ####################################################################
+    #
+    def start(self) -> bool:
+        """
+        Start reading inotify events on the running event loop. Returns True
+        if we are watching folders, False if folders will have to be polled.
+        """
+        if self.fd is not None or not WATCH_FOLDERS:
+            return self.enabled
+        libc = _inotify()
+        if libc is None:
+            return False
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            logger.warning("inotify_init1 failed: %s", os.strerror(err))
+            return False
+        self.fd = fd
+        asyncio.get_running_loop().add_reader(fd, self._read_events)
+        logger.info("Watching folders under '%s' with inotify", self.maildir)
+        return True
+
+    ####################################################################
+    #
+    def close(self) -> None:
+        """
+        Stop watching all folders.
+        """
+        if self.fd is None:
+            return
+        if self._report_handle is not None:
+            self._report_handle.cancel()
+            self._report_handle = None
+        try:
+            asyncio.get_running_loop().remove_reader(self.fd)
+        except RuntimeError:
+            pass
+        os.close(self.fd)
+        self.fd = None
+        self.wds = {}
+        self.names = {}
+        self.changed = set()
+
+    ####################################################################
+    #
+    def watch(self, name: str) -> bool:
+        """
+        Watch the folder `name` if we are not already. Returns True if the
+        folder is being watched.
+        """
+        if name in self.names:
+            return True
+        if self.fd is None or not name:
+            return False
+        libc = _inotify()
+        assert libc is not None
+        path = os.fsencode(self.maildir / name)
+        wd = libc.inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            logger.warning(
+                "Can not watch folder '%s', it will be polled: %s",
+                name,
+                os.strerror(err),
+            )
+            return False
+
+        # Watching a directory we already watch (ie: under a name it had
+        # before it was renamed) gives back the same watch.
+        #
+        if old_name := self.wds.get(wd):
+            del self.names[old_name]
+        self.wds[wd] = name
+        self.names[name] = wd
+        return True
+
+    ####################################################################
+    #
+    def watching(self, name: str) -> bool:
+        """
+        True if the folder `name` is being watched.
+        """
+        return name in self.names
+
+    ####################################################################
+    #
+    def _forget(self, wd: int) -> None:
+        """
+        Forget a watch that inotify has removed.
+        """
+        name = self.wds.pop(wd, None)
+        if name is not None and self.names.get(name) == wd:
+            del self.names[name]
+
+    ####################################################################
+    #
+    def _read_events(self) -> None:
+        """
+        Called by the event loop when there are inotify events to read.
+        Notes which folders changed, and schedules reporting them.
+        """
+        if self.fd is None:
+            return
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset + _EVENT.size <= len(data):
+            wd, mask, _, length = _EVENT.unpack_from(data, offset)
+            name = data[
+                offset + _EVENT.size : offset + _EVENT.size + length
+            ].rstrip(b"\0")
+            offset += _EVENT.size + length
+            WATCHER_COUNTS["events"] += 1
+
+            if mask & IN_Q_OVERFLOW:
+                WATCHER_COUNTS["overflows"] += 1
+                self.changed.update(self.names)
+                continue
+            if mask & IN_IGNORED:
+                self._forget(wd)
+                continue
+
+            # The folder itself was removed or renamed. Whoever did that
+            # deals with its mailbox. If it was renamed it will be watched
+            # under its new name when it is next looked at.
+            #
+            if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                self._forget(wd)
+                continue
+
+            # We only care about messages and the sequences file. Not
+            # sub-folders, lock files or anything else.
+            #
+            if not (name.isdigit() or name == b".mh_sequences"):
+                continue
+            if folder := self.wds.get(wd):
+                self.changed.add(folder)
+
+        if self.changed and self._report_handle is None:
+            self._report_handle = asyncio.get_running_loop().call_later(
+                self.debounce, self._report
+            )
+
+    ####################################################################
+    #
+    def _report(self) -> None:
+        """
+        Tell our caller which folders have changed since the last report.
+        """
+        self._report_handle = None
+        changed, self.changed = self.changed, set()
+        if not changed:
+            return
+        WATCHER_COUNTS["reports"] += 1
+        try:
+            self.on_change(changed)
+        except Exception as e:
+            logger.exception("Problem reporting changed folders: %s", e)
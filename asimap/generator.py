@@ -8,7 +8,12 @@ size.
 
 # system imports
 #
+import codecs
 import logging
+import re
+from array import array
+from bisect import bisect_right
+from collections.abc import Iterator
 from copy import deepcopy
 from email.generator import BytesGenerator, Generator
 from email.message import Message
@@ -16,10 +21,23 @@ from email.policy import HTTP, SMTP, EmailPolicy, Policy
 from io import BytesIO, StringIO
 from typing import Any, BinaryIO, TextIO
 
+# Project imports
+#
+from .utils import encoding_search_fn
+
 logger = logging.getLogger("asimap.generator")
 
 SMTP_LONG_LINES = SMTP.clone(max_line_length=None)
 
+# When converting raw message files to CRLF line endings we read them in
+# chunks of this size.
+#
+CRLF_CHUNK_SIZE = 65536
+
+# A raw message is only sent as is if it starts with a header field.
+#
+RAW_HEADER_RE = re.compile(rb"[!-9;-~]+:")
+
 
 ########################################################################
 ########################################################################
@@ -532,6 +550,57 @@ def msg_as_string(msg: Message, headers: bool = True) -> str:
     return _msg_as_string(msg, headers=headers)
 
 
+####################################################################
+#
+def decode_text_part(part: Message) -> str:
+    """
+    The content of a non-multipart text part with its content transfer
+    encoding and charset decoded.
+
+    Charsets python does not know go through `encoding_search_fn()` (the
+    same mapping the user server registers for the email package) and
+    finally latin-1, which decodes any bytes. Bytes that are invalid in the
+    charset are replaced rather than failing the whole message.
+    """
+    payload = part.get_payload(decode=True)
+    if not isinstance(payload, bytes):
+        return ""
+    charset = (part.get_content_charset() or "us-ascii").lower()
+    try:
+        codec = codecs.lookup(charset)
+    except LookupError:
+        # Search functions are given the name the way `codecs.lookup()`
+        # normalizes it.
+        #
+        name = charset.replace("-", "_").replace(" ", "_")
+        codec = encoding_search_fn(name) or codecs.lookup("latin-1")
+    return codec.decode(payload, "replace")[0]
+
+
+####################################################################
+#
+def msg_search_text(msg: Message) -> tuple[str, str]:
+    """
+    The text of a message that SEARCH BODY and TEXT look in, lowercased:
+    its headers and the headers of all of its MIME parts (decoded, so TEXT
+    finds attachment filenames), and the decoded content of its text parts.
+    The content of non-text parts (images, attachments, etc) is skipped.
+
+    Returns a tuple of (headers, body)
+    """
+    headers = "\n".join(
+        f"{name}: {value}"
+        for part in msg.walk()
+        for name, value in part.items()
+    )
+    body = [
+        decode_text_part(part)
+        for part in msg.walk()
+        if not part.is_multipart() and part.get_content_maintype() == "text"
+    ]
+    return headers.lower(), "\n".join(body).lower()
+
+
 ####################################################################
 #
 def _msg_as_bytes(msg: Message, render_headers: bool = True) -> bytes:
@@ -699,3 +768,258 @@ def msg_headers_as_string(
         g.flatten(msg)
 
     return fp.getvalue()
+
+
+####################################################################
+#
+def crlf_chunks(
+    fp: BinaryIO, chunk_size: int = CRLF_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Read the binary file `fp` in chunks, yielding each chunk with its line
+    endings (LF, CRLF, or a bare CR) converted to CRLF.
+
+    A CR at the end of a chunk is held back until we see the next chunk so
+    that a CRLF split across two chunks is not turned in to two line
+    endings.
+    """
+    carry = b""
+    while chunk := fp.read(chunk_size):
+        data = carry + chunk
+        carry = b""
+        if data.endswith(b"\r"):
+            carry = b"\r"
+            data = data[:-1]
+        yield _to_crlf(data)
+    if carry:
+        yield b"\r\n"
+
+
+####################################################################
+#
+def _to_crlf(data: bytes) -> bytes:
+    """
+    Convert all line endings in `data` (LF, CRLF, or a bare CR) to CRLF.
+    """
+    return (
+        data.replace(b"\r\n", b"\n")
+        .replace(b"\r", b"\n")
+        .replace(b"\n", b"\r\n")
+    )
+
+
+####################################################################
+#
+def raw_msg_as_bytes(fp: BinaryIO) -> bytes | None:
+    """
+    Return the raw bytes of a message file with its line endings converted
+    to CRLF, without parsing the message. This is what we send for a FETCH
+    of the entire message (`BODY[]`, `RFC822`, etc.)
+
+    Returns None if the message fails our cheap validity checks, in which
+    case the caller should fall back to parsing the message and rendering it
+    with `msg_as_bytes()`. The checks are:
+    - the message does not contain any NUL characters
+    - the message begins with a header field
+    - the header block is 7-bit clean
+
+    Args:
+        fp: The message file, opened in binary mode.
+
+    Returns:
+        The message bytes, always ending with ``b"\\r\\n"``, or None.
+    """
+    chunks = []
+    for chunk in crlf_chunks(fp):
+        if b"\0" in chunk:
+            return None
+        chunks.append(chunk)
+    msg_bytes = b"".join(chunks)
+
+    if not RAW_HEADER_RE.match(msg_bytes):
+        return None
+    hdr_end = msg_bytes.find(b"\r\n\r\n")
+    headers = msg_bytes if hdr_end == -1 else msg_bytes[:hdr_end]
+    if not headers.isascii():
+        return None
+
+    return msg_bytes if msg_bytes.endswith(b"\r\n") else msg_bytes + b"\r\n"
+
+
+########################################################################
+########################################################################
+#
+class RawMsgIndex:
+    """
+    An index of a message file that lets us serve any byte range of the
+    message as `raw_msg_as_bytes()` would return it, without converting the
+    entire file.
+
+    IMAP clients fetch large messages in pieces (`BODY.PEEK[]<0.65536>`,
+    `BODY.PEEK[]<65536.65536>`, ...) If every one of those converted the
+    entire message file to CRLF line endings, fetching a message would be
+    O(n^2) in its size. Instead we build this index once, when we scan the
+    message file for the `raw_msg_as_bytes()` validity checks, and record
+    checkpoints pairing offsets in the converted message with offsets in the
+    message file. A range is served by seeking to the checkpoint before its
+    start and converting from there, so the work done is proportional to
+    the length of the range (plus at most one chunk.)
+
+    A checkpoint is only recorded where the conversion does not have a CR
+    held back, so converting from a checkpoint gives exactly the same bytes
+    as converting the whole file would have.
+    """
+
+    __slots__ = ("valid", "size", "_conv_offsets", "_file_offsets", "_tail")
+
+    ####################################################################
+    #
+    def __init__(
+        self,
+        valid: bool,
+        size: int = 0,
+        conv_offsets: array | None = None,
+        file_offsets: array | None = None,
+        tail: bytes = b"",
+    ):
+        """
+        Arguments:
+        - `valid`: False if the message failed the `raw_msg_as_bytes()`
+                   checks. An invalid index can not serve ranges.
+        - `size`: The size of the message with its line endings converted
+        - `conv_offsets`: Checkpoint offsets in the converted message
+        - `file_offsets`: The matching checkpoint offsets in the file
+        - `tail`: What we add to the end of the converted message to make
+                  sure it ends with a CRLF.
+        """
+        self.valid = valid
+        self.size = size
+        self._conv_offsets = (
+            array("q", [0]) if conv_offsets is None else conv_offsets
+        )
+        self._file_offsets = (
+            array("q", [0]) if file_offsets is None else file_offsets
+        )
+        self._tail = tail
+
+    ####################################################################
+    #
+    @property
+    def nbytes(self) -> int:
+        """
+        Roughly how much memory this index uses. Used when caching it.
+        """
+        return 64 + 16 * len(self._conv_offsets)
+
+    ####################################################################
+    #
+    @classmethod
+    def build(
+        cls, fp: BinaryIO, chunk_size: int = CRLF_CHUNK_SIZE
+    ) -> "RawMsgIndex":
+        """
+        Scan the message file `fp` and build an index for it. This applies
+        the same validity checks as `raw_msg_as_bytes()`.
+        """
+        conv_offsets = array("q", [0])
+        file_offsets = array("q", [0])
+        conv_off = 0
+        file_off = 0
+        carry = b""
+        last = b""
+        headers = b""
+        in_headers = True
+
+        while chunk := fp.read(chunk_size):
+            file_off += len(chunk)
+            data = carry + chunk
+            carry = b""
+            if data.endswith(b"\r"):
+                carry = b"\r"
+                data = data[:-1]
+            data = _to_crlf(data)
+            if b"\0" in data:
+                return cls(False)
+
+            # Accumulate the header block (plus a bit) so we can check it
+            # the same way `raw_msg_as_bytes()` does.
+            #
+            if in_headers:
+                headers += data
+                if b"\r\n\r\n" in headers:
+                    in_headers = False
+                    if not cls._headers_ok(headers):
+                        return cls(False)
+
+            conv_off += len(data)
+            if data:
+                last = (last + data)[-2:]
+            if not carry:
+                conv_offsets.append(conv_off)
+                file_offsets.append(file_off)
+
+        if carry:
+            conv_off += 2
+            last = b"\r\n"
+        if in_headers and not cls._headers_ok(headers):
+            return cls(False)
+
+        tail = b"" if last == b"\r\n" else b"\r\n"
+        return cls(True, conv_off + len(tail), conv_offsets, file_offsets, tail)
+
+    ####################################################################
+    #
+    @staticmethod
+    def _headers_ok(msg_bytes: bytes) -> bool:
+        """
+        The header checks from `raw_msg_as_bytes()`: the message begins
+        with a header field and the header block is 7-bit clean.
+        """
+        if not RAW_HEADER_RE.match(msg_bytes):
+            return False
+        hdr_end = msg_bytes.find(b"\r\n\r\n")
+        headers = msg_bytes if hdr_end == -1 else msg_bytes[:hdr_end]
+        return headers.isascii()
+
+    ####################################################################
+    #
+    def read_range(self, fp: BinaryIO, start: int, length: int) -> bytes:
+        """
+        Return `length` bytes starting at `start` of the message file `fp`
+        with its line endings converted to CRLF. Like slicing, a range that
+        extends past the end of the message is truncated.
+        """
+        return b"".join(self.iter_range(fp, start, length))
+
+    ####################################################################
+    #
+    def iter_range(
+        self, fp: BinaryIO, start: int, length: int
+    ) -> Iterator[bytes]:
+        """
+        Like `read_range()` but yields the range in chunks (of roughly
+        `CRLF_CHUNK_SIZE`) as they are read from the message file.
+        """
+        if not self.valid:
+            raise ValueError("Can not read ranges using an invalid index")
+        end = min(start + length, self.size)
+        if start >= end:
+            return
+
+        i = bisect_right(self._conv_offsets, start) - 1
+        conv_off = self._conv_offsets[i]
+        fp.seek(self._file_offsets[i])
+
+        if conv_off < end:
+            for chunk in crlf_chunks(fp):
+                chunk_end = conv_off + len(chunk)
+                if chunk_end > start:
+                    yield chunk[max(start - conv_off, 0) : end - conv_off]
+                conv_off = chunk_end
+                if conv_off >= end:
+                    break
+
+        # The CRLF we add if the message file does not end with one.
+        #
+        if self._tail and end > conv_off:
+            yield self._tail[max(start - conv_off, 0) : end - conv_off]
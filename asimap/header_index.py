@@ -0,0 +1,344 @@
+"""
+An index, in the user server's db, of the headers that clients search on
+the most: the address headers, Subject, Message-ID, In-Reply-To and
+References.
+
+Without it a `SEARCH FROM "alice"` reads the header block of every message
+in the mailbox. With it the search is a single query against the
+`msg_headers` table (see `db.add_msg_headers_table()`). Each row holds the
+decoded, lowercased value of the indexed headers of one message, so the
+query does the same substring match that `IMAPSearch._match_header()` does
+against the message itself.
+
+The index is kept up to date as messages come and go: new messages are indexed,
+in the background, when a resync finds them (which is also how messages added
+by APPEND and COPY get their UID's) and expunged messages are dropped. Only
+`HEADER_INDEX_TASKS` mailboxes index new messages at once, so a sync tool
+dropping tens of thousands of messages in to folders does not hold up the
+resyncs that find them. Messages that are not in the index yet (ie: those that
+were in a mailbox before it had an index) are indexed the first time the
+mailbox's index is searched.
+
+Searches on headers that are not indexed are matched against each message
+as they always have been.
+"""
+
+# system imports
+#
+import asyncio
+import logging
+from typing import TYPE_CHECKING
+
+# Project imports
+#
+from .executor import run_in_thread
+from .search import IMAPSearch, SearchOp
+
+if TYPE_CHECKING:
+    from .mbox import Mailbox
+
+logger = logging.getLogger("asimap.header_index")
+
+# The headers we index, and the column of the `msg_headers` table each one is
+# stored in.
+#
+INDEXED_HEADERS = {
+    "from": "from_addr",
+    "to": "to_addr",
+    "cc": "cc_addr",
+    "bcc": "bcc_addr",
+    "subject": "subject",
+    "message-id": "message_id",
+    "in-reply-to": "in_reply_to",
+    "references": "refs",
+}
+
+# When indexing the messages that are not in a mailbox's index yet we read
+# the headers of this many messages at a time off of the event loop, and
+# write them to the db together.
+#
+HEADER_INDEX_BATCH_SIZE = 200
+
+# The number of mailboxes that add new messages to their index in the
+# background at once (see `HeaderIndex.schedule()`)
+#
+HEADER_INDEX_TASKS = 2
+
+
+########################################################################
+########################################################################
+#
+class HeaderIndex:
+    """
+    The header index of one mailbox.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, mbox: "Mailbox"):
+        """
+        Arguments:
+        - `mbox`: The mailbox whose messages we index
+        """
+        self.mbox = mbox
+
+        # The UID's of the messages in the index. None until it is loaded
+        # from the db by the first search that uses the index.
+        #
+        self.uids: set[int] | None = None
+
+        # Only one task brings the index up to date at a time.
+        #
+        self.lock = asyncio.Lock()
+
+        # New messages waiting to be added to the index by `self.task`, as
+        # (msg_key, uid)
+        #
+        self.pending: list[tuple[int, int]] = []
+        self.task: asyncio.Task | None = None
+
+    ####################################################################
+    #
+    def reset(self) -> None:
+        """
+        Forget which messages are in the index. Used when the mailbox's
+        UID's are all reset. The next search that uses the index loads it
+        again and drops the rows of messages that are no longer in the
+        mailbox.
+        """
+        self.uids = None
+        self.pending = []
+
+    ####################################################################
+    #
+    def schedule(self, msgs: list[tuple[int, int]]) -> None:
+        """
+        Add new messages to the index in the background. A search that
+        needs the index before they have been added adds them itself (see
+        `update()`)
+
+        Arguments:
+        - `msgs`: (msg_key, uid) of the messages to add
+        """
+        if not msgs:
+            return
+        self.pending.extend(msgs)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(
+                self._add_pending(),
+                name=f"header index '{self.mbox.name}'",
+            )
+
+    ####################################################################
+    #
+    def cancel(self) -> None:
+        """
+        Stop adding new messages to the index in the background.
+        """
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+        self.task = None
+        self.pending = []
+
+    ####################################################################
+    #
+    async def _add_pending(self) -> None:
+        """
+        Add the messages waiting in `self.pending` to the index.
+        """
+        async with self.mbox.server.header_index_limit:
+            while self.pending:
+                msgs, self.pending = self.pending, []
+                async with self.lock:
+                    # Messages may have been expunged (and their keys
+                    # reused by a pack), or indexed by a search, since they
+                    # were scheduled.
+                    #
+                    key_to_idx = self.mbox._msg_key_to_idx
+                    uids = self.mbox.uids
+                    msgs = [
+                        (msg_key, uid)
+                        for msg_key, uid in msgs
+                        if (idx := key_to_idx.get(msg_key)) is not None
+                        and uids[idx] == uid
+                        and (self.uids is None or uid not in self.uids)
+                    ]
+                    try:
+                        await self.add(msgs)
+                    except Exception as e:
+                        logger.exception(
+                            "Mailbox: '%s', problem adding %d messages to "
+                            "the header index: %s",
+                            self.mbox.name,
+                            len(msgs),
+                            e,
+                        )
+
+    ####################################################################
+    #
+    def _header_values(
+        self, msgs: list[tuple[int, int]]
+    ) -> list[tuple[int, list[str | None]]]:
+        """
+        Read the indexed headers of the given messages. Runs off of the
+        event loop.
+
+        Arguments:
+        - `msgs`: (msg_key, uid) of the messages to read
+
+        Returns (uid, the values of the indexed headers) for each message
+        that is still in the mailbox.
+        """
+        results = []
+        for msg_key, uid in msgs:
+            try:
+                headers = self.mbox.get_msg_headers(msg_key)
+            except KeyError:
+                continue
+            values = [
+                str(headers[header]).lower() if header in headers else None
+                for header in INDEXED_HEADERS
+            ]
+            results.append((uid, values))
+        return results
+
+    ####################################################################
+    #
+    async def add(self, msgs: list[tuple[int, int]]) -> None:
+        """
+        Add messages to the index.
+
+        Arguments:
+        - `msgs`: (msg_key, uid) of the messages to add
+        """
+        if not msgs:
+            return
+        columns = ", ".join(INDEXED_HEADERS.values())
+        qms = ",".join(["?"] * (len(INDEXED_HEADERS) + 3))
+        for i in range(0, len(msgs), HEADER_INDEX_BATCH_SIZE):
+            batch = msgs[i : i + HEADER_INDEX_BATCH_SIZE]
+            rows = await run_in_thread(self._header_values, batch)
+            async with self.mbox.db_lock:
+                for uid, values in rows:
+                    await self.mbox.server.db.execute(
+                        "INSERT OR REPLACE INTO msg_headers (mailbox_id, "
+                        f"uid_vv, uid, {columns}) VALUES ({qms})",
+                        (self.mbox.id, self.mbox.uid_vv, uid, *values),
+                    )
+                await self.mbox.server.db.commit()
+            if self.uids is not None:
+                self.uids.update(uid for uid, _ in rows)
+
+    ####################################################################
+    #
+    async def remove(self, uids: list[int]) -> None:
+        """
+        Remove expunged messages from the index.
+        """
+        if not uids:
+            return
+        async with self.mbox.db_lock:
+            for i in range(0, len(uids), HEADER_INDEX_BATCH_SIZE):
+                batch = uids[i : i + HEADER_INDEX_BATCH_SIZE]
+                qms = ",".join(["?"] * len(batch))
+                await self.mbox.server.db.execute(
+                    "DELETE FROM msg_headers WHERE mailbox_id=? "
+                    f"AND uid IN ({qms})",
+                    (self.mbox.id, *batch),
+                )
+            await self.mbox.server.db.commit()
+        if self.uids is not None:
+            self.uids.difference_update(uids)
+
+    ####################################################################
+    #
+    async def update(self) -> None:
+        """
+        Make sure every message in the mailbox is in the index, loading the
+        index from the db if we have not yet.
+        """
+        async with self.lock:
+            if self.uids is None:
+                uids = set(self.mbox.uids)
+                async with self.mbox.db_lock:
+                    indexed = set()
+                    async for row in self.mbox.server.db.query(
+                        "SELECT uid FROM msg_headers WHERE mailbox_id=? "
+                        "AND uid_vv=?",
+                        (self.mbox.id, self.mbox.uid_vv),
+                    ):
+                        indexed.add(row[0])
+
+                    # Drop rows from before the mailbox's UID's were reset.
+                    #
+                    stale = indexed - uids
+                    await self.mbox.server.db.execute(
+                        "DELETE FROM msg_headers WHERE mailbox_id=? "
+                        "AND uid_vv!=?",
+                        (self.mbox.id, self.mbox.uid_vv),
+                    )
+                self.uids = indexed
+                if stale:
+                    await self.remove(list(stale))
+
+            missing = [
+                (msg_key, uid)
+                for msg_key, uid in zip(
+                    self.mbox.msg_keys, self.mbox.uids, strict=True
+                )
+                if uid not in self.uids
+            ]
+            if missing:
+                logger.info(
+                    "Mailbox: '%s', adding %d messages to the header index",
+                    self.mbox.name,
+                    len(missing),
+                )
+                await self.add(missing)
+
+    ####################################################################
+    #
+    async def search(self, header: str, string: str) -> set[int]:
+        """
+        The indices (message sequence number - 1) of the messages whose
+        `header` contains `string`.
+
+        Arguments:
+        - `header`: One of the `INDEXED_HEADERS`
+        - `string`: The lowercased string to look for
+        """
+        await self.update()
+        column = INDEXED_HEADERS[header]
+        uid_to_idx = self.mbox._uid_to_idx
+        result = set()
+        async with self.mbox.db_lock:
+            async for row in self.mbox.server.db.query(
+                f"SELECT uid FROM msg_headers WHERE mailbox_id=? AND uid_vv=? "
+                f"AND instr({column}, ?) > 0",
+                (self.mbox.id, self.mbox.uid_vv, string),
+            ):
+                if row[0] in uid_to_idx:
+                    result.add(uid_to_idx[row[0]])
+        return result
+
+    ####################################################################
+    #
+    async def resolve(self, search: IMAPSearch) -> None:
+        """
+        Look up the messages matched by each search key in `search` that is
+        a search on an indexed header. The search key then matches from
+        that set instead of reading each message (see
+        `IMAPSearch.index_matches`)
+
+        Arguments:
+        - `search`: A planned search (see `IMAPSearch.plan()`). Its search
+          keys are modified.
+        """
+        for search_key in search.walk():
+            if search_key.op != SearchOp.HEADER:
+                continue
+            header = search_key.args["header"].lower()
+            if header in INDEXED_HEADERS:
+                search_key.index_matches = await self.search(
+                    header, search_key.args["string"]
+                )
@@ -14,8 +14,8 @@ import re
 import shutil
 import stat
 import time
-from collections import defaultdict
-from collections.abc import AsyncIterator
+from collections import Counter, defaultdict, deque
+from collections.abc import AsyncGenerator, AsyncIterator, Iterable, Sequence
 from copy import copy
 from datetime import datetime
 from email.message import EmailMessage
@@ -27,8 +27,9 @@ from tempfile import TemporaryDirectory
 from typing import (
     TYPE_CHECKING,
     Any,
+    Literal,
     Optional,
-    cast,
+    overload,
 )
 
 # 3rd party imports
@@ -49,8 +50,30 @@ from .constants import (
     seqs_to_flags,
 )
 from .exceptions import Bad, MailboxInconsistency, No
-from .fetch import FetchAtt, FetchOp
+from .executor import (
+    EXECUTOR_COUNTS,
+    FETCH_RENDER_BATCH_SIZE,
+    FETCH_RENDER_MIN_MSGS,
+    FETCH_RENDER_WINDOW,
+    offloading,
+    render_pool,
+    run_in_thread,
+    search_chunks,
+    search_pool,
+)
+from .fetch import (
+    FETCH_PLAN_KINDS,
+    FetchAtt,
+    FetchLiteral,
+    FetchPlan,
+    FetchPlanKind,
+)
+from .fetch_worker import FetchJob, FetchJobResult, render_fetch_batch
+from .header_index import HeaderIndex
 from .mh import MH
+from .msg_cache import MessageCache
+from .msg_columns import MsgColumns
+from .msg_files import MessageFiles
 from .parse import (
     CONFLICTING_COMMANDS,
     IMAPClientCommand,
@@ -58,9 +81,16 @@ from .parse import (
     ListSelectOpt,
     StoreAction,
 )
-from .search import IMAPSearch, SearchContext
+from .search import (
+    SEARCH_TEXT_COUNTS,
+    IMAPSearch,
+    MsgMetadata,
+    SearchContext,
+)
+from .search_worker import SearchJob, SearchJobResult, search_chunk
 from .utils import (
     MsgSet,
+    SavedResult,
     compact_sequence,
     expand_sequence,
     sequence_set_to_list,
@@ -75,6 +105,51 @@ if TYPE_CHECKING:
 
 logger = logging.getLogger("asimap.mbox")
 
+# When loading message metadata from the db we ask for this many UID's per
+# query (sqlite limits the number of bound variables in a statement.)
+#
+METADATA_QUERY_BATCH_SIZE = 500
+
+# The budget, in bytes, of each mailbox's cache of SEARCH results. A result
+# is charged 8 bytes per message in it.
+#
+SEARCH_CACHE_BYTES = 1024 * 1024
+
+# How often, in seconds, the management task of a mailbox whose folder is
+# watched by the server's `FolderWatcher` checks the folder anyway, in case
+# the watcher missed something (ie: a change made over NFS.)
+#
+WATCHED_RESYNC_INTERVAL = (240, 300)
+
+# A folder's directory mtime is only trusted to mean "no messages were added
+# or removed since we last looked" if it was this many nanoseconds older than
+# the time we looked. A message added right after we looked could leave a
+# coarse grained mtime unchanged.
+#
+FOLDER_SCAN_MTIME_SLACK = 2_000_000_000
+
+# How each resync found the message keys in the folder: "unchanged" if the
+# folder's directory mtime showed nothing was added or removed, "append" if
+# a scan of the folder only found new messages after our last message, and
+# "full" if messages were removed (or appeared in gaps) and we had to diff
+# every key. Logged and cleared by the user server when it dumps its
+# metrics.
+#
+RESYNC_SCANS: Counter[str] = Counter()
+
+# How many resyncs found the folder changed by something else ("real"), and
+# how many found the folder changed only by our own writes (STORE, EXPUNGE,
+# etc.) and so had nothing to do ("suppressed".) Logged and cleared by the
+# user server when it dumps its metrics.
+#
+RESYNCS: Counter[str] = Counter()
+
+# The (mtime in ns, inode, size) of a folder's directory and of its
+# `.mh_sequences` file. See `Mailbox.own_stamp`.
+#
+FileStamp = tuple[int, int, int]
+FolderStamp = tuple[FileStamp, FileStamp]
+
 
 ####################################################################
 #
@@ -93,6 +168,65 @@ def mbox_msg_path(mbox: MH, x: int | str | None = None) -> Path:
     return Path(mbox._path) / msg_key
 
 
+####################################################################
+#
+def file_stamp(path: Path) -> FileStamp:
+    """
+    The mtime (in ns), inode, and size of a file. If any of them are
+    different the file has been changed.
+    """
+    st = os.stat(path)
+    return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+
+####################################################################
+#
+def folder_mtimes(maildir: Path) -> dict[str, int]:
+    """
+    Walk the MH mail directory once and return the mtime of every folder
+    under it, by name. A folder's mtime is the same as what
+    `Mailbox.get_actual_mtime()` returns: the max of the mtimes, in whole
+    seconds, of its directory and its `.mh_sequences` file (if it has one.
+    Unlike `get_actual_mtime()` we do not create it.)
+
+    This is synchronous and meant to be run on a thread, so that checking
+    every folder costs one trip to a thread instead of several per folder.
+    """
+    mtimes: dict[str, int] = {}
+    dirs = [(str(maildir), "")]
+    while dirs:
+        path, name = dirs.pop()
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if name:
+            mtime = int(st.st_mtime)
+            try:
+                seq_st = os.stat(os.path.join(path, ".mh_sequences"))
+                mtime = max(mtime, int(seq_st.st_mtime))
+            except FileNotFoundError:
+                pass
+            mtimes[name] = mtime
+
+        # On filesystems that count them, a directory with a link count of
+        # 2 has no sub-directories, so there are no folders in it and no
+        # need to list what could be thousands of messages.
+        #
+        if st.st_nlink == 2:
+            continue
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if not entry.is_dir():
+                        continue
+                    sub_name = f"{name}/{entry.name}" if name else entry.name
+                    dirs.append((entry.path, sub_name))
+        except OSError:
+            continue
+    return mtimes
+
+
 ####################################################################
 #
 def intersect(a: IMAPClientCommand, b: IMAPClientCommand) -> bool:
@@ -129,7 +263,7 @@ class InvalidMailbox(MailboxException):
 ##################################################################
 ##################################################################
 #
-class Mailbox:
+class Mailbox(MessageFiles):
     """
     An instance of an active mailbox folder.
 
@@ -179,9 +313,17 @@ class Mailbox:
                     currently connected to us.
 
         """
+        # You can not instantiate a mailbox that does not exist in the
+        # underlying file system.
+        #
+        try:
+            folder = server.mailbox.get_folder(name)
+        except NoSuchMailboxError as exc:
+            raise NoSuchMailbox(f"No such mailbox: '{name}'") from exc
+        super().__init__(folder, name)
+
         self.logger = logging.getLogger(f"asimap.mbox.Mailbox:'{name}'")
         self.server = server
-        self.name = name
         self.id = None
         self.uid_vv = 0
         self.mtime: int = 0
@@ -214,6 +356,12 @@ class Mailbox:
         self._msg_key_to_idx: dict[int, int] = {}
         self._uid_to_idx: dict[int, int] = {}
 
+        # The internal dates, sizes and sent dates of the messages, in
+        # message sequence order, for date and size searches. Realigned
+        # with self.uids by _rebuild_index_dicts().
+        #
+        self.columns = MsgColumns(self)
+
         self.subscribed = False
 
         # Time in seconds since the unix epoch when a resync was last tried.
@@ -236,13 +384,19 @@ class Mailbox:
         #
         self.db_lock = asyncio.Lock()
 
-        # You can not instantiate a mailbox that does not exist in the
-        # underlying file system.
+        # The index of the headers most searched on, in the db.
         #
-        try:
-            self.mailbox: MH = server.mailbox.get_folder(name)
-        except NoSuchMailboxError as exc:
-            raise NoSuchMailbox(f"No such mailbox: '{name}'") from exc
+        self.header_index = HeaderIndex(self)
+
+        # Bumped whenever something a SEARCH matches on may have changed:
+        # messages are added or removed, their flags change, or the folder
+        # is packed. Results in the search cache are only used in the
+        # generation they were computed in.
+        #
+        self.generation = 0
+        self.search_cache: MessageCache[tuple[str, bool, int], list[int]] = (
+            MessageCache(SEARCH_CACHE_BYTES)
+        )
 
         # The list of attributes on this mailbox (this is things such as
         # '\Noselect'
@@ -264,6 +418,13 @@ class Mailbox:
         # to do a resync is evaluated (and then done)
         #
         self.task_queue: asyncio.Queue[IMAPClientCommand] = asyncio.Queue()
+
+        # Set by `queue_command()` whenever a command is put on the
+        # task_queue, so the management task can wait for either a command
+        # or a change to our folder without taking a command off the queue
+        # it might then drop.
+        #
+        self.commands_queued = asyncio.Event()
         self.mgmt_task: asyncio.Task
         self.executing_tasks: list[IMAPClientCommand] = []
 
@@ -273,6 +434,27 @@ class Mailbox:
         #
         self.optional_resync: bool = True
 
+        # Set by the server's `FolderWatcher` (see `folder_changed()`) when
+        # something changed our folder, to wake up the management task.
+        # Cleared when a resync starts.
+        #
+        self.changes_pending = asyncio.Event()
+
+        # The folder's directory mtime (in ns), and the number of messages
+        # and last message key we had, when `_scan_msg_keys()` last found
+        # the messages in the folder. 0 if the mtime can not be trusted.
+        #
+        self.scanned_mtime = 0
+        self.scanned_keys = (0, 0)
+
+        # The stamps of our folder and its `.mh_sequences` file as of our
+        # last real resync, moved forward by each of our own writes to them
+        # (if nothing else had changed them in between.) If the folder still
+        # has this stamp when we next look at it, only we have changed it and
+        # there is nothing to resync. None until our first resync.
+        #
+        self.own_stamp: FolderStamp | None = None
+
         # It is possible for a mailbox to be deleted while there are commands
         # in the task_queue waiting their chance to be processed. We need a way
         # to tell these commands when they get to run that the mailbox they are
@@ -356,6 +538,7 @@ class Mailbox:
         )
         if m_task:
             m_task.cancel()
+        self.header_index.cancel()
 
         try:
             while True:
@@ -618,6 +801,16 @@ class Mailbox:
         if msg_set is None:
             return None
 
+        # `$` is a saved set of UIDs (whether or not this is a UID command)
+        # kept as ranges. Each range maps to a range of message sequence
+        # numbers.
+        #
+        if isinstance(msg_set, SavedResult):
+            result: set[int] = set()
+            for idxs in msg_set.index_ranges(self.uids):
+                result.update(range(idxs.start + 1, idxs.stop + 1))
+            return result
+
         if from_uids:
             seq_max = self.uids[-1] if self.uids else 1
         else:
@@ -737,11 +930,25 @@ class Mailbox:
                 # mailbox selected. 1s to 5s if their are any
                 # clients. Otherwise 10s-20s if there are no clients.
                 #
-                timeout = randrange(1, 5) if self.clients else randrange(10, 20)
+                # If the server is watching our folder we are woken up when
+                # it changes, and only check it every now and then in case
+                # the watcher missed something. Unless it changed while
+                # commands were running and we still have to look at it.
+                #
+                watched = self.server.folder_watcher.watch(self.name)
+                if watched and not self.changes_pending.is_set():
+                    timeout = randrange(*WATCHED_RESYNC_INTERVAL)
+                elif self.clients:
+                    timeout = randrange(1, 5)
+                else:
+                    timeout = randrange(10, 20)
                 try:
                     async with asyncio.timeout(timeout):
-                        imap_cmd = await self.task_queue.get()
+                        imap_cmd = await self._next_command(watched)
                 except TimeoutError:
+                    imap_cmd = None
+
+                if imap_cmd is None:
                     self._cleanup_executing_tasks()
                     # If there are no currently executing tasks then check for
                     # new messages. If there were no new messages see if we
@@ -822,6 +1029,64 @@ class Mailbox:
                     e,
                 )
 
+    ####################################################################
+    #
+    async def _next_command(self, watched: bool) -> IMAPClientCommand | None:
+        """
+        Wait for the next IMAP command to run on this mailbox. If our folder
+        is being watched and it changes first, return None.
+        """
+        if not watched or self.changes_pending.is_set():
+            return await self.task_queue.get()
+
+        # Only wait on events, and only take a command off the queue once we
+        # are done waiting. If we are timed out or cancelled while waiting
+        # any command stays on the queue.
+        #
+        while self.task_queue.empty() and not self.changes_pending.is_set():
+            self.commands_queued.clear()
+            queued = asyncio.ensure_future(self.commands_queued.wait())
+            changed = asyncio.ensure_future(self.changes_pending.wait())
+            try:
+                await asyncio.wait(
+                    (queued, changed), return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                queued.cancel()
+                changed.cancel()
+        if self.task_queue.empty():
+            return None
+        return self.task_queue.get_nowait()
+
+    ####################################################################
+    #
+    def queue_command(self, imap_cmd: IMAPClientCommand) -> None:
+        """
+        Put an IMAP command on our task_queue for the management task.
+        """
+        self.task_queue.put_nowait(imap_cmd)
+        self.commands_queued.set()
+
+    ####################################################################
+    #
+    def _folder_stamp(self) -> FolderStamp:
+        """
+        The current stamps of our folder and its `.mh_sequences` file.
+        """
+        path = mbox_msg_path(self.mailbox)
+        return (file_stamp(path), file_stamp(path / ".mh_sequences"))
+
+    ####################################################################
+    #
+    def folder_changed(self) -> None:
+        """
+        Called by the server's `FolderWatcher` when something changed our
+        folder. The management task wakes up and does a resync (even if the
+        folder's mtime, in seconds, does not show the change. Unless the
+        change was one of our own writes.)
+        """
+        self.changes_pending.set()
+
     ####################################################################
     #
     def __str__(self) -> str:
@@ -870,6 +1135,20 @@ class Mailbox:
                 seqs.append(sequence)
         return seqs
 
+    ####################################################################
+    #
+    def sequence_indices(self, sequence: str) -> set[int]:
+        """
+        The indices in `self.msg_keys` (the IMAP message sequence numbers -
+        1) of the messages in the given sequence.
+        """
+        key_to_idx = self._msg_key_to_idx
+        return {
+            key_to_idx[msg_key]
+            for msg_key in self.sequences.get(sequence, ())
+            if msg_key in key_to_idx
+        }
+
     ####################################################################
     #
     async def _get_sequences_update_seen(
@@ -1054,21 +1333,37 @@ class Mailbox:
         start_mtime = await self.get_actual_mtime(
             self.server.mailbox, self.name
         )
-
-        # If the mtime we got from the folder/.mh_sequences is older the
-        # stored mtime for the mailbox then we can assume nothing has
-        # touched it and return immediately.
+        stamp = self._folder_stamp()
+
+        # If the folder and its .mh_sequences have not changed since our
+        # last resync, or have only been changed by our own writes, then we
+        # can assume nothing else has touched it and return immediately.
+        # Otherwise if the mtime we got from the folder/.mh_sequences is
+        # older the stored mtime for the mailbox (and the folder watcher has
+        # not told us it changed) we can also return immediately.
         #
         # However if optional is False, then we will do our scan regardless
         # of the mtime.
         #
-        if start_mtime <= self.mtime and self.optional_resync and optional:
-            return False
+        if self.optional_resync and optional:
+            if stamp == self.own_stamp:
+                if start_mtime > self.mtime or self.changes_pending.is_set():
+                    RESYNCS["suppressed"] += 1
+                self.mtime = max(self.mtime, start_mtime)
+                self.changes_pending.clear()
+                return False
+            if start_mtime <= self.mtime and not self.changes_pending.is_set():
+                return False
 
         # We always reset `optional_resync` once we begin a non-optional
-        # resync
+        # resync. This resync sees every change the folder watcher told us
+        # about.
         #
+        RESYNCS["real"] += 1
+        self.own_stamp = stamp
         self.optional_resync = True
+        self.changes_pending.clear()
+        self.generation += 1
 
         # The heart of the resync is to see if there are new messages in
         # the folder. If there are, then those messages are the ones we
@@ -1084,7 +1379,7 @@ class Mailbox:
         #       What is more we only care about sequences that any new
         #       messages were added to.
         #
-        msg_keys = [int(x) for x in self.mailbox.keys()]
+        msg_keys, new_msg_keys = self._scan_msg_keys()
         await asyncio.sleep(0)
 
         # If the list of new_msg_keys matches the existing list of
@@ -1124,6 +1419,9 @@ class Mailbox:
             self.num_recent = 0
             self.sequences = defaultdict(set)
             self.mtime = start_mtime
+            self._clear_msg_caches()
+            self.header_index.reset()
+            new_msg_keys = None
 
         elif len(self.msg_keys) != len(self.uids):
             # XXX There was something broken in the past where we grew the
@@ -1157,14 +1455,17 @@ class Mailbox:
                 self.num_recent = 0
                 self.sequences = defaultdict(set)
                 self.mtime = start_mtime
+                self._clear_msg_caches()
+                self.header_index.reset()
+                new_msg_keys = None
 
-        # If we reach here we know that we have new messages. Find out
-        # the lowest numbered new message and consider that message and
-        # everything after it a new message.
+        # If we reach here we know that we have new messages. Unless the
+        # scan already found them (they were all after our last message)
+        # they are the keys in the folder we did not know about.
         #
-        new_msg_keys = sorted(set(msg_keys) - set(self.msg_keys))
+        if new_msg_keys is None:
+            new_msg_keys = sorted(set(msg_keys) - set(self.msg_keys))
         num_new_msgs = len(new_msg_keys)
-        new_msgs = {}
         logger.debug(
             "Mailbox: '%s': num new messages: %d, new msg keys: %s",
             self.name,
@@ -1172,6 +1473,17 @@ class Mailbox:
             new_msg_keys,
         )
 
+        # A message key we consider new can not have a valid parsed message
+        # in our cache (the key may have been re-used by an external pack.)
+        #
+        for key in new_msg_keys:
+            self._invalidate_msg_caches(key)
+
+        # New messages are registered with just the keys the scan found.
+        # Nothing reads or parses them here. That is left to whatever needs
+        # their contents (and the header index, in the background.)
+        #
+        num_known = len(self.msg_keys)
         self.msg_keys.extend(new_msg_keys)
         new_uids = list(range(self.next_uid, self.next_uid + num_new_msgs))
         logger.debug(
@@ -1183,7 +1495,10 @@ class Mailbox:
         self.uids.extend(new_uids)
         if self.uids:
             self.next_uid = self.uids[-1] + 1
-        self._rebuild_index_dicts()
+        if num_known and len(self.uids) == len(self.msg_keys):
+            self._extend_index_dicts(num_known)
+        else:
+            self._rebuild_index_dicts()
 
         if len(self.uids) != len(self.msg_keys):
             logger.warning(
@@ -1199,9 +1514,6 @@ class Mailbox:
         async with self.mh_sequences_lock:
             msg_seqs = self.get_sequences_from_folder()
             for key in new_msg_keys:
-                msg = self.get_msg(key)
-                new_msgs[key] = msg
-
                 msg_sequences = {"Recent"}
                 for seq in msg_seqs.keys():
                     if key in msg_seqs[seq]:
@@ -1260,7 +1572,6 @@ class Mailbox:
         #
         notifications = []
         for key in new_msg_keys:
-            msg = new_msgs[key]
             fetch, _ = self._generate_fetch_msg_for(key)
             notifications.append(fetch)
 
@@ -1268,6 +1579,12 @@ class Mailbox:
             notifications, dont_notify=dont_notify
         )
 
+        # Add the new messages to the header index, in the background. This
+        # is also how messages added by APPEND and COPY get indexed.
+        #
+        self.header_index.schedule(list(zip(new_msg_keys, new_uids)))
+        self.server.text_index.schedule(self)
+
         # Update counts and commit state of the mailbox to the db.
         #
         self.mtime = await Mailbox.get_actual_mtime(
@@ -1289,6 +1606,83 @@ class Mailbox:
             )
         return True
 
+    ####################################################################
+    #
+    def _scan_msg_keys(self) -> tuple[list[int], list[int] | None]:
+        """
+        Find the message keys in our folder for a resync.
+
+        Almost always all that has happened to a folder since we last looked
+        is that messages were added after our last message. So we do not
+        list, sort, and diff every key in the folder:
+
+        - If the folder's directory mtime has not changed since we last
+          looked (and was old enough then to be trusted) no messages were
+          added or removed.
+        - Otherwise one pass over the directory counts and sums the keys up
+          to our last message key, and collects the ones after it. If the
+          count and sum match our `msg_keys` the folder has only been
+          appended to.
+        - If they do not match (messages were removed, or appeared in gaps)
+          we fall back to a full diff against every key in the folder.
+
+        Returns the sorted message keys in the folder and the new ones
+        (after our last message), or None for the new ones if our caller
+        has to diff the keys to find them.
+        """
+        path = self.mailbox._path
+        mtime = os.stat(path).st_mtime_ns
+        num_keys = len(self.msg_keys)
+        last_key = self.msg_keys[-1] if self.msg_keys else 0
+        if mtime == self.scanned_mtime and self.scanned_keys == (
+            num_keys,
+            last_key,
+        ):
+            RESYNC_SCANS["unchanged"] += 1
+            return self.msg_keys, []
+
+        num_old = 0
+        old_sum = 0
+        new_keys: list[int] = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.name.isdigit():
+                    continue
+                key = int(entry.name)
+                if key > last_key:
+                    new_keys.append(key)
+                else:
+                    num_old += 1
+                    old_sum += key
+
+        new_msg_keys: list[int] | None
+        if num_old == num_keys and old_sum == sum(self.msg_keys):
+            new_keys.sort()
+            msg_keys = self.msg_keys + new_keys
+            new_msg_keys = new_keys
+            RESYNC_SCANS["append"] += 1
+        else:
+            msg_keys = [int(x) for x in self.mailbox.keys()]
+            new_msg_keys = None
+            RESYNC_SCANS["full"] += 1
+            logger.debug(
+                "Mailbox: '%s', messages removed, full scan. "
+                "Had %d messages, %d remain, folder has %d",
+                self.name,
+                num_keys,
+                num_old,
+                len(msg_keys),
+            )
+
+        # If the folder's mtime is too recent, something could add a
+        # message in the same tick without changing it. Then we can not
+        # trust it next time.
+        #
+        trusted = time.time_ns() - mtime > FOLDER_SCAN_MTIME_SLACK
+        self.scanned_mtime = mtime if trusted else 0
+        self.scanned_keys = (len(msg_keys), msg_keys[-1] if msg_keys else 0)
+        return msg_keys, new_msg_keys
+
     ####################################################################
     #
     def _generate_fetch_msg_for(
@@ -1373,9 +1767,11 @@ class Mailbox:
         async with self.mh_sequences_lock:
             self.set_sequences_in_folder(self.sequences)
             self.mailbox.pack()
+            self._clear_msg_caches()
             self.msg_keys = [int(x) for x in self.mailbox.iterkeys()]
             self.sequences = self.get_sequences_from_folder()
         self._rebuild_index_dicts()
+        self.generation += 1
 
         self.mtime = await Mailbox.get_actual_mtime(
             self.server.mailbox, self.name
@@ -1383,42 +1779,6 @@ class Mailbox:
         await self.commit_to_db()
         return True
 
-    ####################################################################
-    #
-    def get_msg(self, msg_key: int) -> EmailMessage:
-        """
-        Get EmailMessage by its msg key in the underlying MH folder
-        """
-        # We have defined a factory for messages in our MH folders, and that
-        # factory will return an EmailMessage, so it is safe and proper to cast
-        # the return of __getitem__ to be an EmailMessage.
-        #
-        # return cast(EmailMessage, self.mailbox[str(msg_key)])
-        msg = cast(EmailMessage, self.mailbox[str(msg_key)])
-
-        # XXX Moving to the bytes generator we should not need this mangle code
-        #     anymore.
-        #
-        # To handle the attempt to decode the header if it is 8bit-unknown with
-        # a 7 bit encoding, capture that case and deal with it by re-writing
-        # the subject.
-        #
-
-        # if msg["content-transfer-encoding"] == "unknown-8bit":
-
-        # Make sure that we can encode the subject as a 7bit string
-        #
-        # subj = msg["subject"]
-        # try:
-        #     if "subject" in msg:
-        #         subj.encode("ascii", "surrogateescape")
-        # except UnicodeEncodeError:
-        #     subjb = subj.encode("ascii", "xmlcharrefreplace")
-        #     del msg["subject"]
-        #     msg["subject"] = subjb.decode("ascii")
-
-        return msg
-
     ####################################################################
     #
     def get_msg_by_uid(self, uid: int) -> EmailMessage:
@@ -1485,7 +1845,23 @@ class Mailbox:
         #     during any asyncio process where we want to guarantee writership.
         #
         assert self.mh_sequences_lock.locked()
+
+        # If nothing else has changed the .mh_sequences file since we last
+        # looked at it then after this write it is still only ours, and the
+        # next resync need not look at it.
+        #
+        seq_path = mbox_msg_path(self.mailbox, ".mh_sequences")
+        own_stamp = self.own_stamp
+        if own_stamp and own_stamp[1] != file_stamp(seq_path):
+            own_stamp = None
         self.mailbox.set_sequences({k: list(v) for k, v in seqs.items()})
+        if own_stamp:
+            self.own_stamp = (own_stamp[0], file_stamp(seq_path))
+
+        # The flags of messages may have changed (ie: a FETCH of a message's
+        # body sets \Seen on it)
+        #
+        self.generation += 1
 
     ##################################################################
     #
@@ -1511,8 +1887,23 @@ class Mailbox:
     #
     def _rebuild_index_dicts(self) -> None:
         """Rebuild the reverse-lookup dicts from the current lists."""
+        old_uid_to_idx = self._uid_to_idx
         self._msg_key_to_idx = {k: i for i, k in enumerate(self.msg_keys)}
         self._uid_to_idx = {u: i for i, u in enumerate(self.uids)}
+        self.columns.realign(old_uid_to_idx)
+
+    ##################################################################
+    #
+    def _extend_index_dicts(self, start: int) -> None:
+        """
+        Add the messages from index `start` on, which were just appended
+        to the lists, to the reverse-lookup dicts. The messages before
+        them have not moved so their entries are left alone.
+        """
+        for i in range(start, len(self.msg_keys)):
+            self._msg_key_to_idx[self.msg_keys[i]] = i
+            self._uid_to_idx[self.uids[i]] = i
+        self.columns.realign(self._uid_to_idx)
 
     ##################################################################
     #
@@ -1743,6 +2134,97 @@ class Mailbox:
                 )
             await self.server.db.commit()
 
+    ##################################################################
+    #
+    async def load_msg_metadata(
+        self, uids: list[int]
+    ) -> dict[int, MsgMetadata]:
+        """
+        Load the persisted metadata for the given UID's from the db. Every
+        UID passed in will have an entry in the returned dict (UID's we have
+        no metadata for yet, or whose message file has changed since it was
+        computed, get an empty `MsgMetadata`.)
+
+        Each entry records the mtime and size its message file has now, so
+        that values computed in to it are stored with them.
+        """
+        metadata: dict[int, MsgMetadata] = {}
+        for uid in uids:
+            mtime_ns = file_size = None
+            if (idx := self._uid_to_idx.get(uid)) is not None:
+                try:
+                    st = os.stat(
+                        mbox_msg_path(self.mailbox, self.msg_keys[idx])
+                    )
+                    mtime_ns, file_size = st.st_mtime_ns, st.st_size
+                except OSError:
+                    pass
+            metadata[uid] = MsgMetadata(
+                uid, mtime_ns=mtime_ns, file_size=file_size
+            )
+
+        # sqlite has a limit on the number of bound variables so we query in
+        # batches.
+        #
+        async with self.db_lock:
+            for i in range(0, len(uids), METADATA_QUERY_BATCH_SIZE):
+                batch = uids[i : i + METADATA_QUERY_BATCH_SIZE]
+                qms = ",".join(["?"] * len(batch))
+                async for row in self.server.db.query(
+                    "SELECT uid, size, internaldate, envelope, body, "
+                    "bodystructure, sentdate, mtime_ns, file_size "
+                    "FROM msg_metadata WHERE mailbox_id=? "
+                    f"AND uid_vv=? AND uid IN ({qms})",
+                    (self.id, self.uid_vv, *batch),
+                ):
+                    md = metadata[row[0]]
+                    if md.mtime_ns is not None and (row[7], row[8]) == (
+                        md.mtime_ns,
+                        md.file_size,
+                    ):
+                        metadata[row[0]] = MsgMetadata(*row)
+        return metadata
+
+    ##################################################################
+    #
+    async def store_msg_metadata(self, metadata: Iterable[MsgMetadata]) -> None:
+        """
+        Write back any metadata that has had values filled in since it was
+        loaded from the db.
+        """
+        dirty = [x for x in metadata if x.dirty]
+        if not dirty:
+            return
+        async with self.db_lock:
+            for md in dirty:
+                await self.server.db.execute(
+                    "INSERT INTO msg_metadata (mailbox_id, uid_vv, uid, size, "
+                    "internaldate, envelope, body, bodystructure, sentdate, "
+                    "mtime_ns, file_size) "
+                    "VALUES (?,?,?,?,?,?,?,?,?,?,?) "
+                    "ON CONFLICT DO UPDATE SET uid_vv=excluded.uid_vv, "
+                    "size=excluded.size, internaldate=excluded.internaldate, "
+                    "envelope=excluded.envelope, body=excluded.body, "
+                    "bodystructure=excluded.bodystructure, "
+                    "sentdate=excluded.sentdate, mtime_ns=excluded.mtime_ns, "
+                    "file_size=excluded.file_size",
+                    (
+                        self.id,
+                        self.uid_vv,
+                        md.uid,
+                        md.size,
+                        md.internaldate,
+                        md.envelope,
+                        md.body,
+                        md.bodystructure,
+                        md.sentdate,
+                        md.mtime_ns,
+                        md.file_size,
+                    ),
+                )
+                md.dirty = False
+            await self.server.db.commit()
+
     ##################################################################
     #
     def check_set_haschildren_attr(self) -> None:
@@ -1938,6 +2420,7 @@ class Mailbox:
 
         async with self.mh_sequences_lock:
             msg_key = int(self.mailbox.add(msg))
+        self.generation += 1
 
         # Update the message and internal sequences.
         #
@@ -2069,6 +2552,16 @@ class Mailbox:
             uids_to_delete,
         )
 
+        # `$` (rfc5182) no longer refers to expunged messages.
+        #
+        for client in self.clients.values():
+            client.saved_result.discard(uids_to_delete)
+
+        self.generation += 1
+        folder_path = mbox_msg_path(self.mailbox)
+        own_stamp = self.own_stamp
+        if own_stamp and own_stamp[0] != file_stamp(folder_path):
+            own_stamp = None
         for msg_key in to_delete:
             # Remove the message from the folder.. and also remove it from our
             # uids to message index mapping. NOTE: To convert which to the IMAP
@@ -2094,6 +2587,7 @@ class Mailbox:
             del self.uids[which]
             self.num_msgs -= 1
             await self.mailbox.aremove(msg_key)
+            self._invalidate_msg_caches(msg_key)
             expunge_msg = f"* {which + 1} EXPUNGE\r\n"
             await self._dispatch_or_pend_notifications(expunge_msg)
         self._rebuild_index_dicts()
@@ -2104,7 +2598,38 @@ class Mailbox:
             for msg_key in to_delete:
                 self.sequences[seq].discard(msg_key)
         self.num_recent = len(self.sequences["Recent"])
+
+        # And the persisted metadata for the expunged messages.
+        #
+        if uids_to_delete:
+            qms = ",".join(["?"] * len(uids_to_delete))
+            async with self.db_lock:
+                await self.server.db.execute(
+                    "DELETE FROM msg_metadata WHERE mailbox_id=? "
+                    f"AND uid IN ({qms})",
+                    (self.id, *uids_to_delete),
+                )
+            await self.header_index.remove(uids_to_delete)
+            await self.server.text_index.remove(self, uids_to_delete)
         await self.commit_to_db()
+
+        # If nothing else had changed the folder before we started, removing
+        # those messages was our own write and the next resync need not look
+        # at the folder. We also record what the folder holds now (the way
+        # `_scan_msg_keys()` does) so that a resync that does look at it
+        # checks the count and sum of the keys we kept instead of diffing
+        # every key. Otherwise make sure the next resync looks.
+        #
+        if own_stamp and self.own_stamp:
+            dir_stamp = file_stamp(folder_path)
+            self.own_stamp = (dir_stamp, self.own_stamp[1])
+            trusted = time.time_ns() - dir_stamp[0] > FOLDER_SCAN_MTIME_SLACK
+            self.scanned_mtime = dir_stamp[0] if trusted else 0
+            self.scanned_keys = (
+                len(self.msg_keys),
+                self.msg_keys[-1] if self.msg_keys else 0,
+            )
+            return
         self.optional_resync = False
 
     ##################################################################
@@ -2129,6 +2654,9 @@ class Mailbox:
               they simply will not be seen by this search. They do not yet
               "exist" in the mailbox as far as we are concerned.
 
+        Results are cached. A search is only run again if the mailbox has
+        changed (see `self.generation`) since it was last run.
+
         Arguments:
         - `search`: An IMAPSearch object instance
         - `uid_cmd`: whether or not this is a UID command.
@@ -2139,48 +2667,423 @@ class Mailbox:
         if not self.num_msgs:
             return []
 
-        results: list[int] = []
-        seq_max = self.num_msgs
-        uid_max = self.uids[-1]
+        # Clients poll with the same searches over and over. If nothing has
+        # changed since we last ran this one we already have its results.
+        #
+        search = search.plan()
+        generation = self.generation
+        cache_key = (str(search), uid_cmd, generation)
+        cached = self.search_cache.get(cache_key, 0, 0)
+        if cached is not None:
+            return list(cached)
+
+        results = await self._run_search(search, uid_cmd, timeout_cm)
+        if self.generation == generation:
+            self.search_cache.put(
+                cache_key, 0, 0, list(results), nbytes=8 * (len(results) + 1)
+            )
+        return results
 
-        # Go through the messages one by one and pass them to the search
-        # object to see if they are or are not in the result set..
+    ##################################################################
+    #
+    async def search_summary(
+        self,
+        search: IMAPSearch,
+        uid_cmd: bool = False,
+        timeout_cm: asyncio.Timeout | None = None,
+    ) -> tuple[int | None, int | None, int]:
+        """
+        The lowest and highest matching message and the number of messages
+        that match the search. This is what the ESEARCH (rfc4731) result
+        options MIN, MAX, and COUNT need and, unlike `search()`, the list of
+        matching messages is never built.
+
+        The arguments are the same as for `search()`
+
+        Returns a tuple of (min, max, count). min and max are None if no
+        messages match.
+        """
+        if not self.num_msgs:
+            return (None, None, 0)
+
+        # If we already have the results of this search in our cache there
+        # is nothing to work out.
         #
+        search = search.plan()
+        cached = self.search_cache.get(
+            (str(search), uid_cmd, self.generation), 0, 0
+        )
+        if cached is not None:
+            if not cached:
+                return (None, None, 0)
+            return (cached[0], cached[-1], len(cached))
+
+        # UIDs increase with the message sequence number so the message with
+        # the lowest index also has the lowest UID.
+        #
+        first: int | None = None
+        last: int | None = None
+        count = 0
+        candidates, residual = await self._split_search(search, timeout_cm)
+        if residual is None:
+            if candidates is None:
+                first, last, count = 0, self.num_msgs - 1, self.num_msgs
+            elif candidates:
+                first, last = min(candidates), max(candidates)
+                count = len(candidates)
+        else:
+            async for idx in self._matching_indices(
+                candidates, residual, timeout_cm
+            ):
+                if first is None:
+                    first = idx
+                last = idx
+                count += 1
+
+        if first is None or last is None:
+            return (None, None, 0)
+        if uid_cmd:
+            return (self.uids[first], self.uids[last], count)
+        return (first + 1, last + 1, count)
+
+    ##################################################################
+    #
+    async def _split_search(
+        self, search: IMAPSearch, timeout_cm: asyncio.Timeout | None
+    ) -> tuple[set[int] | None, IMAPSearch | None]:
+        """
+        The parts of the search on flags, UID's, message sequence numbers,
+        dates and sizes are answered from our in-memory state as sets of
+        messages. Only the messages in that set are looked at, and only if
+        there is more to the search than that.
+
+        Returns the set of candidate message indices (None if every message
+        is a candidate) and what is left of the search to be run against each
+        candidate (None if there is nothing left.)
+        """
+        await self.columns.fill(search, timeout_cm)
+        await self.header_index.resolve(search)
+        await self.server.text_index.resolve(self, search)
+        candidates, residual = search.split(self)
         logger.debug(
-            "Mailbox: '%s', applying search to messages: %s",
+            "Mailbox: '%s', search: %s, candidates: %s, per message: %s",
             self.name,
             str(search),
+            self.num_msgs if candidates is None else len(candidates),
+            str(residual),
         )
+        return candidates, residual
 
-        for idx, msg_key in enumerate(self.msg_keys):
-            # IMAP messages are numbered starting from 1.
-            #
-            msg_seq_num = idx + 1
-            ctx = SearchContext(self, msg_key, msg_seq_num, seq_max, uid_max)
-            if await search.match(ctx):
-                # The UID SEARCH command returns uid's of messages
+    ##################################################################
+    #
+    async def _matching_indices(
+        self,
+        candidates: set[int] | None,
+        residual: IMAPSearch,
+        timeout_cm: asyncio.Timeout | None,
+    ) -> AsyncIterator[int]:
+        """
+        Go through the candidate messages one by one, in order, and yield
+        the index of each one that the rest of the search matches.
+
+        If the rest of the search has to look at the text of messages, and
+        there are enough of them, they are matched in chunks by the server's
+        SEARCH processes instead (see `asimap.search_worker`)
+        """
+        seq_max = self.num_msgs
+        uid_max = self.uids[-1]
+        decoded = self.search_text_decoded
+        indices = range(seq_max) if candidates is None else sorted(candidates)
+        chunks = search_chunks(indices) if residual.reads_text() else None
+        if chunks is not None:
+            async for idx in self._match_in_processes(
+                chunks, residual, timeout_cm
+            ):
+                yield idx
+        else:
+            for idx in indices:
+                # IMAP messages are numbered starting from 1.
                 #
-                if uid_cmd:
-                    uid = ctx.uid()
-                    assert uid
-                    results.append(uid)
-                else:
-                    results.append(msg_seq_num)
+                msg_key = self.msg_keys[idx]
+                ctx = SearchContext(self, msg_key, idx + 1, seq_max, uid_max)
+                if await residual.match(ctx):
+                    yield idx
 
-            await asyncio.sleep(0)
-            self._maybe_extend_timeout(timeout_cm)
+                await asyncio.sleep(0)
+                self._maybe_extend_timeout(timeout_cm)
 
-        return results
+        decoded = self.search_text_decoded - decoded
+        if residual.reads_text():
+            SEARCH_TEXT_COUNTS["searches"] += 1
+            SEARCH_TEXT_COUNTS["decoded"] += decoded
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Mailbox: '%s', text decoded: %d, search plan:\n%s",
+                self.name,
+                decoded,
+                residual.explain(),
+            )
+
+    ##################################################################
+    #
+    async def _run_search(
+        self,
+        search: IMAPSearch,
+        uid_cmd: bool,
+        timeout_cm: asyncio.Timeout | None,
+    ) -> list[int]:
+        """
+        Run a planned search (see `IMAPSearch.plan()`) against the messages
+        in the mailbox. The arguments are the same as for `search()`
+        """
+        candidates, residual = await self._split_search(search, timeout_cm)
+        if residual is None:
+            indices = (
+                range(self.num_msgs)
+                if candidates is None
+                else sorted(candidates)
+            )
+            if uid_cmd:
+                return [self.uids[idx] for idx in indices]
+            return [idx + 1 for idx in indices]
+
+        # The UID SEARCH command returns uid's of messages
+        #
+        if uid_cmd:
+            return [
+                self.uids[idx]
+                async for idx in self._matching_indices(
+                    candidates, residual, timeout_cm
+                )
+            ]
+        return [
+            idx + 1
+            async for idx in self._matching_indices(
+                candidates, residual, timeout_cm
+            )
+        ]
+
+    ##################################################################
+    #
+    def _msg_key_for_seq_num(self, msg_seq_num: int) -> int:
+        """
+        The message key of the message with the given IMAP message sequence
+        number. Raises MailboxInconsistency if there is no such message.
+        """
+        try:
+            return self.msg_keys[msg_seq_num - 1]
+        except IndexError as exc:
+            # Every key in msg_idx should be in the folder. If it is
+            # not then something is off between our state and the
+            # folder's state.
+            #
+            log_msg = (
+                f"Mailbox '{self.name}': Attempted to look up msg seq "
+                f"num {msg_seq_num}, but msgs is only of length "
+                f"{self.num_msgs}"
+            )
+            logger.warning(log_msg)
+            raise MailboxInconsistency(log_msg, mbox_name=self.name) from exc
+
+    ##################################################################
+    #
+    async def _match_in_processes(
+        self,
+        chunks: list[Sequence[int]],
+        residual: IMAPSearch,
+        timeout_cm: asyncio.Timeout | None,
+    ) -> AsyncIterator[int]:
+        """
+        Match the rest of a search against the messages in `chunks` in the
+        server's SEARCH processes. Yields the index of each message that
+        matches, in order.
+
+        At most `SEARCH_PROCESS_WINDOW` chunks per SEARCH process are in
+        flight at once. While we wait on them the command's timeout is
+        extended, since we are not going through the messages ourselves.
+
+        The text the SEARCH processes decode is counted in our
+        `search_text_decoded`.
+        """
+        loop = asyncio.get_running_loop()
+        pool, window = search_pool()
+        seq_max = self.num_msgs
+        uid_max = self.uids[-1]
+        in_flight: deque[tuple[int, asyncio.Future[SearchJobResult]]] = deque()
+        next_chunk = 0
+        try:
+            while in_flight or next_chunk < len(chunks):
+                while next_chunk < len(chunks) and len(in_flight) < window:
+                    jobs: list[SearchJob] = []
+                    for idx in chunks[next_chunk]:
+                        msg_key = self.msg_keys[idx]
+                        jobs.append(
+                            (
+                                idx,
+                                msg_key,
+                                self.uids[idx],
+                                self.msg_sequences(msg_key),
+                            )
+                        )
+                    future = loop.run_in_executor(
+                        pool,
+                        search_chunk,
+                        self.mailbox._path,
+                        self.name,
+                        self.uid_vv,
+                        seq_max,
+                        uid_max,
+                        residual,
+                        jobs,
+                    )
+                    in_flight.append((len(jobs), future))
+                    next_chunk += 1
+
+                num_jobs, future = in_flight[0]
+                while not future.done():
+                    await asyncio.wait([future], timeout=1.0)
+                    self._maybe_extend_timeout(timeout_cm)
+                in_flight.popleft()
+                matches, decoded = future.result()
+                EXECUTOR_COUNTS["search"] += num_jobs
+                self.search_text_decoded += decoded
+                for idx in matches:
+                    yield idx
+        finally:
+            for _, future in in_flight:
+                future.cancel()
+
+    ##################################################################
+    #
+    async def _render_in_processes(
+        self,
+        plan: FetchPlan,
+        msg_set: list[int],
+        metadata: dict[int, MsgMetadata],
+        stream_literals: bool,
+    ) -> AsyncGenerator[list[bytes | FetchLiteral]]:
+        """
+        Render a FETCH in the server's FETCH render processes (see
+        `asimap.fetch_worker`). Yields the FETCH results for each message in
+        `msg_set`, in order.
+
+        Messages are sent to the render processes in batches. At most
+        `FETCH_RENDER_WINDOW` batches per render process are in flight at
+        once, and a new batch is only sent when the oldest one has been
+        consumed, so we never get too far ahead of the client.
+
+        The metadata the workers compute is put back in to `metadata` for
+        `fetch()` to persist.
+        """
+        loop = asyncio.get_running_loop()
+        workers = self.server.render_processes
+        pool = render_pool(workers)
+        seq_max = self.num_msgs
+        uid_max = self.uids[-1] if self.uids else 1
+        batches = [
+            msg_set[i : i + FETCH_RENDER_BATCH_SIZE]
+            for i in range(0, len(msg_set), FETCH_RENDER_BATCH_SIZE)
+        ]
+        in_flight: deque[asyncio.Future[list[FetchJobResult]]] = deque()
+        next_batch = 0
+        try:
+            while in_flight or next_batch < len(batches):
+                while (
+                    next_batch < len(batches)
+                    and len(in_flight) < workers * FETCH_RENDER_WINDOW
+                ):
+                    jobs: list[FetchJob] = []
+                    for msg_seq_num in batches[next_batch]:
+                        msg_key = self._msg_key_for_seq_num(msg_seq_num)
+                        uid = self.uids[msg_seq_num - 1]
+                        jobs.append(
+                            (
+                                msg_seq_num,
+                                msg_key,
+                                uid,
+                                self.msg_sequences(msg_key),
+                                metadata.get(uid),
+                            )
+                        )
+                    in_flight.append(
+                        loop.run_in_executor(
+                            pool,
+                            render_fetch_batch,
+                            self.mailbox._path,
+                            self.name,
+                            self.uid_vv,
+                            seq_max,
+                            uid_max,
+                            plan,
+                            jobs,
+                            stream_literals,
+                        )
+                    )
+                    next_batch += 1
+
+                for msg_seq_num, fetched, md in await in_flight.popleft():
+                    EXECUTOR_COUNTS["render"] += 1
+                    if md is not None:
+                        metadata[md.uid] = md
+
+                    # Literals to stream to the client are left for us.
+                    #
+                    results: list[bytes | FetchLiteral] = []
+                    ctx: SearchContext | None = None
+                    for op, result in zip(plan.fetch_ops, fetched, strict=True):
+                        if result is not None:
+                            results.append(result)
+                            continue
+                        if ctx is None:
+                            ctx = SearchContext(
+                                self,
+                                self._msg_key_for_seq_num(msg_seq_num),
+                                msg_seq_num,
+                                seq_max,
+                                uid_max,
+                            )
+                            ctx.load_mailbox_state()
+                        results.append(
+                            await run_in_thread(op.fetch_or_stream, ctx, True)
+                        )
+                    yield results
+        finally:
+            for future in in_flight:
+                future.cancel()
 
     #########################################################################
     #
+    @overload
+    def fetch(
+        self,
+        msg_set: list[int],
+        fetch_ops: list[FetchAtt],
+        uid_cmd: bool = ...,
+        timeout_cm: asyncio.Timeout | None = ...,
+        *,
+        stream_literals: Literal[False] = ...,
+    ) -> AsyncIterator[tuple[int, list[bytes]]]: ...
+
+    @overload
+    def fetch(
+        self,
+        msg_set: list[int],
+        fetch_ops: list[FetchAtt],
+        uid_cmd: bool = ...,
+        timeout_cm: asyncio.Timeout | None = ...,
+        *,
+        stream_literals: Literal[True],
+    ) -> AsyncIterator[tuple[int, list[bytes | FetchLiteral]]]: ...
+
     async def fetch(
         self,
         msg_set: list[int],
         fetch_ops: list[FetchAtt],
         uid_cmd: bool = False,
         timeout_cm: asyncio.Timeout | None = None,
-    ) -> AsyncIterator[tuple[int, list[bytes]]]:
+        *,
+        stream_literals: bool = False,
+    ) -> AsyncIterator[tuple[int, list[Any]]]:
         """
         Go through the messages in the mailbox. For the messages that are
         within the indicated message set parse them and pull out the data
@@ -2206,6 +3109,9 @@ class Mailbox:
         - `fetch_ops`: The things to fetch for the messags indiated in
           msg_set
         - `uid_cmd`: whether or not this is a UID command.
+        - `stream_literals`: If True, FETCH's of large entire messages are
+          returned as `FetchLiteral`s to be streamed to the client instead of
+          as bytes (see `FetchAtt.stream()`)
         """
 
         if not self.msg_keys:
@@ -2231,83 +3137,113 @@ class Mailbox:
         fetch_yield_times = []
         yield_times = []
 
+        # Work out what this FETCH needs once, instead of for every message.
+        # If this is a uid_cmd the plan adds the UID to the fetch atts we
+        # need to return. ie: a fetch response that would have been:
+        # * 23 FETCH (FLAGS (\Seen))
+        # is now going to be:
+        # * 23 FETCH (FLAGS (\Seen) UID 4827313)
+        #
+        plan = FetchPlan(fetch_ops, uid_cmd)
+        FETCH_PLAN_KINDS[plan.kind.name] += 1
+        rendered: AsyncGenerator[list[bytes | FetchLiteral]] | None = None
+
         try:
             seq_max = self.num_msgs
             uid_max = self.uids[-1] if self.uids else 1
 
+            # If any of the fetch ops can be answered from the persisted
+            # message metadata, load the metadata for all the messages we are
+            # fetching in one go.
+            #
+            metadata: dict[int, MsgMetadata] = {}
+            if plan.needs_metadata:
+                metadata = await self.load_msg_metadata(
+                    [
+                        self.uids[x - 1]
+                        for x in msg_set
+                        if 0 < x <= len(self.uids)
+                    ]
+                )
+
             # Go through each message and apply the fetch_ops.fetch() to it
             # building up a set of data to respond to the client with. Remember
             # IMAP message sequence number `1` refers to the first message in
             # the folder, ie: msgs[0].
             #
+            # Large FETCH's on a server with FETCH render processes are
+            # rendered by them, in batches, and come back in order.
+            #
+            if (
+                self.server.render_processes
+                and plan.kind != FetchPlanKind.FLAGS_UID
+                and len(msg_set) >= FETCH_RENDER_MIN_MSGS
+            ):
+                rendered = self._render_in_processes(
+                    plan, msg_set, metadata, stream_literals
+                )
+
             fetch_started = time.time()
             for msg_seq_num in msg_set:
                 single_fetch_started = time.time()
-                try:
-                    msg_key = self.msg_keys[msg_seq_num - 1]
-                except IndexError as exc:
-                    # Every key in msg_idx should be in the folder. If it is
-                    # not then something is off between our state and the
-                    # folder's state.
+                msg_key = self._msg_key_for_seq_num(msg_seq_num)
+
+                iter_results: list[bytes | FetchLiteral] = []
+                if rendered is not None:
+                    iter_results = await anext(rendered)
+                elif plan.kind == FetchPlanKind.FLAGS_UID:
+                    # Nothing but FLAGS and UID's: answer straight from our
+                    # in-memory state. No need to look at the message file.
                     #
-                    log_msg = (
-                        f"Mailbox '{self.name}': Attempted to look up msg seq "
-                        f"num {msg_seq_num}, but msgs is only of length "
-                        f"{self.num_msgs}"
+                    uid = self.uids[msg_seq_num - 1]
+                    sequences = self.msg_sequences(msg_key)
+                    for elt in plan.fetch_ops:
+                        iter_results.append(
+                            elt.fetch_from_state(uid, sequences)
+                        )
+                else:
+                    ctx = SearchContext(
+                        self,
+                        msg_key,
+                        msg_seq_num,
+                        seq_max,
+                        uid_max,
+                        metadata=metadata.get(self.uids[msg_seq_num - 1]),
                     )
-                    logger.warning(log_msg)
-                    raise MailboxInconsistency(
-                        log_msg, mbox_name=self.name
-                    ) from exc
-
-                ctx = SearchContext(
-                    self, msg_key, msg_seq_num, seq_max, uid_max
-                )
-                fetched_flags = False
-                fetched_body_seen = False
-                iter_results: list[bytes] = []
-
-                # If this is a uid_cmd add the UID to the fetch atts we
-                # need to return. ie: a fetch response that would have been:
-                # * 23 FETCH (FLAGS (\Seen))
-                # is now going to be:
-                # * 23 FETCH (FLAGS (\Seen) UID 4827313)
-                #
-                fo = list(fetch_ops)
-                if uid_cmd and not any(
-                    op.attribute == FetchOp.UID for op in fo
-                ):
-                    fo.append(FetchAtt(FetchOp.UID))
-                last_sleep = time.monotonic()
-                for elt in fo:
-                    iter_results.append(elt.fetch(ctx))
-                    # If one of the FETCH ops gets the FLAGS we want to
-                    # know and likewise if one of the FETCH ops gets the
-                    # BODY (but NOT BODY.PEEK) we want to know. Both of
-                    # these operations can potentially change the flags of
-                    # the message.
-                    #
-                    if elt.attribute == "body" and elt.peek is False:
-                        fetched_body_seen = True
-                    if elt.attribute == "flags":
-                        fetched_flags = True
-
-                    # Since each fetch op is asyncio blocking, release some
-                    # time to other tasks between each fetch if we have not
-                    # done so in a certain amount of time. (Makes fetch's
-                    # faster)
-                    #
-                    now = time.monotonic()
-                    if now - last_sleep > 0.05:
-                        await asyncio.sleep(0)
+                    if offloading():
+                        # Read and render the message on a FETCH thread,
+                        # leaving the event loop free for other clients. The
+                        # thread must not look at our in-memory state (the
+                        # event loop may change it) so we look up what the
+                        # FETCH needs from it first.
+                        #
+                        ctx.load_mailbox_state()
+                        iter_results = await run_in_thread(
+                            plan.fetch, ctx, stream_literals
+                        )
+                    else:
                         last_sleep = time.monotonic()
+                        for elt in plan.fetch_ops:
+                            iter_results.append(
+                                elt.fetch_or_stream(ctx, stream_literals)
+                            )
+
+                            # Since each fetch op is asyncio blocking,
+                            # release some time to other tasks between each
+                            # fetch if we have not done so in a certain
+                            # amount of time. (Makes fetch's faster)
+                            #
+                            now = time.monotonic()
+                            if now - last_sleep > 0.05:
+                                await asyncio.sleep(0)
+                                last_sleep = time.monotonic()
 
                 # If we did a FETCH FLAGS and the message was in the
                 # 'Recent' sequence then remove it from the 'Recent'
                 # sequence. Only one client gets to actually see that a
                 # message is 'Recent.'
                 #
-                if fetched_flags:
+                if plan.fetches_flags:
                     if msg_key in self.sequences["Recent"]:
                         no_longer_recent_msgs.add(msg_key)
 
@@ -2316,7 +3252,7 @@ class Mailbox:
                 # in it) and added to the 'Seen' sequence (if it was not in
                 # it.)
                 #
-                if fetched_body_seen:
+                if plan.marks_seen:
                     if msg_key in self.sequences["unseen"]:
                         no_longer_unseen_msgs.add(msg_key)
 
@@ -2330,6 +3266,10 @@ class Mailbox:
 
             fetch_finished_time = time.time()
 
+            # Persist any message metadata we computed during this fetch.
+            #
+            await self.store_msg_metadata(metadata.values())
+
             # A FETCH BODY with no peek means we have to send FETCH messages to
             # all other clients (that do not have dont_notify set)
             #
@@ -2374,6 +3314,8 @@ class Mailbox:
                 await self._dispatch_or_pend_notifications(notifies)
 
         finally:
+            if rendered is not None:
+                await rendered.aclose()
             now = time.time()
             total_time = now - start_time
             if total_time > 1.0:
@@ -2519,6 +3461,7 @@ class Mailbox:
         #
         flags = [flag_to_seq(x) for x in flags]
         store_start = time.monotonic()
+        self.generation += 1
 
         notifications: list[str] = []
         response: list[str] = []
@@ -2620,7 +3563,11 @@ class Mailbox:
 
                 seq_max = len(self.msg_keys)
 
-                if uid_command:
+                if isinstance(msg_set, SavedResult):
+                    msg_idxs = sorted(
+                        self.msg_set_to_msg_seq_set(msg_set) or ()
+                    )
+                elif uid_command:
                     # If we are doing a 'UID COPY' command we need to use the
                     # max uid for the sequence max.
                     #
@@ -3024,7 +3971,14 @@ class Mailbox:
                 await server.db.execute(
                     "DELETE FROM sequences WHERE mailbox_id = ?", (mbox.id,)
                 )
+                await server.db.execute(
+                    "DELETE FROM msg_metadata WHERE mailbox_id = ?", (mbox.id,)
+                )
+                await server.db.execute(
+                    "DELETE FROM msg_headers WHERE mailbox_id = ?", (mbox.id,)
+                )
                 await server.db.commit()
+            await server.text_index.remove_mailbox(mbox)
 
             logger.debug("**** Waiting for active mailbox lock: %s", name)
             async with server.active_mailboxes_lock:
@@ -3516,3 +4470,15 @@ async def _helper_rename_inbox(inbox: Mailbox, new_name: str) -> None:
         inbox.uids = []
         inbox.set_sequences_in_folder(inbox.sequences)
         await inbox.commit_to_db()
+    async with inbox.db_lock:
+        await server.db.execute(
+            "DELETE FROM msg_metadata WHERE mailbox_id=?",
+            (inbox.id,),
+        )
+        await server.db.execute(
+            "DELETE FROM msg_headers WHERE mailbox_id=?",
+            (inbox.id,),
+            commit=True,
+        )
+    inbox.header_index.reset()
+    await server.text_index.remove_mailbox(inbox)
@@ -0,0 +1,190 @@
+"""
+A byte-budgeted LRU cache of parsed messages (and other things derived from
+message files.)
+
+Parsing a message file in to an `EmailMessage` is the single most expensive
+thing we do when answering `FETCH` and `SEARCH` commands. IMAP clients very
+often ask for the same messages several times in a row (ie: `ENVELOPE`, then
+`BODYSTRUCTURE`, then `BODY[]`) so we keep a cache of recently parsed messages
+around.
+
+Entries are keyed by the MH message key (or something that includes it), and
+every entry also records the mtime and size of the file it was derived from. A
+lookup with a different mtime or size is treated as a miss and the stale entry
+is dropped. This way a message file that is re-written out from under us (by us
+or by an external MH command) is never served from the cache.
+
+For parsed messages the byte budget is accounted in terms of the size of the
+message file on disk. The in-memory size of a parsed message is larger than
+that, but it is roughly proportional to it, and it is a number we get for free
+from the `stat()` we are doing anyways. Other values are charged whatever
+their caller says they cost.
+
+FETCH's may read messages on worker threads (see `asimap.executor`), so the
+cache is protected by a lock.
+"""
+
+# system imports
+#
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import Hashable
+
+logger = logging.getLogger("asimap.msg_cache")
+
+# The budget of each mailbox's message cache, in bytes (measured by the size
+# of the message files on disk.) Can be changed via `set_msg_cache_bytes()`.
+#
+MSG_CACHE_BYTES: int = 16 * 1024 * 1024
+
+
+####################################################################
+#
+def set_msg_cache_bytes(max_bytes: int) -> None:
+    """Set the byte budget for message caches created after this call."""
+    global MSG_CACHE_BYTES
+    MSG_CACHE_BYTES = max_bytes
+
+
+########################################################################
+########################################################################
+#
+class MessageCache[K: Hashable, V]:
+    """
+    A LRU cache of values derived from message files, bounded by the total
+    number of bytes they are charged.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, max_bytes: int | None = None):
+        """
+        Arguments:
+        - `max_bytes`: The total number of bytes of entries we will keep
+                       around. A value of 0 disables the cache. Defaults to
+                       `MSG_CACHE_BYTES`.
+        """
+        self.max_bytes = MSG_CACHE_BYTES if max_bytes is None else max_bytes
+        self.num_bytes = 0
+
+        # value is a tuple of the mtime (in ns) and size of the message file,
+        # the number of bytes this entry is charged, and the cached value.
+        #
+        self._entries: OrderedDict[K, tuple[int, int, int, V]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Counters for our metrics. These are reset by `reset_stats()`
+        #
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    ####################################################################
+    #
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    ####################################################################
+    #
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    ####################################################################
+    #
+    def get(self, key: K, mtime: int, size: int) -> V | None:
+        """
+        Return the cached value for `key` if we have one and it was derived
+        from a file with the same mtime and size. Returns None otherwise.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            cached_mtime, cached_size, _, value = entry
+            if cached_mtime != mtime or cached_size != size:
+                # The message file has changed since we parsed it. The cached
+                # entry is useless.
+                #
+                self._invalidate(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    ####################################################################
+    #
+    def put(
+        self,
+        key: K,
+        mtime: int,
+        size: int,
+        value: V,
+        nbytes: int | None = None,
+    ) -> None:
+        """
+        Add a value to the cache, evicting the least recently used entries
+        until we are back under our byte budget.
+
+        Arguments:
+        - `key`: The cache key
+        - `mtime`: The mtime, in ns, of the message file `value` came from
+        - `size`: The size of the message file `value` came from
+        - `value`: The value to cache
+        - `nbytes`: How many bytes this entry is charged against our budget.
+                    Defaults to `size`. Entries larger than the entire budget
+                    are not cached.
+        """
+        nbytes = size if nbytes is None else nbytes
+        with self._lock:
+            self._invalidate(key)
+            if nbytes > self.max_bytes:
+                return
+
+            self._entries[key] = (mtime, size, nbytes, value)
+            self.num_bytes += nbytes
+            while self.num_bytes > self.max_bytes:
+                _, (_, _, evicted_bytes, _) = self._entries.popitem(last=False)
+                self.num_bytes -= evicted_bytes
+                self.evictions += 1
+
+    ####################################################################
+    #
+    def invalidate(self, key: K) -> None:
+        """
+        Remove the entry for the given key, if there is one.
+        """
+        with self._lock:
+            self._invalidate(key)
+
+    ####################################################################
+    #
+    def _invalidate(self, key: K) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.num_bytes -= entry[2]
+
+    ####################################################################
+    #
+    def clear(self) -> None:
+        """
+        Remove all entries from the cache. Used when message keys are no
+        longer valid (ie: the folder was packed or reset.)
+        """
+        with self._lock:
+            self._entries.clear()
+            self.num_bytes = 0
+
+    ####################################################################
+    #
+    def reset_stats(self) -> None:
+        """
+        Reset the hit/miss/eviction counters.
+        """
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
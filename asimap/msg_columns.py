@@ -0,0 +1,376 @@
+"""
+Columns of the per-message values that the date and size search keys
+compare: each message's internal date, RFC822.SIZE and the day of its Date:
+header.
+
+Matching `SEARCH SINCE 1-Jan-2026` (or BEFORE, ON, LARGER, SMALLER and the
+SENT* search keys) against each message means a stat() of every message
+file, rendering its size, or reading its header block. Instead each mailbox
+keeps these values in compact arrays, in message sequence order, and these
+search keys are answered by comparing every element of an array against the
+search key's date or size at once (with NumPy when it is installed, in pure
+python otherwise.)
+
+The values are persisted in the `msg_metadata` table like the rest of a
+message's metadata. Values that are not known yet (ie: for new messages)
+are loaded from the db, or computed from the message and written to the db,
+the first time a search needs them (see `MsgColumns.fill()`)
+"""
+
+# system imports
+#
+import asyncio
+import logging
+import math
+from array import array
+from datetime import date
+from typing import TYPE_CHECKING, Any
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Project imports
+#
+from .executor import run_in_thread
+from .search import IMAPSearch, MsgMetadata, SearchContext, SearchOp
+
+if TYPE_CHECKING:
+    from .mbox import Mailbox
+
+logger = logging.getLogger("asimap.msg_columns")
+
+# The value of an element of a column that has not been loaded or computed
+# yet.
+#
+UNKNOWN_DATE = -(2**63)
+UNKNOWN_SIZE = 2**32 - 1
+UNKNOWN_SENT_DAY = -1
+
+# The sent day of a message that has no Date: header, or one that can not be
+# parsed. Sent days are date ordinals, which start at 1.
+#
+NO_SENT_DAY = 0
+
+# The date ordinal of the first day of the unix epoch.
+#
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+SECONDS_PER_DAY = 86400
+
+# The values of messages that are not in the db are computed this many
+# messages at a time off of the event loop, and written to the db together.
+#
+COLUMN_BATCH_SIZE = 200
+
+# The column each search op compares.
+#
+COLUMN_OPS = {
+    SearchOp.BEFORE: "internal_dates",
+    SearchOp.ON: "internal_dates",
+    SearchOp.SINCE: "internal_dates",
+    SearchOp.LARGER: "sizes",
+    SearchOp.SMALLER: "sizes",
+    SearchOp.SENTBEFORE: "sent_days",
+    SearchOp.SENTON: "sent_days",
+    SearchOp.SENTSINCE: "sent_days",
+}
+
+# For each column: its array typecode and the value of unknown elements.
+#
+COLUMNS = {
+    "internal_dates": ("q", UNKNOWN_DATE),
+    "sizes": ("I", UNKNOWN_SIZE),
+    "sent_days": ("q", UNKNOWN_SENT_DAY),
+}
+
+
+####################################################################
+#
+def _day_start(day: date) -> int:
+    """
+    The internal date, in seconds since the unix epoch, of the start of
+    `day` in UTC.
+    """
+    return (day.toordinal() - EPOCH_ORDINAL) * SECONDS_PER_DAY
+
+
+####################################################################
+#
+def _in_range(column: array, lo: int | None, hi: int | None) -> set[int]:
+    """
+    The indices of the elements of `column` that are at least `lo` and less
+    than `hi`. A bound of None is not checked.
+    """
+    if not column:
+        return set()
+
+    # Bounds outside of what the column's type can hold do not exclude
+    # anything (or exclude everything.) Clamping them also keeps NumPy from
+    # comparing against a python int its dtype can not represent.
+    #
+    if column.typecode == "I":
+        col_min, col_max = 0, UNKNOWN_SIZE
+    else:
+        col_min, col_max = UNKNOWN_DATE, 2**63 - 1
+    if lo is not None and lo <= col_min:
+        lo = None
+    if hi is not None and hi > col_max:
+        hi = None
+    if (lo is not None and lo > col_max) or (hi is not None and hi <= col_min):
+        return set()
+
+    if np is not None:
+        values = np.frombuffer(column, dtype=column.typecode)
+        mask = np.ones(len(values), dtype=bool)
+        if lo is not None:
+            mask &= values >= lo
+        if hi is not None:
+            mask &= values < hi
+        return set(np.flatnonzero(mask).tolist())
+
+    if lo is None and hi is None:
+        return set(range(len(column)))
+    if lo is None:
+        return {i for i, x in enumerate(column) if x < hi}
+    if hi is None:
+        return {i for i, x in enumerate(column) if x >= lo}
+    return {i for i, x in enumerate(column) if lo <= x < hi}
+
+
+########################################################################
+########################################################################
+#
+class MsgColumns:
+    """
+    The internal dates, sizes and sent days of the messages of one mailbox,
+    in message sequence order. Kept the same length as, and in the same
+    order as, the mailbox's `uids` by `realign()`.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, mbox: "Mailbox"):
+        """
+        Arguments:
+        - `mbox`: The mailbox whose messages these are the values of
+        """
+        self.mbox = mbox
+
+        # Internal dates in whole seconds since the unix epoch.
+        #
+        self.internal_dates = array("q")
+
+        # RFC822.SIZE's
+        #
+        self.sizes = array("I")
+
+        # The day of the Date: header, in that header's time zone, as a date
+        # ordinal. `NO_SENT_DAY` if the message does not have one.
+        #
+        self.sent_days = array("q")
+
+        # The UID of the last message when the columns were last realigned.
+        #
+        self.last_uid: int | None = None
+
+        # Only one task fills in unknown values at a time.
+        #
+        self.lock = asyncio.Lock()
+
+    ####################################################################
+    #
+    def realign(self, old_uid_to_idx: dict[int, int]) -> None:
+        """
+        Bring the columns back in line with the mailbox's UID's after they
+        have changed. Messages that are new get unknown values. Called by
+        the mailbox whenever its UID's change.
+
+        Arguments:
+        - `old_uid_to_idx`: The index of each UID from before they changed
+        """
+        uids = self.mbox.uids
+        num = len(self.sizes)
+
+        # UID's only ever go up, so if the message at the end of the
+        # columns is still at the same index then all of the messages
+        # before it are too, and the only change is messages being added.
+        # This is every resync that finds new messages.
+        #
+        if num == 0 or (num <= len(uids) and uids[num - 1] == self.last_uid):
+            added = len(uids) - num
+            for name, (typecode, unknown) in COLUMNS.items():
+                getattr(self, name).extend(array(typecode, [unknown]) * added)
+        else:
+            old_columns = [getattr(self, name) for name in COLUMNS]
+            new_columns = [
+                array(typecode, [unknown]) * len(uids)
+                for typecode, unknown in COLUMNS.values()
+            ]
+            for i, uid in enumerate(uids):
+                j = old_uid_to_idx.get(uid)
+                if j is None or j >= num:
+                    continue
+                for old, new in zip(old_columns, new_columns, strict=True):
+                    new[i] = old[j]
+            for name, column in zip(COLUMNS, new_columns, strict=True):
+                setattr(self, name, column)
+        self.last_uid = uids[-1] if uids else None
+
+    ####################################################################
+    #
+    def _complete(self, name: str) -> bool:
+        """
+        True if every message's value in the named column is known.
+        """
+        column = getattr(self, name)
+        return len(column) == len(self.mbox.uids) and (
+            COLUMNS[name][1] not in column
+        )
+
+    ####################################################################
+    #
+    def _set_values(self, md: MsgMetadata) -> None:
+        """
+        Fill in the values of the message `md` is the metadata of from it.
+        """
+        idx = self.mbox._uid_to_idx.get(md.uid)
+        if idx is None or idx >= len(self.sizes):
+            return
+        if md.internaldate is not None:
+            self.internal_dates[idx] = math.floor(md.internaldate)
+        if md.size is not None and md.size < UNKNOWN_SIZE:
+            self.sizes[idx] = md.size
+        if md.sentdate is not None:
+            self.sent_days[idx] = md.sentdate
+
+    ####################################################################
+    #
+    def _compute(
+        self, names: set[str], msgs: list[tuple[int, MsgMetadata]]
+    ) -> list[MsgMetadata]:
+        """
+        Compute the values of the named columns for the given messages,
+        recording them in their metadata. Runs off of the event loop.
+
+        Arguments:
+        - `names`: The columns to compute values for
+        - `msgs`: (msg_key, metadata) of the messages to compute them for
+
+        Returns the metadata of the messages that are still in the mailbox.
+        """
+        results = []
+        for msg_key, md in msgs:
+            ctx = SearchContext(self.mbox, msg_key, 0, 0, 0, metadata=md)
+            try:
+                if "internal_dates" in names:
+                    ctx.internal_date()
+                if "sizes" in names:
+                    ctx.msg_size()
+                if "sent_days" in names:
+                    ctx.sent_date()
+            except (FileNotFoundError, KeyError):
+                continue
+            results.append(md)
+        return results
+
+    ####################################################################
+    #
+    async def fill(
+        self, search: IMAPSearch, timeout_cm: asyncio.Timeout | None = None
+    ) -> None:
+        """
+        Make sure the values the date and size search keys of `search`
+        compare are known for every message: loaded from the db, or
+        computed from the message (and written to the db.)
+
+        Arguments:
+        - `search`: The search about to be run
+        - `timeout_cm`: The timeout of the command running the search, if
+          any. It is extended if computing the values is taking a while.
+        """
+        names = {
+            COLUMN_OPS[search_key.op]
+            for search_key in search.walk()
+            if search_key.op in COLUMN_OPS
+        }
+        names = {name for name in names if not self._complete(name)}
+        if not names:
+            return
+
+        async with self.lock:
+            unknown = [(name, COLUMNS[name][1]) for name in names]
+            missing = [
+                uid
+                for idx, uid in enumerate(self.mbox.uids)
+                if any(getattr(self, n)[idx] == u for n, u in unknown)
+            ]
+            metadata = await self.mbox.load_msg_metadata(missing)
+            for md in metadata.values():
+                self._set_values(md)
+
+            uid_to_idx = self.mbox._uid_to_idx
+            to_compute = [
+                (self.mbox.msg_keys[uid_to_idx[uid]], metadata[uid])
+                for uid in missing
+                if uid in uid_to_idx
+                and any(
+                    getattr(self, n)[uid_to_idx[uid]] == u for n, u in unknown
+                )
+            ]
+            if to_compute:
+                logger.info(
+                    "Mailbox: '%s', computing %s for %d messages",
+                    self.mbox.name,
+                    ", ".join(sorted(names)),
+                    len(to_compute),
+                )
+            for i in range(0, len(to_compute), COLUMN_BATCH_SIZE):
+                batch = to_compute[i : i + COLUMN_BATCH_SIZE]
+                computed = await run_in_thread(self._compute, names, batch)
+                for md in computed:
+                    self._set_values(md)
+                await self.mbox.store_msg_metadata(computed)
+                self.mbox._maybe_extend_timeout(timeout_cm)
+
+    ####################################################################
+    #
+    def select(self, op: SearchOp, args: dict[str, Any]) -> set[int] | None:
+        """
+        The indices (message sequence number - 1) of the messages that the
+        date or size search key `op` with the given arguments matches. None
+        if the values it compares are not all known (see `fill()`)
+
+        These are the same comparisons as the search key's `_match_<op>`
+        method makes: internal dates are compared by their day in UTC, sent
+        dates by the day in the Date: header's time zone, and messages with
+        no Date: header do not match any SENT* search key.
+        """
+        name = COLUMN_OPS[op]
+        if not self._complete(name):
+            return None
+        column = getattr(self, name)
+
+        match op:
+            case SearchOp.BEFORE:
+                return _in_range(column, None, _day_start(args["date"]))
+            case SearchOp.ON:
+                start = _day_start(args["date"])
+                return _in_range(column, start, start + SECONDS_PER_DAY)
+            case SearchOp.SINCE:
+                return _in_range(column, _day_start(args["date"]), None)
+            case SearchOp.LARGER:
+                return _in_range(column, args["n"] + 1, None)
+            case SearchOp.SMALLER:
+                return _in_range(column, None, args["n"])
+            case SearchOp.SENTBEFORE:
+                return _in_range(
+                    column, NO_SENT_DAY + 1, args["date"].toordinal()
+                )
+            case SearchOp.SENTON:
+                day = args["date"].toordinal()
+                return _in_range(column, day, day + 1)
+            case SearchOp.SENTSINCE:
+                return _in_range(column, args["date"].toordinal(), None)
+        return None
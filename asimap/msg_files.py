@@ -0,0 +1,302 @@
+"""
+Reading the message files of a MH folder: parsed messages, just their
+headers, the index used to serve pieces of raw messages, and rendered message
+sections, each with a cache.
+
+This is split out of `Mailbox` so that FETCH worker processes (see
+`asimap.fetch_worker`) can read and render messages without a `Mailbox`.
+"""
+
+# system imports
+#
+import email.policy
+import logging
+import os
+import re
+from collections.abc import Callable
+from email import message_from_binary_file
+from email.message import EmailMessage
+from email.parser import BytesHeaderParser
+from pathlib import Path
+from typing import cast
+
+# Project imports
+#
+from .executor import can_run_in_process, run_in_process
+from .generator import RawMsgIndex, msg_search_text
+from .mh import MH
+from .msg_cache import MessageCache
+
+logger = logging.getLogger("asimap.msg_files")
+
+# When only a message's headers are needed we read its file in chunks of this
+# size until we find the blank line that ends the header block.
+#
+HEADER_READ_SIZE = 8192
+
+# The blank line that separates a message's headers from its body.
+#
+HEADER_END_RE = re.compile(rb"\r?\n\r?\n")
+
+# The budget of each mailbox's cache of the text that SEARCH BODY and TEXT
+# look in (see `MessageFiles.get_search_text()`), in characters of text. Can
+# be changed via `set_search_text_cache_bytes()`.
+#
+SEARCH_TEXT_CACHE_BYTES: int = 8 * 1024 * 1024
+
+
+####################################################################
+#
+def set_search_text_cache_bytes(max_bytes: int) -> None:
+    """Set the budget for search text caches created after this call."""
+    global SEARCH_TEXT_CACHE_BYTES
+    SEARCH_TEXT_CACHE_BYTES = max_bytes
+
+
+####################################################################
+#
+def parse_msg_file(path: Path) -> EmailMessage:
+    """
+    Parse a message file the same way the user server's MH folders do. A
+    module level function so it can be run in the process pool (see
+    `executor.run_in_process()`)
+    """
+    with open(path, "rb") as f:
+        return message_from_binary_file(f, policy=email.policy.default)
+
+
+########################################################################
+########################################################################
+#
+class MessageFiles:
+    """
+    The message files of a MH folder, and the caches of what we have read
+    from them. `Mailbox` is one of these.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, folder: MH, name: str):
+        """
+        Arguments:
+        - `folder`: The MH folder the messages are in
+        - `name`: The name of the mailbox
+        """
+        self.mailbox = folder
+        self.name = name
+
+        # Parsed messages are kept in a byte-budgeted LRU cache so that
+        # clients doing a series of FETCH's over the same messages (ie:
+        # ENVELOPE, then BODYSTRUCTURE, then BODY[]) only pay to parse each
+        # message once.
+        #
+        self.msg_cache: MessageCache[int, EmailMessage] = MessageCache()
+
+        # Clients fetch large messages and attachments in pieces. To make
+        # each piece cost only its own length we keep an index of the raw
+        # message files (for `BODY[]<start.length>`) and the rendered bytes
+        # of message sections (for `BODY[2]<start.length>`, etc.)
+        #
+        self.raw_index_cache: MessageCache[int, RawMsgIndex] = MessageCache()
+        self.section_cache: MessageCache[tuple[int, str], bytes] = (
+            MessageCache()
+        )
+
+        # SEARCH BODY and TEXT look in the decoded, lowercased text of a
+        # message (see `generator.msg_search_text()`). Clients repeat these
+        # searches with different strings so we keep the text around instead
+        # of parsing and decoding the message again.
+        #
+        # `search_text_decoded` counts the characters of text we have had to
+        # extract from messages because they were not in the cache.
+        #
+        self.search_text_cache: MessageCache[int, tuple[str, str]] = (
+            MessageCache(SEARCH_TEXT_CACHE_BYTES)
+        )
+        self.search_text_decoded = 0
+
+    ####################################################################
+    #
+    def get_msg(self, msg_key: int) -> EmailMessage:
+        """
+        Get EmailMessage by its msg key in the underlying MH folder
+
+        Parsed messages are cached in `self.msg_cache`. The cache entry is
+        only used if the message file's mtime and size have not changed since
+        it was parsed.
+        """
+        path = self.mailbox.get_message_path(msg_key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            # Let the MH folder raise the KeyError for us.
+            #
+            self.msg_cache.invalidate(msg_key)
+            return cast(EmailMessage, self.mailbox[str(msg_key)])
+
+        msg = self.msg_cache.get(msg_key, st.st_mtime_ns, st.st_size)
+        if msg is not None:
+            return msg
+
+        # If we are on a FETCH thread and there is a process pool, parse the
+        # message in a process instead of holding the GIL while we do it.
+        #
+        if can_run_in_process():
+            try:
+                msg = run_in_process(parse_msg_file, path)
+            except FileNotFoundError as exc:
+                raise KeyError(f"No message with key: {msg_key}") from exc
+        else:
+            # We have defined a factory for messages in our MH folders, and
+            # that factory will return an EmailMessage, so it is safe and
+            # proper to cast the return of __getitem__ to be an EmailMessage.
+            #
+            msg = cast(EmailMessage, self.mailbox[str(msg_key)])
+        self.msg_cache.put(msg_key, st.st_mtime_ns, st.st_size, msg)
+        return msg
+
+    ####################################################################
+    #
+    def get_msg_headers(self, msg_key: int) -> EmailMessage:
+        """
+        Get an EmailMessage with just the top level headers of a message.
+
+        This only reads the message file up to the blank line that ends its
+        header block and does not parse the body at all, so it costs the
+        same for a message with a 20mb attachment as for a one line note.
+        Use it for things like ENVELOPE, `BODY[HEADER.FIELDS (...)]` and
+        header SEARCH's.
+
+        If the entire message is already in `self.msg_cache` we return that
+        instead.
+
+        Raises KeyError if there is no such message.
+        """
+        path = self.mailbox.get_message_path(msg_key)
+        try:
+            with open(path, "rb") as f:
+                st = os.fstat(f.fileno())
+                msg = self.msg_cache.get(msg_key, st.st_mtime_ns, st.st_size)
+                if msg is not None:
+                    return msg
+
+                data = b""
+                while chunk := f.read(HEADER_READ_SIZE):
+                    # Look for the end of the header block starting a bit
+                    # before this chunk in case it straddles two chunks.
+                    #
+                    start = max(len(data) - 3, 0)
+                    data += chunk
+                    if m := HEADER_END_RE.search(data, start):
+                        data = data[: m.end()]
+                        break
+        except FileNotFoundError as exc:
+            raise KeyError(f"No message with key: {msg_key}") from exc
+
+        # Same policy our MH folders use when parsing entire messages so
+        # that the headers are rendered exactly the same.
+        #
+        return BytesHeaderParser(policy=email.policy.default).parsebytes(data)
+
+    ####################################################################
+    #
+    def get_search_text(self, msg_key: int) -> tuple[str, str]:
+        """
+        The lowercased, decoded (headers, body) text of a message that
+        SEARCH BODY and TEXT look in (see `generator.msg_search_text()`)
+        from `self.search_text_cache`. The message is only parsed if its
+        text is not cached (or the message file has changed.)
+
+        Raises KeyError if there is no such message.
+        """
+        path = self.mailbox.get_message_path(msg_key)
+        try:
+            st = os.stat(path)
+        except FileNotFoundError as exc:
+            self.search_text_cache.invalidate(msg_key)
+            raise KeyError(f"No message with key: {msg_key}") from exc
+
+        text = self.search_text_cache.get(msg_key, st.st_mtime_ns, st.st_size)
+        if text is None:
+            text = msg_search_text(self.get_msg(msg_key))
+            nbytes = len(text[0]) + len(text[1])
+            self.search_text_decoded += nbytes
+            self.search_text_cache.put(
+                msg_key, st.st_mtime_ns, st.st_size, text, nbytes
+            )
+        return text
+
+    ####################################################################
+    #
+    def get_raw_index(self, msg_key: int) -> RawMsgIndex:
+        """
+        Get the `RawMsgIndex` for a message, building it if it is not in
+        `self.raw_index_cache` (or the message file has changed.)
+        """
+        path = self.mailbox.get_message_path(msg_key)
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            index = self.raw_index_cache.get(
+                msg_key, st.st_mtime_ns, st.st_size
+            )
+            if index is None:
+                index = RawMsgIndex.build(f)
+                self.raw_index_cache.put(
+                    msg_key, st.st_mtime_ns, st.st_size, index, index.nbytes
+                )
+        return index
+
+    ####################################################################
+    #
+    def get_rendered_section(
+        self, msg_key: int, section: str, render: Callable[[], bytes]
+    ) -> bytes:
+        """
+        Get the rendered bytes of a section of a message from
+        `self.section_cache`, calling `render` to render them if they are
+        not cached (or the message file has changed.)
+
+        Arguments:
+        - `msg_key`: The message the section is from
+        - `section`: A string uniquely identifying the section
+        - `render`: Called to render the section on a cache miss
+        """
+        try:
+            st = os.stat(self.mailbox.get_message_path(msg_key))
+        except FileNotFoundError:
+            return render()
+
+        key = (msg_key, section)
+        data = self.section_cache.get(key, st.st_mtime_ns, st.st_size)
+        if data is None:
+            data = render()
+            self.section_cache.put(
+                key, st.st_mtime_ns, st.st_size, data, len(data)
+            )
+        return data
+
+    ####################################################################
+    #
+    def _invalidate_msg_caches(self, msg_key: int) -> None:
+        """
+        Drop everything we have cached for the given message key.
+
+        NOTE: Rendered sections are not dropped here. Their entries are
+              checked against the message file's mtime and size so a stale
+              one is never used, and they age out of the cache.
+        """
+        self.msg_cache.invalidate(msg_key)
+        self.raw_index_cache.invalidate(msg_key)
+        self.search_text_cache.invalidate(msg_key)
+
+    ####################################################################
+    #
+    def _clear_msg_caches(self) -> None:
+        """
+        Drop everything we have cached about the messages in this mailbox.
+        Used when message keys are no longer valid (ie: after a pack.)
+        """
+        self.msg_cache.clear()
+        self.raw_index_cache.clear()
+        self.section_cache.clear()
+        self.search_text_cache.clear()
@@ -29,7 +29,7 @@ from .search import IMAPSearch
 
 # asimapd imports
 #
-from .utils import MsgSet, parsedate
+from .utils import MsgSet, SavedResult, parsedate
 
 if TYPE_CHECKING:
     from .mbox import Mailbox
@@ -180,6 +180,20 @@ class ListReturnOpt(StrEnum):
     SPECIAL_USE = "special-use"
 
 
+#######################################################################
+#
+# ESEARCH (rfc4731) result options. The order here is the order they are
+# returned in the untagged ESEARCH response. SAVE (rfc5182) is not returned,
+# it saves the result for use as `$`.
+#
+class SearchReturnOpt(StrEnum):
+    MIN = "min"
+    MAX = "max"
+    COUNT = "count"
+    ALL = "all"
+    SAVE = "save"
+
+
 #######################################################################
 #
 # Attributes of a fetch command. Note that the order is important. We need to
@@ -373,6 +387,8 @@ def msg_set_to_str(msg_set: MsgSet | None) -> str:
     """
     if msg_set is None:
         return ""
+    if isinstance(msg_set, SavedResult):
+        return "$"
 
     return ",".join(
         [
@@ -431,6 +447,13 @@ class IMAPClientCommand:
         #
         self.msg_set_as_set: set[int] | None = None
 
+        # If the command refers to the result saved by a previous `SEARCH
+        # RETURN (SAVE)` (`$`, rfc5182) this is what `$` was parsed as. The
+        # client handler fills it in with the saved result before the
+        # command is run.
+        #
+        self.saved_result: SavedResult | None = None
+
         # If the IMAP Command is currently operating under an asyncio.Timeout
         # context manager, that context manager is set here so that when a
         # command is being processed, if it knows it is going to run longer it
@@ -464,7 +487,7 @@ class IMAPClientCommand:
         command to be completed before exiting.
         """
         try:
-            mbox.task_queue.put_nowait(self)
+            mbox.queue_command(self)
             await self.ready.wait()
             if mbox.deleted:
                 from .mbox import NoSuchMailbox
@@ -557,6 +580,13 @@ class IMAPClientCommand:
                 case IMAPCommand.LIST | IMAPCommand.LSUB:
                     result.extend(self._fmt_list_cmd_args())
                 case IMAPCommand.SEARCH:
+                    if self.search_return_opts is not None:
+                        opts = " ".join(
+                            x.value.upper()
+                            for x in SearchReturnOpt
+                            if x in self.search_return_opts
+                        )
+                        result.append(f"RETURN ({opts})")
                     result.append(str(self.search_key))
                 case IMAPCommand.STORE:
                     result.append(msg_set_to_str(self.msg_set))
@@ -848,17 +878,27 @@ class IMAPClientCommand:
     #######################################################################
     #
     def _p_search(self) -> None:
-        """search ::= "SEARCH" SPACE ["CHARSET" SPACE astring SPACE]
-                   1#search_key
+        """search ::= "SEARCH" [SPACE "RETURN" SPACE "(" [search_return_opt
+                   *(SPACE search_return_opt)] ")"]
+                   SPACE ["CHARSET" SPACE astring SPACE] 1#search_key
         [CHARSET] MUST be registered with IANA
 
+        The "RETURN" options are from ESEARCH (rfc4731.) If they are not given
+        `search_return_opts` is None and the result is a plain SEARCH
+        response. An empty list of options is the same as "RETURN (ALL)".
+
         The "search" command has what amounts to its own little grammar.
         We parse out the initial part of the message and then we pass the
         last bit ("1#search_key") in to a sub-parsing routine. We expect
         back a list of mhimap.IMAPSearch objects.
         """
+        self.search_return_opts: set[SearchReturnOpt] | None = None
         self._p_simple_string(" ")
 
+        if self._p_simple_string("return ", silent=True):
+            self._p_search_return_options()
+            self._p_simple_string(" ")
+
         # If the next token is 'CHARSET' then we need to pull aside the
         # CHARSET. If not, we default the charset to 'us-ascii'
         #
@@ -876,6 +916,31 @@ class IMAPClientCommand:
             "and", search_key=self._p_list_of(self._p_search_key)
         )
 
+    #######################################################################
+    #
+    def _p_search_return_options(self) -> None:
+        """
+        Parse ESEARCH return options (rfc4731 Section 3.1, rfc5182)
+
+        Grammar: "(" [search_return_opt *(SP search_return_opt)] ")"
+                 search_return_opt ::= "MIN" / "MAX" / "ALL" / "COUNT" /
+                                       "SAVE"
+        """
+        opts = self._p_paren_list_of(lambda: self._p_re(_atom_re).lower())
+        self.search_return_opts = set()
+        for opt_str in opts:
+            try:
+                self.search_return_opts.add(SearchReturnOpt(opt_str))
+            except ValueError as err:
+                raise BadSyntax(
+                    f"Unknown SEARCH return option: {opt_str}"
+                ) from err
+
+        # "RETURN ()" is the same as "RETURN (ALL)"
+        #
+        if not self.search_return_opts:
+            self.search_return_opts.add(SearchReturnOpt.ALL)
+
     #######################################################################
     #
     def _p_store(self) -> None:
@@ -1807,7 +1872,9 @@ class IMAPClientCommand:
 
     #######################################################################
     #
-    def _p_msg_set(self) -> list[int | str | tuple[int | str, int | str]]:
+    def _p_msg_set(
+        self,
+    ) -> list[int | str | tuple[int | str, int | str]] | SavedResult:
         """sequence_num ::= nz_number / "*"
 
         * is the largest number in use.  For message sequence numbers, it is
@@ -1831,7 +1898,15 @@ class IMAPClientCommand:
         element). The list will be a list of integers, "*", and tuples. Tuples
         will reprsent the "sequence_num : sequence_num" construct. The
         integers MUST be greater then zero.
+
+        The message set may also be "$" (rfc5182), the result saved by the
+        last `SEARCH RETURN (SAVE)`. It is returned as the command's
+        `saved_result`. Every "$" in a command is the same object.
         """
+        if self._p_simple_string("$", silent=True):
+            if self.saved_result is None:
+                self.saved_result = SavedResult()
+            return self.saved_result
 
         # Pull what should be a message off of our input string.
         #
@@ -5,26 +5,40 @@ structure.
 
 # system imports
 #
-import asyncio
 import logging
 import os.path
-from datetime import UTC, datetime
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from collections.abc import Iterator
+from datetime import UTC, date, datetime
 from email.message import EmailMessage
-from enum import StrEnum
+from enum import IntEnum, StrEnum
 from pathlib import Path
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Optional
 
 # asimap imports
 #
 from .constants import flag_to_seq
-from .generator import get_msg_size, msg_as_string
-from .utils import parsedate
+from .generator import (
+    RawMsgIndex,
+    get_msg_size,
+    raw_msg_as_bytes,
+)
+from .utils import SavedResult, parsedate
 
 if TYPE_CHECKING:
+    from .fetch_worker import WorkerFolder
     from .mbox import Mailbox
 
 logger = logging.getLogger("asimap.search")
 
+# Counts of the searches that matched BODY or TEXT against the text of
+# messages ("searches") and how many characters of text were extracted from
+# messages for them because it was not in a search text cache ("decoded").
+# Logged and cleared by the user server when it dumps its metrics.
+#
+SEARCH_TEXT_COUNTS: Counter[str] = Counter()
+
 
 ############################################################################
 #
@@ -36,6 +50,75 @@ class BadSearchOp(Exception):
         return f"BadSearchOp: {self.value}"
 
 
+##################################################################
+##################################################################
+#
+class MsgMetadata:
+    """
+    The per-message metadata that is persisted in the `msg_metadata` table.
+    These are values that require parsing the message to compute but do not
+    change unless the message file does, so once computed they are stored and
+    served from the db instead of the message file. The mtime (in ns) and
+    size of the message file they were computed from are stored with them.
+    If the file no longer matches they are computed again.
+
+    Any attribute that is None has not been computed yet. When a value is
+    filled in `dirty` is set so the mailbox knows to write it back to the db.
+    """
+
+    __slots__ = (
+        "uid",
+        "size",
+        "internaldate",
+        "envelope",
+        "body",
+        "bodystructure",
+        "sentdate",
+        "mtime_ns",
+        "file_size",
+        "dirty",
+    )
+
+    ##################################################################
+    #
+    def __init__(
+        self,
+        uid: int,
+        size: int | None = None,
+        internaldate: float | None = None,
+        envelope: bytes | None = None,
+        body: bytes | None = None,
+        bodystructure: bytes | None = None,
+        sentdate: int | None = None,
+        mtime_ns: int | None = None,
+        file_size: int | None = None,
+    ):
+        self.uid = uid
+        self.size = size
+        self.internaldate = internaldate
+        self.envelope = envelope
+        self.body = body
+        self.bodystructure = bodystructure
+
+        # The day of the message's Date: header as a date ordinal, 0 if it
+        # does not have one (see `SearchContext.sent_date()`)
+        #
+        self.sentdate = sentdate
+        self.mtime_ns = mtime_ns
+        self.file_size = file_size
+        self.dirty = False
+
+    ##################################################################
+    #
+    def set(self, attr: str, value: Any) -> None:
+        """
+        Set a computed value and mark this metadata as needing to be written
+        to the db.
+        """
+        setattr(self, attr, value)
+        self.dirty = True
+
+
 ##################################################################
 ##################################################################
 #
@@ -50,25 +133,31 @@ class SearchContext:
     #
     def __init__(
         self,
-        mailbox: "Mailbox",
+        mailbox: "Mailbox | WorkerFolder",
         msg_key: int,
         msg_number: int,
         seq_max: int,
         uid_max: int,
+        metadata: MsgMetadata | None = None,
     ):
         """
         A container to hold the contextual information an IMAPSearch
         objects to actually perform its matching function.
 
         Arguments:
-        - `mailbox`: The mailbox the message lives in
+        - `mailbox`: The mailbox the message lives in (or, in a FETCH worker
+          process, its `fetch_worker.WorkerFolder`)
         - `msg_key`: The message key (mailbox.get_message(msg_key))
         - `msg_number`: The imap message number for this message
         - `seq_max`: The largest message sequence number in this mailbox
         - `uid_max`: The largest assigned uid, or next_uid if there
           are no messages in this mailbox
+        - `metadata`: The persisted metadata for this message, if the caller
+          has it. Values we compute that are in the metadata are recorded in
+          it.
         """
         self.mailbox = mailbox
+        self.metadata = metadata
         self.msg_key = msg_key
         self.seq_max = seq_max
         self.uid_max = uid_max
@@ -81,6 +170,9 @@ class SearchContext:
         #
         self._internal_date: datetime | None = None
         self._msg: EmailMessage | None = None
+        self._headers: EmailMessage | None = None
+        self._raw_msg: bytes | None = None
+        self._raw_msg_checked = False
         self._msg_size: int | None = None
         self._uid_vv: int | None = None
         self._uid: int | None = None
@@ -100,12 +192,14 @@ class SearchContext:
     def internal_date(self) -> datetime:
         if self._internal_date:
             return self._internal_date
-        internal_date = datetime.fromtimestamp(
-            # await aiofiles.os.path.getmtime(self.path), timezone.utc
-            self.path.stat().st_mtime,
-            UTC,
-        )
-        self._internal_date = internal_date
+        if self.metadata and self.metadata.internaldate is not None:
+            mtime = self.metadata.internaldate
+        else:
+            # mtime = await aiofiles.os.path.getmtime(self.path)
+            mtime = self.path.stat().st_mtime
+            if self.metadata:
+                self.metadata.set("internaldate", mtime)
+        self._internal_date = datetime.fromtimestamp(mtime, UTC)
         return self._internal_date
 
     ##################################################################
@@ -113,10 +207,51 @@ class SearchContext:
     def msg_size(self) -> int:
         if self._msg_size:
             return self._msg_size
+        if self.metadata and self.metadata.size is not None:
+            self._msg_size = self.metadata.size
+            return self._msg_size
 
-        self._msg_size = get_msg_size(self.msg())
+        # The size of the message is the size of what we send for a FETCH
+        # of the entire message. Which is the raw message file if it passes
+        # the checks for that, otherwise what the generator renders.
+        #
+        # If we have not already read the raw message we get its size from
+        # its index, which does not keep the message's contents around.
+        #
+        if self._raw_msg_checked:
+            raw_size = None if self._raw_msg is None else len(self._raw_msg)
+        else:
+            raw_index = self.raw_index()
+            raw_size = raw_index.size if raw_index.valid else None
+        if raw_size is not None:
+            self._msg_size = raw_size
+        else:
+            self._msg_size = get_msg_size(self.msg())
+        if self.metadata:
+            self.metadata.set("size", self._msg_size)
         return self._msg_size
 
+    ##################################################################
+    #
+    def sent_date(self) -> date | None:
+        """
+        The day of the message's Date: header, in the header's time zone.
+        None if the message has no Date: header or it can not be parsed.
+        """
+        if self.metadata and self.metadata.sentdate is not None:
+            day = self.metadata.sentdate
+        else:
+            day = 0
+            headers = self.headers()
+            if "date" in headers:
+                try:
+                    day = parsedate(headers["date"]).date().toordinal()
+                except (TypeError, ValueError):
+                    pass
+            if self.metadata:
+                self.metadata.set("sentdate", day)
+        return date.fromordinal(day) if day else None
+
     ##################################################################
     #
     def msg(self) -> EmailMessage:
@@ -129,6 +264,57 @@ class SearchContext:
         self._msg = self.mailbox.get_msg(self.msg_key)
         return self._msg
 
+    ##################################################################
+    #
+    def headers(self) -> EmailMessage:
+        """
+        The message's top level headers, without parsing its body. Use this
+        instead of `msg()` when only headers are needed. (If the message has
+        already been parsed that is returned instead.)
+        """
+        if self._msg:
+            return self._msg
+        if self._headers:
+            return self._headers
+
+        self._headers = self.mailbox.get_msg_headers(self.msg_key)
+        return self._headers
+
+    ##################################################################
+    #
+    def search_text(self) -> tuple[str, str]:
+        """
+        The lowercased, decoded (headers, body) text of the message that
+        BODY and TEXT search in. Cached by the mailbox so repeated content
+        searches do not parse and decode the message again.
+        """
+        return self.mailbox.get_search_text(self.msg_key)
+
+    ##################################################################
+    #
+    def raw_msg(self) -> bytes | None:
+        """
+        The message file's contents with CRLF line endings, without parsing
+        it. None if the message file fails the checks for being sent as is
+        (see `generator.raw_msg_as_bytes()`)
+        """
+        if self._raw_msg_checked:
+            return self._raw_msg
+
+        with open(self.path, "rb") as f:
+            self._raw_msg = raw_msg_as_bytes(f)
+        self._raw_msg_checked = True
+        return self._raw_msg
+
+    ##################################################################
+    #
+    def raw_index(self) -> RawMsgIndex:
+        """
+        The index of the message file used to serve byte ranges of the raw
+        message (see `generator.RawMsgIndex`)
+        """
+        return self.mailbox.get_raw_index(self.msg_key)
+
     ##################################################################
     #
     def uid(self) -> int | None:
@@ -163,12 +349,26 @@ class SearchContext:
         message is in.
         """
         # Otherwise we populate sequence information from the folder.
-        if self._sequences:
+        if self._sequences is not None:
             return self._sequences
 
         self._sequences = self.mailbox.msg_sequences(self.msg_key)
         return self._sequences
 
+    ####################################################################
+    #
+    def load_mailbox_state(self) -> None:
+        """
+        Look up the message's UID and sequences from the mailbox's in-memory
+        state now, instead of when they are first needed. After this the
+        context only reads the message's file, so it can be used off of the
+        event loop (see `asimap.executor`) while the event loop changes the
+        mailbox's state.
+        """
+        self.uid()
+        if self._sequences is None:
+            self._sequences = self.mailbox.msg_sequences(self.msg_key)
+
 
 ########################################################################
 ########################################################################
@@ -201,6 +401,55 @@ class SearchOp(StrEnum):
 STR_TO_SEARCH_OP = {op_enum.value: op_enum for op_enum in SearchOp}
 
 
+########################################################################
+########################################################################
+#
+class SearchCost(IntEnum):
+    """
+    How expensive a search op is to match against a message, cheapest
+    first. `IMAPSearch.plan()` orders the search keys of an AND or OR by
+    this so the cheap ones get to decide a match before the expensive ones
+    are looked at.
+    """
+
+    # Answered from the mailbox's in-memory sequences, UID's and message
+    # sequence numbers.
+    #
+    STATE = 0
+    # The internal date and size of the message: from the mailbox's columns
+    # of them (see `asimap.msg_columns`), its persisted metadata or a stat()
+    # of the message file.
+    #
+    METADATA = 1
+    # Needs the message's header block.
+    #
+    HEADERS = 2
+    # Needs the entire message.
+    #
+    CONTENT = 3
+
+
+# The cost of the search ops that do not have search keys of their own.
+#
+SEARCH_OP_COST = {
+    SearchOp.ALL: SearchCost.STATE,
+    SearchOp.KEYWORD: SearchCost.STATE,
+    SearchOp.MESSAGE_SET: SearchCost.STATE,
+    SearchOp.UID: SearchCost.STATE,
+    SearchOp.BEFORE: SearchCost.METADATA,
+    SearchOp.ON: SearchCost.METADATA,
+    SearchOp.SINCE: SearchCost.METADATA,
+    SearchOp.LARGER: SearchCost.METADATA,
+    SearchOp.SMALLER: SearchCost.METADATA,
+    SearchOp.HEADER: SearchCost.HEADERS,
+    SearchOp.SENTBEFORE: SearchCost.HEADERS,
+    SearchOp.SENTON: SearchCost.HEADERS,
+    SearchOp.SENTSINCE: SearchCost.HEADERS,
+    SearchOp.BODY: SearchCost.CONTENT,
+    SearchOp.TEXT: SearchCost.CONTENT,
+}
+
+
 ############################################################################
 ############################################################################
 #
@@ -227,7 +476,20 @@ class IMAPSearch:
             raise BadSearchOp(f"'{op}' is not a valid search op")
         self.op = STR_TO_SEARCH_OP[op]
         self.args = kwargs
-        self.ctx: SearchContext
+
+        # How many messages this search key has been matched against and how
+        # many of them matched. For debugging the plan of a search (see
+        # `explain()`)
+        #
+        self.num_evals = 0
+        self.num_matches = 0
+
+        # For HEADER, BODY and TEXT searches that can be answered from the
+        # header or text index: the indices (message sequence number - 1) of
+        # the messages that match, looked up in the index before the search
+        # is run (see `asimap.header_index` and `asimap.text_index`)
+        #
+        self.index_matches: set[int] | None = None
 
     #########################################################################
     #
@@ -259,7 +521,7 @@ class IMAPSearch:
                 result.append(f", n = {self.args['n']}")
             case SearchOp.TEXT | SearchOp.BODY:
                 result.append(f', string = "{self.args["string"]}"')
-            case SearchOp.MESSAGE_SET:
+            case SearchOp.MESSAGE_SET | SearchOp.UID:
                 result.append(f", msg_set = {self.args['msg_set']}")
             case SearchOp.HEADER:
                 result.append(
@@ -285,21 +547,328 @@ class IMAPSearch:
         - `ctx`: The SearchContext that contains the message we are
           applying this search object against and its meta-information
         """
-        self.ctx = ctx
-
         # We look up the method on ourselves that is the search op we
         # are to perform and we call that operation.
         #
-        return await getattr(self, f"_match_{self.op.value}")()
+        self.num_evals += 1
+        result = await getattr(self, f"_match_{self.op.value}")(ctx)
+        if result:
+            self.num_matches += 1
+        return result
+
+    ##################################################################
+    #
+    def cost(self) -> SearchCost:
+        """
+        How expensive this search is to match against a message: that of
+        its most expensive search op.
+        """
+        match self.op:
+            case SearchOp.AND | SearchOp.OR:
+                return max(
+                    (x.cost() for x in self.args["search_key"]),
+                    default=SearchCost.STATE,
+                )
+            case SearchOp.NOT:
+                return self.args["search_key"].cost()
+            case _:
+                return SEARCH_OP_COST[self.op]
+
+    ##################################################################
+    #
+    def plan(self) -> "IMAPSearch":
+        """
+        Return a new search, equivalent to this one, that is cheaper to
+        match against messages:
+
+        - nested AND's and OR's are flattened in to their parent
+        - ALL is dropped from an AND (and an OR with ALL is ALL)
+        - double NOT's cancel out
+        - the search keys of an AND or OR are ordered by their `cost()`
+
+        Since AND and OR stop at the first search key that decides the
+        match, a search like `UNSEEN BODY "invoice"` only looks at the body
+        of the messages that are not seen.
+
+        This search is not modified. The new search has its own evaluation
+        counts.
+        """
+        match self.op:
+            case SearchOp.AND | SearchOp.OR:
+                search_keys: list[IMAPSearch] = []
+                for search_key in self.args["search_key"]:
+                    planned = search_key.plan()
+                    if planned.op == self.op:
+                        search_keys.extend(planned.args["search_key"])
+                    elif planned.op == SearchOp.ALL:
+                        if self.op == SearchOp.OR:
+                            return planned
+                    else:
+                        search_keys.append(planned)
+
+                match search_keys:
+                    case []:
+                        return IMAPSearch("all")
+                    case [search_key]:
+                        return search_key
+                search_keys.sort(key=lambda x: x.cost())
+                return IMAPSearch(self.op.value, search_key=search_keys)
+
+            case SearchOp.NOT:
+                planned = self.args["search_key"].plan()
+                if planned.op == SearchOp.NOT:
+                    return planned.args["search_key"]
+                return IMAPSearch("not", search_key=planned)
+
+            case _:
+                return IMAPSearch(self.op.value, **self.args)
+
+    ##################################################################
+    #
+    def reads_text(self) -> bool:
+        """
+        True if this search has a BODY or TEXT search key that is matched
+        against the text of each message (ie: not answered by the text
+        index.)
+        """
+        return any(
+            x.op in (SearchOp.BODY, SearchOp.TEXT) and x.index_matches is None
+            for x in self.walk()
+        )
+
+    ##################################################################
+    #
+    def walk(self) -> Iterator["IMAPSearch"]:
+        """
+        Yield this search and all of the search keys under it.
+        """
+        yield self
+        match self.op:
+            case SearchOp.AND | SearchOp.OR:
+                for search_key in self.args["search_key"]:
+                    yield from search_key.walk()
+            case SearchOp.NOT:
+                yield from self.args["search_key"].walk()
+
+    ##################################################################
+    #
+    def explain(self, indent: int = 0) -> str:
+        """
+        This search as an indented tree, one search key per line, with
+        the cost of each search key and how many messages it was matched
+        against and matched. For debug logging.
+        """
+        match self.op:
+            case SearchOp.AND | SearchOp.OR:
+                desc = self.op.value
+                children = self.args["search_key"]
+            case SearchOp.NOT:
+                desc = self.op.value
+                children = [self.args["search_key"]]
+            case _:
+                desc = str(self)
+                children = []
+        lines = [
+            f"{'  ' * indent}{desc} (cost: {self.cost().name}, "
+            f"evals: {self.num_evals}, matches: {self.num_matches})"
+        ]
+        lines.extend(x.explain(indent + 1) for x in children)
+        return "\n".join(lines)
+
+    ##################################################################
+    #
+    def match_set(self, mailbox: "Mailbox") -> set[int] | None:
+        """
+        Evaluate this search against the mailbox's in-memory state: the
+        sequences messages are in, their UID's, their message sequence
+        numbers, and the columns of their dates and sizes. No message is
+        looked at.
+
+        Returns the set of the indices (message sequence number - 1) of the
+        messages that match, or None if this search needs to look at the
+        messages themselves.
+
+        Arguments:
+        - `mailbox`: The mailbox being searched
+        """
+        set_fn = getattr(self, f"_set_{self.op.value}", None)
+        return None if set_fn is None else set_fn(mailbox)
+
+    ##################################################################
+    #
+    def split(
+        self, mailbox: "Mailbox"
+    ) -> tuple[set[int] | None, Optional["IMAPSearch"]]:
+        """
+        Split this search in to the part that can be answered from the
+        mailbox's in-memory state (see `match_set()`) and the part that
+        has to be matched against each message.
+
+        Returns a tuple of the indices of the messages that the in-memory
+        part matches (None if there is no in-memory part, ie: all messages
+        are candidates) and the search that the candidates still have to
+        match (None if there is nothing more to match.)
+
+        Arguments:
+        - `mailbox`: The mailbox being searched
+        """
+        if self.op != SearchOp.AND:
+            candidates = self.match_set(mailbox)
+            return (
+                (candidates, None) if candidates is not None else (None, self)
+            )
+
+        candidates = None
+        residual: list[IMAPSearch] = []
+        for search_key in self.args["search_key"]:
+            key_set = search_key.match_set(mailbox)
+            if key_set is None:
+                residual.append(search_key)
+            elif candidates is None:
+                candidates = key_set
+            else:
+                candidates &= key_set
+
+        match residual:
+            case []:
+                return (candidates, None)
+            case [search_key]:
+                return (candidates, search_key)
+            case _:
+                return (candidates, IMAPSearch("and", search_key=residual))
 
     #########################################################################
     #########################################################################
     #
+    # The `_set_<op>` methods evaluate search ops against the mailbox's
+    # in-memory state for `match_set()`. Ops without one need to look at the
+    # messages.
     #
 
     #########################################################################
     #
-    async def _match_keyword(self) -> bool:
+    def _set_all(self, mailbox: "Mailbox") -> set[int]:
+        return set(range(mailbox.num_msgs))
+
+    #########################################################################
+    #
+    def _set_keyword(self, mailbox: "Mailbox") -> set[int]:
+        return mailbox.sequence_indices(flag_to_seq(self.args["keyword"]))
+
+    #########################################################################
+    #
+    def _set_indexed(self, mailbox: "Mailbox") -> set[int] | None:
+        if self.index_matches is None:
+            return None
+        return set(self.index_matches)
+
+    _set_header = _set_body = _set_text = _set_indexed
+
+    #########################################################################
+    #
+    def _set_column(self, mailbox: "Mailbox") -> set[int] | None:
+        """
+        Date and size search keys are answered from the mailbox's columns
+        of internal dates, sizes and sent dates (see `asimap.msg_columns`)
+        """
+        return mailbox.columns.select(self.op, self.args)
+
+    _set_before = _set_on = _set_since = _set_column
+    _set_larger = _set_smaller = _set_column
+    _set_sentbefore = _set_senton = _set_sentsince = _set_column
+
+    #########################################################################
+    #
+    def _set_and(self, mailbox: "Mailbox") -> set[int] | None:
+        result = None
+        for search_key in self.args["search_key"]:
+            key_set = search_key.match_set(mailbox)
+            if key_set is None:
+                return None
+            result = key_set if result is None else result & key_set
+        return result if result is not None else self._set_all(mailbox)
+
+    #########################################################################
+    #
+    def _set_or(self, mailbox: "Mailbox") -> set[int] | None:
+        result: set[int] = set()
+        for search_key in self.args["search_key"]:
+            key_set = search_key.match_set(mailbox)
+            if key_set is None:
+                return None
+            result |= key_set
+        return result
+
+    #########################################################################
+    #
+    def _set_not(self, mailbox: "Mailbox") -> set[int] | None:
+        key_set = self.args["search_key"].match_set(mailbox)
+        if key_set is None:
+            return None
+        return self._set_all(mailbox) - key_set
+
+    #########################################################################
+    #
+    def _set_message_set(self, mailbox: "Mailbox") -> set[int]:
+        """
+        The same as `_match_message_set()`, as a set of ranges of message
+        sequence numbers.
+        """
+        seq_max = mailbox.num_msgs
+        result: set[int] = set()
+        if isinstance(self.args["msg_set"], SavedResult):
+            for idxs in self.args["msg_set"].index_ranges(mailbox.uids):
+                result.update(idxs)
+            return result
+        for elt in self.args["msg_set"]:
+            if isinstance(elt, str) and elt == "*":
+                if seq_max:
+                    result.add(seq_max - 1)
+            elif isinstance(elt, int):
+                if 1 <= elt <= seq_max:
+                    result.add(elt - 1)
+            elif isinstance(elt, tuple):
+                start, end = (seq_max if x == "*" else x for x in elt)
+                result.update(range(max(start, 1) - 1, min(end, seq_max)))
+        return result
+
+    #########################################################################
+    #
+    def _set_uid(self, mailbox: "Mailbox") -> set[int]:
+        """
+        The same as `_match_uid()`. The mailbox's UID's are in ascending
+        order so ranges of UID's are found by bisecting them.
+        """
+        uids = mailbox.uids
+        uid_max = uids[-1] if uids else 0
+        result: set[int] = set()
+        if isinstance(self.args["msg_set"], SavedResult):
+            for idxs in self.args["msg_set"].index_ranges(uids):
+                result.update(idxs)
+            return result
+        for elt in self.args["msg_set"]:
+            if isinstance(elt, str) and elt == "*":
+                if uids:
+                    result.add(len(uids) - 1)
+            elif isinstance(elt, int):
+                idx = bisect_left(uids, elt)
+                if idx < len(uids) and uids[idx] == elt:
+                    result.add(idx)
+            elif isinstance(elt, tuple):
+                start, end = (uid_max if x == "*" else x for x in elt)
+                result.update(
+                    range(bisect_left(uids, start), bisect_right(uids, end))
+                )
+        return result
+
+    #########################################################################
+    #########################################################################
+    #
+    #
+
+    #########################################################################
+    #
+    async def _match_keyword(self, ctx: SearchContext) -> bool:
         """
         True if the given flag is set on this message. In our implementaton
         keywords (aka flags) are indicated by the sequences a message is in.
@@ -315,19 +884,22 @@ class IMAPSearch:
         #       recent sequence or not.
         #
         keyword = flag_to_seq(self.args["keyword"])
-        result = keyword in self.ctx.sequences
+        result = keyword in ctx.sequences
         return result
 
     #########################################################################
     #
-    async def _match_header(self) -> bool:
+    async def _match_header(self, ctx: SearchContext) -> bool:
         """
         Messages that have a header with the specified field-name (as
         defined in [RFC-822]) and that contains the specified string
         in the [RFC-822] field-body.
         """
+        if self.index_matches is not None:
+            return ctx.msg_number - 1 in self.index_matches
+
         header = self.args["header"]
-        msg = self.ctx.msg()
+        msg = ctx.headers()
         return (
             header in msg
             and msg[header].lower().find(self.args["string"]) != -1
@@ -335,29 +907,20 @@ class IMAPSearch:
 
     #########################################################################
     #
-    async def _match_and(self) -> bool:
+    async def _match_and(self, ctx: SearchContext) -> bool:
         """
-        We have a list of search keys. All of them must be True.
+        We have a list of search keys. All of them must be True. They are
+        matched in order, stopping at the first one that is False, so
+        cheaper search keys go first (see `plan()`)
         """
-        tasks = []
-        try:
-            async with asyncio.TaskGroup() as tg:
-                for search_op in self.args["search_key"]:
-                    tasks.append(tg.create_task(search_op.match(self.ctx)))
-        except* Exception as e:
-            for err in e.exceptions:
-                logger.error(
-                    "Unable to perform search operation: %s", err, exc_info=err
-                )
-            raise
-
-        if all(x.result() for x in tasks):
-            return True
-        return False
+        for search_op in self.args["search_key"]:
+            if not await search_op.match(ctx):
+                return False
+        return True
 
     #########################################################################
     #
-    async def _match_all(self) -> bool:
+    async def _match_all(self, ctx: SearchContext) -> bool:
         """
         All messages in the mailbox; the default initial key for
         ANDing.
@@ -366,58 +929,53 @@ class IMAPSearch:
 
     #########################################################################
     #
-    async def _match_or(self) -> bool:
+    async def _match_or(self, ctx: SearchContext) -> bool:
         """
         We have a list of search keys. If any of these are true then
-        the match is true.
-        """
-        tasks = []
-        async with asyncio.TaskGroup() as tg:
-            for search_op in self.args["search_key"]:
-                tasks.append(tg.create_task(search_op.match(self.ctx)))
-        if any(x.result() for x in tasks):
-            return True
+        the match is true. They are matched in order, stopping at the first
+        one that is True.
+        """
+        for search_op in self.args["search_key"]:
+            if await search_op.match(ctx):
+                return True
         return False
 
     #########################################################################
     #
-    async def _match_before(self) -> bool:
+    async def _match_before(self, ctx: SearchContext) -> bool:
         """
         Messages whose internal date is earlier than the specified
         date.
         """
-        internal_date = (self.ctx.internal_date()).date()
+        internal_date = (ctx.internal_date()).date()
         return internal_date < self.args["date"]
 
     #########################################################################
     #
-    async def _match_body(self) -> bool:
+    async def _match_body(self, ctx: SearchContext) -> bool:
         """
         Messages that contain the specified string in the body of the
         message.
         """
-        text = self.args["string"]
-        msg = self.ctx.msg()
-        for msg_part in msg.walk():
-            if msg_part.is_multipart():
-                continue
-            if text in msg_as_string(msg, headers=False).lower():
-                return True
-        return False
+        if self.index_matches is not None:
+            return ctx.msg_number - 1 in self.index_matches
+
+        _, body = ctx.search_text()
+        return self.args["string"] in body
 
     #########################################################################
     #
-    async def _match_larger(self) -> bool:
+    async def _match_larger(self, ctx: SearchContext) -> bool:
         """
         Messages with an [RFC-822] size larger than the specified
         number of octets.
         """
-        size = self.ctx.msg_size()
+        size = ctx.msg_size()
         return size > self.args["n"]
 
     #########################################################################
     #
-    async def _match_message_set(self) -> bool:
+    async def _match_message_set(self, ctx: SearchContext) -> bool:
         """
         Messages with message sequence numbers corresponding to the
         specified message sequence number set
@@ -428,32 +986,34 @@ class IMAPSearch:
         One trick, an integer may be '*' which means the last message
         sequence number in our mailbox.
         """
-        msg_number = self.ctx.msg_number
+        if isinstance(self.args["msg_set"], SavedResult):
+            return ctx.uid() in self.args["msg_set"]
+        msg_number = ctx.msg_number
         for elt in self.args["msg_set"]:
             if isinstance(elt, str) and elt == "*":
-                if msg_number == self.ctx.seq_max:
+                if msg_number == ctx.seq_max:
                     return True
             elif isinstance(elt, int):
                 if elt == msg_number:
                     return True
             elif isinstance(elt, tuple):
                 if isinstance(elt[1], str) and elt[1] == "*":
-                    elt = (elt[0], self.ctx.seq_max)
+                    elt = (elt[0], ctx.seq_max)
                 if msg_number >= elt[0] and msg_number <= elt[1]:
                     return True
         return False
 
     #########################################################################
     #
-    async def _match_not(self) -> bool:
+    async def _match_not(self, ctx: SearchContext) -> bool:
         """
         Messages that do not match the specified search key.
         """
-        return not await self.args["search_key"].match(self.ctx)
+        return not await self.args["search_key"].match(ctx)
 
     #########################################################################
     #
-    async def _match_on(self) -> bool:
+    async def _match_on(self, ctx: SearchContext) -> bool:
         """
         Messages whose internal date is within the specified date.
 
@@ -462,71 +1022,62 @@ class IMAPSearch:
         vague about this and just says what is listed above 'within
         the specific date')
         """
-        internal_date = (self.ctx.internal_date()).date()
+        internal_date = (ctx.internal_date()).date()
         return internal_date == self.args["date"]
 
     #########################################################################
     #
-    async def _match_sentbefore(self) -> bool:
+    async def _match_sentbefore(self, ctx: SearchContext) -> bool:
         """
         Messages whose [RFC-822] Date: header is earlier than the
         specified date.
         """
-        msg = self.ctx.msg()
-        if "date" not in msg:
-            return False
-        msg_date = parsedate(msg["date"]).date()
-        return msg_date < self.args["date"]
+        msg_date = ctx.sent_date()
+        return msg_date is not None and msg_date < self.args["date"]
 
     #########################################################################
     #
-    async def _match_senton(self) -> bool:
+    async def _match_senton(self, ctx: SearchContext) -> bool:
         """
         Messages whose [RFC-822] Date: header is within the specified
         date.
         """
-        msg = self.ctx.msg()
-        if "date" not in msg:
-            return False
-        msg_date = parsedate(msg["date"]).date()
-        return msg_date == self.args["date"]
+        msg_date = ctx.sent_date()
+        return msg_date is not None and msg_date == self.args["date"]
 
     #########################################################################
     #
-    async def _match_sentsince(self) -> bool:
+    async def _match_sentsince(self, ctx: SearchContext) -> bool:
         """
         Messages whose [RFC-822] Date: header is later than the
         specified date.
         """
-        msg = self.ctx.msg()
-        if "date" not in msg:
-            return False
-        msg_date = parsedate(msg["date"]).date()
-        return msg_date >= self.args["date"]
+        msg_date = ctx.sent_date()
+        return msg_date is not None and msg_date >= self.args["date"]
 
     #########################################################################
     #
-    async def _match_since(self) -> bool:
+    async def _match_since(self, ctx: SearchContext) -> bool:
         """
         Messages whose internal date is within or later than the
         specified date.
         """
-        internal_date = (self.ctx.internal_date()).date()
+        internal_date = (ctx.internal_date()).date()
         return internal_date >= self.args["date"]
 
     #########################################################################
     #
-    async def _match_smaller(self) -> bool:
+    async def _match_smaller(self, ctx: SearchContext) -> bool:
         """
         Messages with an [RFC-822] size larger than the specified
         number of octets.
         """
-        size = self.ctx.msg_size()
+        size = ctx.msg_size()
         return size < self.args["n"]
 
     #########################################################################
     #
-    async def _match_text(self) -> bool:
+    async def _match_text(self, ctx: SearchContext) -> bool:
         """
         Messages that contain the specified string in the header
         (including MIME header fields) or body of the message.  Servers
@@ -537,34 +1088,36 @@ class IMAPSearch:
 
         NOTE: We do not do such fancy text searching.
         """
+        if self.index_matches is not None:
+            return ctx.msg_number - 1 in self.index_matches
+
         # Look in the headers.. and if it is not in the headers, look
         # in the body.
         #
         text = self.args["string"]
-        msg = self.ctx.msg()
-        msg_text = msg_as_string(msg, headers=True).lower()
-        if text in msg_text:
-            return True
-        return False
+        headers, body = ctx.search_text()
+        return text in headers or text in body
 
     #########################################################################
     #
-    async def _match_uid(self) -> bool:
+    async def _match_uid(self, ctx: SearchContext) -> bool:
         """
         Messages with unique identifiers corresponding to the
         specified unique identifier set.
         """
-        uid = self.ctx.uid()
+        uid = ctx.uid()
+        if isinstance(self.args["msg_set"], SavedResult):
+            return uid in self.args["msg_set"]
         for elt in self.args["msg_set"]:
             if isinstance(elt, str) and elt == "*":
-                if uid == self.ctx.uid_max:
+                if uid == ctx.uid_max:
                     return True
             elif isinstance(elt, int):
                 if elt == uid:
                     return True
             elif isinstance(elt, tuple):
                 if isinstance(elt[1], str) and elt[1] == "*":
-                    elt = (elt[0], self.ctx.uid_max)
+                    elt = (elt[0], ctx.uid_max)
                 if uid >= elt[0] and uid <= elt[1]:
                     return True
         return False
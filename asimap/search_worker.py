@@ -0,0 +1,93 @@
+"""
+Matching SEARCH's in worker processes.
+
+A SEARCH BODY or TEXT that is not answered by the text index has to read
+and decode the text of every message it looks at. In a large mailbox that
+keeps the user server busy on one core. When a server has SEARCH processes
+(see `executor.search_pool()`), the messages such a SEARCH has to look at
+are split in to chunks that are sent, along with what is left of the
+SEARCH after everything answered from the mailbox's in-memory state, to
+them. A worker reads the messages in a chunk by path, matches the SEARCH
+against each one, and sends back the ones that matched. The user server
+merges the results back in to message sequence order (see
+`Mailbox.search()`)
+
+The workers share their folders, and the caches of those folders, with the
+FETCH render processes (see `asimap.fetch_worker`)
+"""
+
+# system imports
+#
+import asyncio
+
+# Project imports
+#
+from .fetch_worker import WorkerFolder, worker_folder
+from .search import IMAPSearch, SearchContext
+
+# A message to match: its index in the mailbox, message key, UID, and the
+# sequences it is in.
+#
+type SearchJob = tuple[int, int, int, list[str]]
+
+# The result of a chunk of SearchJob's: the indices of the messages that
+# matched, in order, and the number of characters of text the worker had to
+# decode to match them.
+#
+type SearchJobResult = tuple[list[int], int]
+
+
+####################################################################
+#
+def search_chunk(
+    path: str,
+    name: str,
+    uid_vv: int,
+    seq_max: int,
+    uid_max: int,
+    search: IMAPSearch,
+    jobs: list[SearchJob],
+) -> SearchJobResult:
+    """
+    Run in a worker process: match `search` against each of the messages in
+    `jobs`.
+
+    Arguments:
+    - `path`: The path to the mailbox's MH folder
+    - `name`: The name of the mailbox
+    - `uid_vv`: The mailbox's UID validity value
+    - `seq_max`: The largest message sequence number in the mailbox
+    - `uid_max`: The largest UID in the mailbox
+    - `search`: The search to match each message against
+    - `jobs`: The messages to match
+    """
+    folder = worker_folder(path, name)
+    folder.uid_vv = uid_vv
+    folder.uids = {msg_key: uid for _, msg_key, uid, _ in jobs}
+    folder.seqs = {msg_key: seqs for _, msg_key, _, seqs in jobs}
+
+    decoded = folder.search_text_decoded
+    matches = asyncio.run(_match_jobs(folder, seq_max, uid_max, search, jobs))
+    return (matches, folder.search_text_decoded - decoded)
+
+
+####################################################################
+#
+async def _match_jobs(
+    folder: WorkerFolder,
+    seq_max: int,
+    uid_max: int,
+    search: IMAPSearch,
+    jobs: list[SearchJob],
+) -> list[int]:
+    """
+    The indices of the messages in `jobs` that `search` matches.
+    """
+    matches: list[int] = []
+    for idx, msg_key, _, _ in jobs:
+        # IMAP messages are numbered starting from 1.
+        #
+        ctx = SearchContext(folder, msg_key, idx + 1, seq_max, uid_max)
+        if await search.match(ctx):
+            matches.append(idx)
+    return matches
@@ -34,6 +34,7 @@ from pytest_mock import MockerFixture
 #
 import asimap.auth
 
+from ..generator import get_msg_size, raw_msg_as_bytes
 from ..mbox import Mailbox
 from ..server import IMAPClient, IMAPServer
 from ..user_server import (
@@ -82,6 +83,21 @@ def client_push_responses(
     return results
 
 
+####################################################################
+#
+def expected_msg_size(mbox: Mailbox, msg_key: int) -> int:
+    """
+    The size of a message as sent to an IMAP client for a FETCH of the entire
+    message: the raw message file with CRLF line endings if it passes the
+    checks for being sent as is, otherwise the rendered message.
+    """
+    with open(mbox.mailbox.get_message_path(msg_key), "rb") as f:
+        raw_msg = raw_msg_as_bytes(f)
+    if raw_msg is not None:
+        return len(raw_msg)
+    return get_msg_size(mbox.get_msg(msg_key))
+
+
 ####################################################################
 #
 def decode_headers(headers: list[str]) -> list[str]:
@@ -675,6 +691,17 @@ def big_static_email_bytes(
     return static_email_factory_bytes(10)
 
 
+####################################################################
+#
+async def indexed(mbox: Mailbox) -> None:
+    """
+    Wait for the messages a resync found to be added to the mailbox's
+    header index in the background, so tests do not race with it.
+    """
+    if mbox.header_index.task is not None:
+        await mbox.header_index.task
+
+
 ####################################################################
 #
 @pytest_asyncio.fixture
@@ -697,6 +724,7 @@ async def mailbox_with_big_static_email(
     seqs["unseen"] = [msg_key]
     m_folder.set_sequences(seqs)
     mbox = await server.get_mailbox(NAME)
+    await indexed(mbox)
     return mbox
 
 
@@ -724,6 +752,7 @@ async def mailbox_with_mimekit_email(
     seqs["unseen"] = STATIC_EMAIL_MSG_KEYS
     m_folder.set_sequences(seqs)
     mbox = await server.get_mailbox(NAME)
+    await indexed(mbox)
     return mbox
 
 
@@ -751,6 +780,7 @@ async def mailbox_with_problematic_email(
     seqs["unseen"] = STATIC_EMAIL_MSG_KEYS
     m_folder.set_sequences(seqs)
     mbox = await server.get_mailbox(NAME)
+    await indexed(mbox)
     return mbox
 
 
@@ -769,4 +799,5 @@ async def mailbox_with_bunch_of_email(
     bunch_of_email_in_folder(folder=NAME)
     server = imap_user_server
     mbox = await server.get_mailbox(NAME)
+    await indexed(mbox)
     return mbox
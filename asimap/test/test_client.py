@@ -16,6 +16,7 @@ from typing import Any
 #
 import pytest
 from faker import Faker
+from pytest_mock import MockerFixture
 
 from ..auth import PWUser
 
@@ -30,6 +31,7 @@ from ..client import (
     PreAuthenticated,
 )
 from ..constants import SPECIAL_USE_ATTRS
+from ..fetch import FetchLiteral
 from ..mbox import Mailbox
 from ..parse import IMAPClientCommand, StoreAction
 from ..user_server import IMAPClientProxy, IMAPUserServer
@@ -775,6 +777,103 @@ async def test_authenticated_client_search(
     expected = f"* SEARCH {' '.join(str(x) for x in msg_keys)}"
     assert results == [expected, "A001 OK SEARCH command completed"]
 
+    # ESEARCH result options return a sequence set instead of every number.
+    #
+    cmd = IMAPClientCommand("A002 SEARCH RETURN (MIN MAX COUNT ALL) UNSEEN")
+    cmd.parse()
+    await client_handler.command(cmd)
+    results = client_push_responses(imap_client)
+    expected = (
+        f'* ESEARCH (TAG "A002") MIN 1 MAX {len(msg_keys)} '
+        f"COUNT {len(msg_keys)} ALL 1:{len(msg_keys)}"
+    )
+    assert results == [expected, "A002 OK SEARCH command completed"]
+
+    cmd = IMAPClientCommand("A003 UID SEARCH RETURN (MIN COUNT) FLAGGED")
+    cmd.parse()
+    await client_handler.command(cmd)
+    results = client_push_responses(imap_client)
+    expected = '* ESEARCH (TAG "A003") UID COUNT 0'
+    assert results == [expected, "A003 OK SEARCH command completed"]
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_authenticated_client_search_save(
+    mailbox_with_bunch_of_email: Mailbox,
+    imap_user_server_and_client: tuple[IMAPUserServer, IMAPClientProxy],
+) -> None:
+    """
+    SEARCH RETURN (SAVE) saves its result as `$` which later commands can
+    use as a message set. It follows its messages across an EXPUNGE.
+    """
+    server, imap_client = imap_user_server_and_client
+    _ = mailbox_with_bunch_of_email
+    client_handler = Authenticated(imap_client, server)
+    mbox = await server.get_mailbox("inbox")
+
+    cmd = IMAPClientCommand("A001 SELECT INBOX")
+    cmd.parse()
+    await client_handler.command(cmd)
+    client_push_responses(imap_client)
+
+    await mbox.store([2, 4, 6], StoreAction.ADD_FLAGS, [r"\Flagged"])
+    uids = [mbox.uids[1], mbox.uids[3], mbox.uids[5]]
+
+    # SAVE by itself sends no ESEARCH response.
+    #
+    cmd = IMAPClientCommand("A002 SEARCH RETURN (SAVE) FLAGGED")
+    cmd.parse()
+    await client_handler.command(cmd)
+    results = client_push_responses(imap_client)
+    assert results == ["A002 OK SEARCH command completed"]
+    assert client_handler.saved_result.ranges == [(x, x) for x in uids]
+
+    cmd = IMAPClientCommand("A003 SEARCH $")
+    cmd.parse()
+    await client_handler.command(cmd)
+    results = client_push_responses(imap_client)
+    assert results == ["* SEARCH 2 4 6", "A003 OK SEARCH command completed"]
+
+    cmd = IMAPClientCommand("A004 STORE 2 +FLAGS.SILENT (\\Deleted)")
+    cmd.parse()
+    await client_handler.command(cmd)
+    cmd = IMAPClientCommand("A005 EXPUNGE")
+    cmd.parse()
+    await client_handler.command(cmd)
+    client_push_responses(imap_client)
+    assert client_handler.saved_result.ranges == [(x, x) for x in uids[1:]]
+
+    cmd = IMAPClientCommand("A006 UID FETCH $ (FLAGS)")
+    cmd.parse()
+    await client_handler.command(cmd)
+    results = client_push_responses(imap_client)
+    for result, msg_seq_num, uid in zip(results, (3, 5), uids[1:]):
+        assert isinstance(result, bytes)  # Making mypy happy
+        assert result.startswith(f"* {msg_seq_num} FETCH ".encode())
+        assert result.endswith(f"UID {uid})".encode())
+    assert results[-1] == "A006 OK FETCH command completed"
+
+    # SAVE with MIN saves only the lowest matching message.
+    #
+    cmd = IMAPClientCommand("A007 UID SEARCH RETURN (SAVE MIN) FLAGGED")
+    cmd.parse()
+    await client_handler.command(cmd)
+    results = client_push_responses(imap_client)
+    assert results == [
+        f'* ESEARCH (TAG "A007") UID MIN {uids[1]}',
+        "A007 OK SEARCH command completed",
+    ]
+    assert client_handler.saved_result.ranges == [(uids[1], uids[1])]
+
+    # Selecting a mailbox empties the saved result.
+    #
+    cmd = IMAPClientCommand("A008 SELECT INBOX")
+    cmd.parse()
+    await client_handler.command(cmd)
+    assert not client_handler.saved_result
+
 
 ####################################################################
 #
@@ -886,6 +985,54 @@ async def test_authenticated_client_fetch_lotta_fields(
     assert results[-1] == "A001 OK FETCH command completed\r\n"
 
 
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_authenticated_client_fetch_streamed_literal(
+    mailbox_with_bunch_of_email: Mailbox,
+    imap_user_server_and_client: tuple[IMAPUserServer, IMAPClientProxy],
+    mocker: MockerFixture,
+) -> None:
+    """
+    FETCH's of large messages send the message as a literal streamed from
+    the message file.
+    """
+    server, imap_client = imap_user_server_and_client
+    _ = mailbox_with_bunch_of_email
+    client_handler = Authenticated(imap_client, server)
+    mocker.patch("asimap.fetch.STREAM_LITERAL_THRESHOLD", 0)
+
+    streamed: list[bytes] = []
+
+    async def push_literal(
+        literal: FetchLiteral, timeout_cm: asyncio.Timeout | None = None
+    ) -> None:
+        streamed.append(literal.prefix)
+        streamed.append(b"".join([x async for x in literal.chunks()]))
+
+    mocker.patch.object(imap_client, "push_literal", side_effect=push_literal)
+
+    mbox = await server.get_mailbox("inbox")
+    cmd = IMAPClientCommand("A004 SELECT INBOX")
+    cmd.parse()
+    await client_handler.command(cmd)
+    client_push_responses(imap_client)
+
+    cmd = IMAPClientCommand("A001 FETCH 1 (UID BODY.PEEK[])")
+    cmd.parse()
+    await client_handler.command(cmd)
+    results = client_push_responses(imap_client, strip=False)
+
+    msg_path = mbox.mailbox.get_message_path(mbox.msg_keys[0])
+    raw = msg_path.read_bytes().replace(b"\n", b"\r\n")
+    assert results == [
+        b"* 1 FETCH (UID %d " % mbox.uids[0],
+        b")\r\n",
+        "A001 OK FETCH command completed\r\n",
+    ]
+    assert streamed == [b"BODY[] {%d}\r\n" % len(raw), raw]
+
+
 ####################################################################
 #
 @pytest.mark.asyncio
@@ -88,5 +88,38 @@ async def test_db_init_migrate(db: Database) -> None:
             "sequence": "TEXT",
             "date": "TEXT",
         },
+        "msg_metadata": {
+            "mailbox_id": "INTEGER",
+            "uid_vv": "INTEGER",
+            "uid": "INTEGER",
+            "size": "INTEGER",
+            "internaldate": "REAL",
+            "envelope": "BLOB",
+            "body": "BLOB",
+            "bodystructure": "BLOB",
+            "sentdate": "INTEGER",
+            "mtime_ns": "INTEGER",
+            "file_size": "INTEGER",
+        },
+        "msg_headers": {
+            "mailbox_id": "INTEGER",
+            "uid_vv": "INTEGER",
+            "uid": "INTEGER",
+            "from_addr": "TEXT",
+            "to_addr": "TEXT",
+            "cc_addr": "TEXT",
+            "bcc_addr": "TEXT",
+            "subject": "TEXT",
+            "message_id": "TEXT",
+            "in_reply_to": "TEXT",
+            "refs": "TEXT",
+        },
+        "msg_text": {
+            "id": "INTEGER",
+            "mailbox_id": "INTEGER",
+            "uid_vv": "INTEGER",
+            "uid": "INTEGER",
+            "size": "INTEGER",
+        },
     }
     assert schema == expected
@@ -0,0 +1,99 @@
+"""
+Test running work off of the event loop.
+"""
+
+# System imports
+#
+import asyncio
+import threading
+import time
+from pathlib import Path
+
+# 3rd party imports
+#
+import pytest
+from pytest_mock import MockerFixture
+
+# Project imports
+#
+from .. import executor
+from ..executor import (
+    EXECUTOR_COUNTS,
+    LoopLagMonitor,
+    can_run_in_process,
+    run_in_process,
+    run_in_thread,
+)
+from ..mbox import Mailbox, mbox_msg_path
+from ..msg_files import parse_msg_file
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_run_in_thread(mocker: MockerFixture) -> None:
+    EXECUTOR_COUNTS.clear()
+    thread = await run_in_thread(threading.current_thread)
+    assert thread is not threading.current_thread()
+    assert EXECUTOR_COUNTS["thread"] == 1
+
+    # With no FETCH threads the function is run on the event loop.
+    #
+    mocker.patch("asimap.executor.FETCH_THREADS", 0)
+    thread = await run_in_thread(threading.current_thread)
+    assert thread is threading.current_thread()
+    assert EXECUTOR_COUNTS["thread"] == 1
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_run_in_process(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    Parsing a message in the process pool gives the same message as parsing
+    it in the thread. Only FETCH threads use the process pool.
+    """
+    mbox = mailbox_with_bunch_of_email
+    path = mbox_msg_path(mbox.mailbox, mbox.msg_keys[0])
+    mocker.patch("asimap.executor.PARSE_PROCESSES", 1)
+    EXECUTOR_COUNTS.clear()
+
+    def parse(path: Path) -> tuple[bool, bytes]:
+        msg = run_in_process(parse_msg_file, path)
+        return can_run_in_process(), msg.as_bytes()
+
+    try:
+        assert not can_run_in_process()
+        in_process, msg_bytes = await run_in_thread(parse, path)
+        assert in_process
+        assert EXECUTOR_COUNTS["process"] == 1
+        assert msg_bytes == parse_msg_file(path).as_bytes()
+        assert msg_bytes == mbox.get_msg(mbox.msg_keys[0]).as_bytes()
+    finally:
+        executor.shutdown_executors()
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_loop_lag_monitor() -> None:
+    monitor = LoopLagMonitor(interval=0.01)
+    task = asyncio.create_task(monitor.run())
+    await asyncio.sleep(0.05)
+
+    # Block the event loop.
+    #
+    time.sleep(0.2)
+    await asyncio.sleep(0.05)
+    task.cancel()
+
+    assert monitor.num_samples > 2
+    assert monitor.max_lag >= 0.15
+    assert monitor.num_stalls >= 1
+    assert monitor.total_lag >= monitor.max_lag
+
+    monitor.reset_stats()
+    assert monitor.num_samples == 0
+    assert monitor.max_lag == 0.0
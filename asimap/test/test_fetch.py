@@ -20,8 +20,16 @@ from pytest_mock import MockerFixture
 # Project imports
 #
 from ..constants import REV_SYSTEM_FLAG_MAP, SYSTEM_FLAGS
-from ..fetch import STR_TO_FETCH_OP, FetchAtt, FetchOp, encode_header
-from ..generator import msg_as_bytes, msg_headers_as_bytes
+from ..fetch import (
+    FETCH_BODY_PATHS,
+    STR_TO_FETCH_OP,
+    FetchAtt,
+    FetchOp,
+    FetchPlan,
+    FetchPlanKind,
+    encode_header,
+)
+from ..generator import RawMsgIndex, msg_as_bytes, msg_headers_as_bytes
 from ..mbox import Mailbox, mbox_msg_path
 from ..parse import _lit_ref_re
 from ..search import SearchContext
@@ -385,6 +393,10 @@ def test_fetch_envelope(
     assert result[9:] == expected_envelope
 
 
+# NOTE: These messages all pass the checks for being sent raw so their size is
+#       the size of the message file (as written by MH) with CRLF line
+#       endings.
+#
 MSG_SIZE_BY_MSG_KEY = [
     pytest.param(1, 253, id="1"),
     pytest.param(2, 271, id="2"),
@@ -395,16 +407,14 @@ MSG_SIZE_BY_MSG_KEY = [
     pytest.param(7, 1018, id="7"),
     pytest.param(8, 586, id="8"),
     pytest.param(9, 586, id="9"),
-    # pytest.param(10, 28202, id="10"),  # python 3.12.7
-    pytest.param(10, 28067, id="10"),  # python 3.12.9
-    pytest.param(11, 2440, id="11"),
-    pytest.param(12, 2438, id="12"),
+    pytest.param(10, 28097, id="10"),
+    pytest.param(11, 2416, id="11"),
+    pytest.param(12, 2414, id="12"),
     pytest.param(13, 1441, id="13"),
     pytest.param(14, 717, id="14"),
-    pytest.param(15, 1221, id="15"),
-    pytest.param(16, 9267, id="16"),
-    pytest.param(17, 584, id="17"),
-    # pytest.param(17, 579, id="17"),
+    pytest.param(15, 1172, id="15"),
+    pytest.param(16, 7788, id="16"),
+    pytest.param(17, 582, id="17"),
     pytest.param(18, 264, id="18"),
     pytest.param(19, 467, id="19"),
     pytest.param(20, 2686, id="20"),
@@ -435,10 +445,10 @@ def test_fetch_rfc822_size(
 
 
 PROBLEMATIC_MSG_SIZE_BY_MSG_KEY = [
-    pytest.param(1, 1162, id="1"),
-    pytest.param(2, 4393, id="2"),
-    pytest.param(3, 26083, id="3"),
-    pytest.param(4, 9629, id="4"),
+    pytest.param(1, 1158, id="1"),
+    pytest.param(2, 4399, id="2"),
+    pytest.param(3, 25966, id="3"),
+    pytest.param(4, 9527, id="4"),
 ]
 
 
@@ -855,8 +865,10 @@ async def test_fetch_body_braces(mailbox_with_bunch_of_email: Mailbox) -> None:
     for msg_idx, msg_key in enumerate(msg_keys):
         msg_idx += 1
         ctx = SearchContext(mbox, msg_key, msg_idx, seq_max, uid_max)
-        email_msg = ctx.msg()
-        msg_body = msg_as_bytes(email_msg)
+        # Messages that pass the raw checks are sent as is (with CRLF line
+        # endings), otherwise they are rendered by the generator.
+        #
+        msg_body = ctx.raw_msg() or msg_as_bytes(ctx.msg())
         size = len(msg_body)
         mid = int(size / 2)
         fetch = FetchAtt(FetchOp.BODY, section=[], partial=(0, mid))
@@ -991,6 +1003,209 @@ class TestBadlyEncodedHeaders:
         assert b"From:" in headers
 
 
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_fetch_body_raw_and_generator_paths(
+    mailbox_with_bunch_of_email: Mailbox,
+) -> None:
+    """
+    A FETCH of the entire message sends the message file as is unless it
+    fails the raw checks, in which case the message is rendered by the
+    generator.
+    """
+    mbox = mailbox_with_bunch_of_email
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+    msg_key = mbox.msg_keys[0]
+    msg_path = mbox_msg_path(mbox.mailbox, msg_key)
+    FETCH_BODY_PATHS.clear()
+
+    ctx = SearchContext(mbox, msg_key, 1, seq_max, uid_max)
+    result = FetchAtt(FetchOp.BODY, section=[], peek=True).fetch(ctx)
+    raw = msg_path.read_bytes().replace(b"\n", b"\r\n")
+    assert result == b"BODY[] {%d}\r\n%b" % (len(raw), raw)
+    assert FETCH_BODY_PATHS["raw"] == 1
+
+    # Put an 8-bit character in the subject. Now the message has to be
+    # rendered by the generator.
+    #
+    msg_path.write_bytes(b"Subject: caf\xc3\xa9\n" + msg_path.read_bytes())
+    ctx = SearchContext(mbox, msg_key, 1, seq_max, uid_max)
+    result = FetchAtt(FetchOp.BODY, section=[], peek=True).fetch(ctx)
+    msg_body = msg_as_bytes(ctx.msg())
+    assert result == b"BODY[] {%d}\r\n%b" % (len(msg_body), msg_body)
+    assert ctx.msg_size() == len(msg_body)
+    assert FETCH_BODY_PATHS["generator"] == 1
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_fetch_body_partial_chunks(
+    mailbox_with_mimekit_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    Fetching a message, or a section of one, in pieces (the way clients
+    fetch large attachments) gives the same bytes as fetching all of it,
+    without converting the message file or rendering the section for every
+    piece.
+    """
+    mbox = mailbox_with_mimekit_email
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+    msg_key = max(
+        (k for k in mbox.msg_keys if mbox.get_msg(k).is_multipart()),
+        key=lambda k: mbox_msg_path(mbox.mailbox, k).stat().st_size,
+    )
+    msg_num = mbox.msg_keys.index(msg_key) + 1
+    chunk_size = 1000
+
+    def fetch_in_pieces(section: list[int | str]) -> tuple[bytes, bytes]:
+        ctx = SearchContext(mbox, msg_key, msg_num, seq_max, uid_max)
+        whole = FetchAtt(FetchOp.BODY, section=section).fetch(ctx)
+        whole = whole[whole.find(b"}") + 3 :]
+        pieces = []
+        start = 0
+        while True:
+            # Each piece is a separate FETCH command.
+            #
+            ctx = SearchContext(mbox, msg_key, msg_num, seq_max, uid_max)
+            fetch = FetchAtt(
+                FetchOp.BODY, section=section, partial=(start, chunk_size)
+            )
+            result = fetch.fetch(ctx)
+            piece = result[result.find(b"}") + 3 :]
+            assert result.startswith(b"%b {%d}" % (bytes(fetch), len(piece)))
+            if not piece:
+                break
+            pieces.append(piece)
+            start += chunk_size
+        return whole, b"".join(pieces)
+
+    build = mocker.spy(RawMsgIndex, "build")
+    get_msg = mocker.spy(mbox, "get_msg")
+
+    whole, pieces = fetch_in_pieces([])
+    assert len(whole) > 2 * chunk_size
+    assert whole == pieces
+    build.assert_called_once()
+    get_msg.assert_not_called()
+
+    # A section of the message is rendered once and the pieces are served
+    # from the section cache.
+    #
+    render = mocker.spy(FetchAtt, "_body")
+    whole, pieces = fetch_in_pieces([2])
+    assert whole
+    assert whole == pieces
+    assert render.call_count == 2
+    assert mbox.section_cache.hits > 0
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_fetch_headers_without_parsing_body(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    ENVELOPE and the top level header sections only load the message's
+    headers, and give the same results as they do from the entire parsed
+    message.
+    """
+    mbox = mailbox_with_bunch_of_email
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+    mbox.msg_cache.clear()
+    hdrs = ["From", "Subject", "Date"]
+    sections: list[list[int | str]] = [
+        ["HEADER"],
+        [["HEADER.FIELDS", hdrs]],  # type: ignore[list-item]
+        [["HEADER.FIELDS.NOT", hdrs]],  # type: ignore[list-item]
+    ]
+
+    get_msg = mocker.spy(mbox, "get_msg")
+    results = {}
+    for msg_num, msg_key in enumerate(mbox.msg_keys, start=1):
+        ctx = SearchContext(mbox, msg_key, msg_num, seq_max, uid_max)
+        fetches = [FetchAtt(FetchOp.ENVELOPE)] + [
+            FetchAtt(FetchOp.BODY, section=x, peek=True) for x in sections
+        ]
+        results[msg_key] = [x.fetch(ctx) for x in fetches]
+    get_msg.assert_not_called()
+
+    for msg_key, result in results.items():
+        msg = mbox.get_msg(msg_key)
+        fetch = FetchAtt(FetchOp.ENVELOPE)
+        assert result[0] == bytes(fetch) + b" " + fetch.envelope(msg)
+        for section, section_result in zip(sections, result[1:], strict=True):
+            fetch = FetchAtt(FetchOp.BODY, section=section, peek=True)
+            assert section_result == bytes(fetch) + b" " + fetch.body(
+                msg, section
+            )
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_fetch_stream(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    FETCH's of entire messages at least STREAM_LITERAL_THRESHOLD in size are
+    streamed from the message file.
+    """
+    mbox = mailbox_with_bunch_of_email
+    msg_key = mbox.msg_keys[0]
+    msg_path = mbox_msg_path(mbox.mailbox, msg_key)
+    ctx = SearchContext(mbox, msg_key, 1, mbox.num_msgs, mbox.uids[-1])
+    fetch = FetchAtt(FetchOp.BODY, section=[], peek=True)
+    assert fetch.stream(ctx) is None
+
+    mocker.patch("asimap.fetch.STREAM_LITERAL_THRESHOLD", 0)
+    assert FetchAtt(FetchOp.BODY, section=["TEXT"]).stream(ctx) is None
+    assert (
+        FetchAtt(FetchOp.BODY, section=[], partial=(0, 10)).stream(ctx) is None
+    )
+
+    literal = fetch.stream(ctx)
+    assert literal
+    assert literal.prefix + b"".join(
+        [x async for x in literal.chunks()]
+    ) == fetch.fetch(ctx)
+
+    assert not literal.inconsistent
+
+    # If the message file changes while we are sending it we can not send
+    # what we promised the client. We still send exactly as many octets as
+    # we promised, padded or truncated.
+    #
+    literal = fetch.stream(ctx)
+    assert literal
+    msg_bytes = msg_path.read_bytes()
+    msg_path.write_bytes(msg_bytes[:100])
+    data = b"".join([x async for x in literal.chunks()])
+    assert len(data) == literal.length
+    assert data.endswith(b" ")
+    assert literal.inconsistent
+
+    literal = fetch.stream(ctx)
+    assert literal
+    msg_path.write_bytes(msg_bytes + msg_bytes)
+    data = b"".join([x async for x in literal.chunks()])
+    assert len(data) == literal.length
+
+    # Even if the file goes away.
+    #
+    literal = fetch.stream(ctx)
+    assert literal
+    msg_path.unlink()
+    data = b"".join([x async for x in literal.chunks()])
+    assert data == b" " * literal.length
+    assert literal.inconsistent
+
+
 ENCODE_HEADER_CASES = [
     pytest.param(
         "hello world",
@@ -1013,6 +1228,79 @@ ENCODE_HEADER_CASES = [
 ]
 
 
+####################################################################
+#
+@pytest.mark.parametrize(
+    "fetch_ops,uid_cmd,kind,fetches_flags,marks_seen",
+    [
+        ([FetchAtt(FetchOp.FLAGS)], True, FetchPlanKind.FLAGS_UID, True, False),
+        ([FetchAtt(FetchOp.UID)], False, FetchPlanKind.FLAGS_UID, False, False),
+        (
+            [FetchAtt(FetchOp.FLAGS), FetchAtt(FetchOp.RFC822_SIZE)],
+            False,
+            FetchPlanKind.METADATA,
+            True,
+            False,
+        ),
+        (
+            [
+                FetchAtt(FetchOp.ENVELOPE),
+                FetchAtt(FetchOp.BODY, section=["HEADER"], peek=True),
+            ],
+            True,
+            FetchPlanKind.HEADERS,
+            False,
+            False,
+        ),
+        (
+            [FetchAtt(FetchOp.BODY, section=[["HEADER.FIELDS", ["From"]]])],
+            False,
+            FetchPlanKind.HEADERS,
+            False,
+            True,
+        ),
+        (
+            [FetchAtt(FetchOp.FLAGS), FetchAtt(FetchOp.BODY, section=[])],
+            True,
+            FetchPlanKind.BODY,
+            True,
+            True,
+        ),
+        (
+            [FetchAtt(FetchOp.BODY, section=[1, "HEADER"], peek=True)],
+            False,
+            FetchPlanKind.BODY,
+            False,
+            False,
+        ),
+        (
+            [FetchAtt(FetchOp.RFC822_TEXT)],
+            False,
+            FetchPlanKind.BODY,
+            False,
+            False,
+        ),
+    ],
+)
+def test_fetch_plan(
+    fetch_ops: list[FetchAtt],
+    uid_cmd: bool,
+    kind: FetchPlanKind,
+    fetches_flags: bool,
+    marks_seen: bool,
+) -> None:
+    plan = FetchPlan(fetch_ops, uid_cmd)
+    assert plan.kind == kind
+    assert plan.fetches_flags == fetches_flags
+    assert plan.marks_seen == marks_seen
+
+    # UID FETCH's always return the UID, exactly once.
+    #
+    num_uids = len([x for x in plan.fetch_ops if x.attribute == FetchOp.UID])
+    assert num_uids == (1 if uid_cmd or fetch_ops[0].attribute == "uid" else 0)
+    assert plan.fetch_ops[: len(fetch_ops)] == fetch_ops
+
+
 ####################################################################
 #
 @pytest.mark.parametrize("hdr,expected,is_rfc2047", ENCODE_HEADER_CASES)
@@ -0,0 +1,108 @@
+"""
+Test rendering FETCH's in worker processes.
+"""
+
+# System imports
+#
+import pickle
+
+# 3rd party imports
+#
+import pytest
+from pytest_mock import MockerFixture
+
+# Project imports
+#
+from ..fetch import FetchAtt, FetchOp, FetchPlan
+from ..fetch_worker import FetchJob, render_fetch_batch
+from ..mbox import Mailbox
+from ..search import MsgMetadata, SearchContext
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_render_fetch_batch(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    A batch rendered by a worker gives the same results as the mailbox does,
+    fills in the metadata it computed, and leaves literals that the user
+    server streams for it to stream.
+    """
+    mbox = mailbox_with_bunch_of_email
+    mbox.sequences["flagged"].add(mbox.msg_keys[0])
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+    plan = FetchPlan(
+        [
+            FetchAtt(FetchOp.FLAGS),
+            FetchAtt(FetchOp.RFC822_SIZE),
+            FetchAtt(FetchOp.BODY, section=[], peek=True),
+        ],
+        uid_cmd=True,
+    )
+
+    # The plan, and what the worker sends back, goes through pickle.
+    #
+    plan.fetch_ops[0].fetch(SearchContext(mbox, mbox.msg_keys[0], 1, 1, 1))
+    plan = pickle.loads(pickle.dumps(plan))
+
+    msg_seq_nums = [3, 1, 2]
+    jobs: list[FetchJob] = []
+    for msg_seq_num in msg_seq_nums:
+        msg_key = mbox.msg_keys[msg_seq_num - 1]
+        uid = mbox.uids[msg_seq_num - 1]
+        jobs.append(
+            (
+                msg_seq_num,
+                msg_key,
+                uid,
+                mbox.msg_sequences(msg_key),
+                MsgMetadata(uid),
+            )
+        )
+    results = render_fetch_batch(
+        str(mbox.mailbox._path),
+        mbox.name,
+        mbox.uid_vv,
+        seq_max,
+        uid_max,
+        plan,
+        jobs,
+        False,
+    )
+    results = pickle.loads(pickle.dumps(results))
+
+    assert [x[0] for x in results] == msg_seq_nums
+    for msg_seq_num, fetched, md in results:
+        ctx = SearchContext(
+            mbox,
+            mbox.msg_keys[msg_seq_num - 1],
+            msg_seq_num,
+            seq_max,
+            uid_max,
+        )
+        assert fetched == [op.fetch(ctx) for op in plan.fetch_ops]
+        assert md is not None
+        assert md.uid == mbox.uids[msg_seq_num - 1]
+        assert md.dirty
+        assert md.size == ctx.msg_size()
+    assert b"\\Flagged" in results[1][1][0]
+
+    # Entire messages that would be streamed are left as None.
+    #
+    mocker.patch("asimap.fetch.STREAM_LITERAL_THRESHOLD", 0)
+    results = render_fetch_batch(
+        str(mbox.mailbox._path),
+        mbox.name,
+        mbox.uid_vv,
+        seq_max,
+        uid_max,
+        plan,
+        jobs,
+        True,
+    )
+    for _, fetched, _ in results:
+        assert fetched[2] is None
+        assert fetched[0] is not None
@@ -0,0 +1,134 @@
+"""
+Test the inotify folder watcher.
+"""
+
+# system imports
+#
+import asyncio
+import contextlib
+from collections.abc import Callable
+from pathlib import Path
+
+# 3rd party imports
+#
+import pytest
+
+# Project imports
+#
+from ..folder_watcher import WATCHER_COUNTS, FolderWatcher
+from ..parse import IMAPClientCommand
+from ..user_server import IMAPUserServer
+from .conftest import EmailFactoryType
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_folder_watcher_reports_changes(tmp_path: Path) -> None:
+    """
+    GIVEN: A folder watcher watching a folder
+    WHEN:  Messages and the sequences file in the folder are written
+    THEN:  The folder is reported as changed once, and only for messages and
+           the sequences file.
+    """
+    (tmp_path / "inbox" / "sub").mkdir(parents=True)
+    reports: list[set[str]] = []
+    watcher = FolderWatcher(tmp_path, reports.append)
+    if not watcher.start():
+        pytest.skip("inotify is not available")
+    try:
+        assert watcher.watch("inbox")
+        assert watcher.watching("inbox")
+        assert not watcher.watch("nosuchfolder")
+
+        # Nothing we care about.
+        #
+        (tmp_path / "inbox" / ".mh_sequences.lock").write_text("")
+        (tmp_path / "inbox" / "sub" / "1").write_text("")
+        await asyncio.sleep(watcher.debounce * 4)
+        assert reports == []
+
+        WATCHER_COUNTS.clear()
+        for i in range(1, 20):
+            (tmp_path / "inbox" / str(i)).write_text("Subject: hi\n\nhi\n")
+        (tmp_path / "inbox" / ".mh_sequences").write_text("unseen: 1-19\n")
+        await asyncio.sleep(watcher.debounce * 4)
+        assert reports == [{"inbox"}]
+        assert WATCHER_COUNTS["reports"] == 1
+
+        # A folder that is renamed is no longer watched under its old name.
+        #
+        (tmp_path / "inbox").rename(tmp_path / "archive")
+        await asyncio.sleep(watcher.debounce * 4)
+        assert not watcher.watching("inbox")
+        assert watcher.watch("archive")
+    finally:
+        watcher.close()
+    assert not watcher.enabled
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_folder_watcher_wakes_mailbox(
+    bunch_of_email_in_folder: Callable[..., Path],
+    imap_user_server: IMAPUserServer,
+    email_factory: EmailFactoryType,
+) -> None:
+    """
+    GIVEN: An active mailbox whose folder is being watched
+    WHEN:  A message is delivered to the folder by something else
+    THEN:  The mailbox notices it right away instead of on its next poll
+    """
+    server = imap_user_server
+    if not server.folder_watcher.start():
+        pytest.skip("inotify is not available")
+    bunch_of_email_in_folder(folder="inbox")
+    mbox = await server.get_mailbox("inbox")
+    await asyncio.sleep(0.2)
+    assert server.folder_watcher.watching("inbox")
+    num_msgs = mbox.num_msgs
+
+    mbox.mailbox.add(email_factory())
+    async with asyncio.timeout(2):
+        while mbox.num_msgs == num_msgs:
+            await asyncio.sleep(0.01)
+    assert mbox.num_msgs == num_msgs + 1
+    assert "Recent" in mbox.msg_sequences(mbox.msg_keys[-1])
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_watched_mailbox_keeps_command_when_interrupted(
+    bunch_of_email_in_folder: Callable[..., Path],
+    imap_user_server: IMAPUserServer,
+) -> None:
+    """
+    GIVEN: A watched mailbox's management task waiting for a command
+    WHEN:  A command is queued in the same loop iteration the wait is
+           cancelled (ie: by its timeout)
+    THEN:  The command is still on the queue for the next wait
+    """
+    bunch_of_email_in_folder(folder="inbox")
+    mbox = await imap_user_server.get_mailbox("inbox")
+    mbox.mgmt_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await mbox.mgmt_task
+
+    imap_cmd = IMAPClientCommand("A001 NOOP\r\n")
+    waiting = asyncio.create_task(mbox._next_command(watched=True))
+    await asyncio.sleep(0)
+    mbox.queue_command(imap_cmd)
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert mbox.task_queue.qsize() == 1
+
+    assert await mbox._next_command(watched=True) is imap_cmd
+
+    waiting = asyncio.create_task(mbox._next_command(watched=True))
+    await asyncio.sleep(0)
+    mbox.folder_changed()
+    async with asyncio.timeout(1):
+        assert await waiting is None
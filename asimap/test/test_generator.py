@@ -18,7 +18,14 @@ import pytest
 # Project imports
 #
 # from ..generator import msg_as_string, msg_headers_as_string
-from ..generator import msg_as_bytes, msg_headers_as_bytes
+from ..generator import (
+    RawMsgIndex,
+    crlf_chunks,
+    msg_as_bytes,
+    msg_headers_as_bytes,
+    msg_search_text,
+    raw_msg_as_bytes,
+)
 from .conftest import (
     PROBLEMATIC_EMAIL_MSG_KEYS,
     STATIC_EMAIL_MSG_KEYS,
@@ -266,3 +273,122 @@ def test_generator_problematic_email(
     assert msg_text
     msg_hdrs = msg_headers_as_bytes(msg)
     assert msg_hdrs
+
+
+####################################################################
+#
+@pytest.mark.parametrize(
+    "raw,expected",
+    [
+        (b"a\nb\n", b"a\r\nb\r\n"),
+        (b"a\r\nb\r\n", b"a\r\nb\r\n"),
+        (b"a\rb\n\r\nc", b"a\r\nb\r\n\r\nc"),
+        (b"a\r", b"a\r\n"),
+    ],
+)
+def test_crlf_chunks(raw: bytes, expected: bytes) -> None:
+    """
+    Line endings are converted to CRLF regardless of where the chunk
+    boundaries fall.
+    """
+    for chunk_size in (1, 2, 3, 1024):
+        result = b"".join(crlf_chunks(BytesIO(raw), chunk_size=chunk_size))
+        assert result == expected
+
+
+####################################################################
+#
+def test_raw_msg_as_bytes() -> None:
+    msg = b"From: foo@example.com\nSubject: hi\n\nbody\n"
+    assert raw_msg_as_bytes(BytesIO(msg)) == msg.replace(b"\n", b"\r\n")
+    unterminated = raw_msg_as_bytes(BytesIO(msg.rstrip()))
+    assert unterminated is not None
+    assert unterminated.endswith(b"body\r\n")
+
+    # Messages that fail our checks have to go through the generator.
+    #
+    assert (
+        raw_msg_as_bytes(BytesIO(b"From foo@example.com Mon\n" + msg)) is None
+    )
+    assert raw_msg_as_bytes(BytesIO(msg + b"\0")) is None
+    assert raw_msg_as_bytes(BytesIO(b"Subject: caf\xc3\xa9\n\nbody")) is None
+    assert raw_msg_as_bytes(BytesIO(b"")) is None
+
+    # 8-bit bodies are fine.
+    #
+    assert raw_msg_as_bytes(BytesIO(b"Subject: x\n\ncaf\xc3\xa9"))
+
+
+####################################################################
+#
+@pytest.mark.parametrize(
+    "raw",
+    [
+        b"From: foo@example.com\nSubject: hi\n\nbody\nmore body\n",
+        b"Subject: hi\r\n\r\nline one\r\nline two\rline three",
+        b"Subject: hi\r\n\r\ncaf\xc3\xa9\r",
+        b"Subject: caf\xc3\xa9\n\nbody",
+        b"",
+    ],
+)
+def test_raw_msg_index(raw: bytes) -> None:
+    """
+    Every byte range read through the index matches the same range of what
+    `raw_msg_as_bytes()` returns, regardless of chunk size.
+    """
+    expected = raw_msg_as_bytes(BytesIO(raw))
+    for chunk_size in (1, 2, 3, 7, 1024):
+        index = RawMsgIndex.build(BytesIO(raw), chunk_size=chunk_size)
+        assert index.valid == (expected is not None)
+        if expected is None:
+            continue
+        assert index.size == len(expected)
+        for start in range(len(expected) + 2):
+            for length in (1, 3, 10, 100):
+                result = index.read_range(BytesIO(raw), start, length)
+                assert result == expected[start : start + length]
+
+
+####################################################################
+#
+def test_msg_search_text() -> None:
+    """
+    The search text of a message is its decoded headers, including those
+    of its MIME parts, and the decoded content of its text parts. The
+    content of non-text parts is skipped.
+    """
+    raw = (
+        b"From: Alice <alice@example.com>\n"
+        b"Subject: =?utf-8?q?Caf=C3=A9_Invoice?=\n"
+        b"MIME-Version: 1.0\n"
+        b'Content-Type: multipart/mixed; boundary="XX"\n'
+        b"\n"
+        b"--XX\n"
+        b"Content-Type: text/plain; charset=utf-8\n"
+        b"Content-Transfer-Encoding: base64\n"
+        b"\n"
+        b"UGxlYXNlIHBheSB0aGUgaW52b2ljZSwgbWVyY2kgYmVhdWNvdXAuIMOg\n"
+        b"--XX\n"
+        b"Content-Type: text/plain; charset=unknown-8bit\n"
+        b"Content-Transfer-Encoding: 8bit\n"
+        b"\n"
+        b"Gr\xfc\xdfe\n"
+        b"--XX\n"
+        b"Content-Type: application/octet-stream\n"
+        b'Content-Disposition: attachment; filename="Q3-Report.pdf"\n'
+        b"Content-Transfer-Encoding: base64\n"
+        b"\n"
+        b"c2VjcmV0IGF0dGFjaG1lbnQ=\n"
+        b"--XX--\n"
+    )
+    msg = message_from_bytes(raw, policy=default)
+    headers, body = msg_search_text(msg)
+    assert "subject: café invoice" in headers
+    assert "alice@example.com" in headers
+    assert "content-type: text/plain" in headers
+    assert 'filename="q3-report.pdf"' in headers
+    assert "q3-report.pdf" not in body
+    assert "please pay the invoice, merci beaucoup. à" in body
+    assert "grüße" in body
+    assert "secret" not in body
+    assert "ugxlyxnl" not in body
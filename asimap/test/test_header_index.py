@@ -0,0 +1,154 @@
+"""
+Test the header index used by SEARCH.
+"""
+
+# 3rd party imports
+#
+import pytest
+from pytest_mock import MockerFixture
+
+# Project imports
+#
+from ..header_index import INDEXED_HEADERS
+from ..mbox import Mailbox
+from ..search import IMAPSearch, SearchContext
+from .conftest import EmailFactoryType
+
+
+####################################################################
+#
+async def _scan(mbox: Mailbox, search: IMAPSearch) -> list[int]:
+    """
+    The message sequence numbers of the messages that match `search` when
+    it is matched against each message.
+    """
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+    results = []
+    for idx, msg_key in enumerate(mbox.msg_keys):
+        ctx = SearchContext(mbox, msg_key, idx + 1, seq_max, uid_max)
+        if await search.match(ctx):
+            results.append(idx + 1)
+    return results
+
+
+####################################################################
+#
+@pytest.mark.parametrize(
+    "header,string",
+    [
+        ("from", "@"),
+        ("from", "a"),
+        ("to", "e"),
+        ("subject", ""),
+        ("subject", "s"),
+        ("message-id", "-"),
+        ("cc", "a"),
+        ("In-Reply-To", ""),
+    ],
+)
+@pytest.mark.asyncio
+async def test_header_index_search(
+    mailbox_with_bunch_of_email: Mailbox,
+    mocker: MockerFixture,
+    header: str,
+    string: str,
+) -> None:
+    """
+    Searches on indexed headers match the same messages through the index
+    as they do reading each message, without reading any message.
+    """
+    mbox = mailbox_with_bunch_of_email
+    search = IMAPSearch("header", header=header, string=string)
+    expected = await _scan(mbox, search)
+
+    get_msg_headers = mocker.spy(mbox, "get_msg_headers")
+    results = await mbox.search(search)
+    assert results == expected
+    get_msg_headers.assert_not_called()
+
+    # Headers that are not indexed are matched against each message.
+    #
+    assert "date" not in INDEXED_HEADERS
+    search = IMAPSearch("header", header="date", string="")
+    assert await mbox.search(search) == await _scan(mbox, search)
+    assert get_msg_headers.call_count > 0
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_header_index_update(
+    mailbox_with_bunch_of_email: Mailbox,
+    email_factory: EmailFactoryType,
+) -> None:
+    """
+    Appended messages are added to the index, expunged ones are removed,
+    and messages that are missing from the index are added when it is
+    searched.
+    """
+    mbox = mailbox_with_bunch_of_email
+    search = IMAPSearch("header", header="subject", string="zebra crossing")
+    assert await mbox.search(search) == []
+
+    uid = await mbox.append(email_factory(subject="The Zebra Crossing"))
+    assert await mbox.search(search, uid_cmd=True) == [uid]
+    assert mbox.header_index.uids is not None
+    assert uid in mbox.header_index.uids
+
+    mbox.sequences["Deleted"].add(mbox.msg_keys[-1])
+    await mbox.expunge()
+    assert uid not in mbox.header_index.uids
+    row = await mbox.server.db.fetchone(
+        "SELECT count(*) FROM msg_headers WHERE mailbox_id=? AND uid=?",
+        (mbox.id, uid),
+    )
+    assert row is not None and row[0] == 0
+
+    # A mailbox whose messages are not in the index (ie: it was around
+    # before we had one) has them added the first time it is searched.
+    #
+    await mbox.server.db.execute("DELETE FROM msg_headers", commit=True)
+    mbox.header_index.reset()
+    search = IMAPSearch("header", header="from", string="@")
+    assert await mbox.search(search) == list(range(1, mbox.num_msgs + 1))
+    assert mbox.header_index.uids == set(mbox.uids)
+    row = await mbox.server.db.fetchone(
+        "SELECT count(*) FROM msg_headers WHERE mailbox_id=?", (mbox.id,)
+    )
+    assert row is not None and row[0] == mbox.num_msgs
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_header_index_new_msgs_in_background(
+    mailbox_with_bunch_of_email: Mailbox,
+    email_factory: EmailFactoryType,
+    mocker: MockerFixture,
+) -> None:
+    """
+    GIVEN: A mailbox whose header index is loaded
+    WHEN:  A resync finds new messages
+    THEN:  The resync does not parse the new messages. They are added to the
+           index in the background.
+    """
+    mbox = mailbox_with_bunch_of_email
+    search = IMAPSearch("header", header="subject", string="zebra crossing")
+    assert await mbox.search(search) == []
+
+    for _ in range(3):
+        mbox.mailbox.add(email_factory(subject="The Zebra Crossing"))
+    get_msg = mocker.spy(mbox, "get_msg")
+    get_msg_headers = mocker.spy(mbox, "get_msg_headers")
+    await mbox.check_new_msgs_and_flags(optional=False)
+    get_msg.assert_not_called()
+    new_uids = mbox.uids[-3:]
+
+    assert mbox.header_index.task is not None
+    await mbox.header_index.task
+    get_msg.assert_not_called()
+    assert get_msg_headers.call_count == 3
+    assert mbox.header_index.uids is not None
+    assert set(new_uids) <= mbox.header_index.uids
+    assert await mbox.search(search, uid_cmd=True) == new_uids
@@ -7,7 +7,9 @@ Tests for the mbox module
 import asyncio
 import os
 import random
+import time
 from collections.abc import Callable, Iterable
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from datetime import datetime
 from email.message import EmailMessage
@@ -23,12 +25,31 @@ from dirty_equals import IsNow
 from faker import Faker
 from pytest_mock import MockerFixture
 
+from .. import mbox as asimap_mbox
+
 # Project imports
 #
 from ..constants import flag_to_seq
 from ..exceptions import Bad, No
+from ..executor import (
+    EXECUTOR_COUNTS,
+    FETCH_RENDER_WINDOW,
+    SEARCH_PROCESS_CHUNK_SIZE,
+    SEARCH_PROCESS_MIN_MSGS,
+    set_search_processes,
+    shutdown_executors,
+)
 from ..fetch import FetchAtt, FetchOp
-from ..mbox import InvalidMailbox, Mailbox, MailboxExists, NoSuchMailbox
+from ..fetch_worker import render_fetch_batch
+from ..mbox import (
+    RESYNC_SCANS,
+    RESYNCS,
+    InvalidMailbox,
+    Mailbox,
+    MailboxExists,
+    NoSuchMailbox,
+    mbox_msg_path,
+)
 from ..parse import (
     IMAPClientCommand,
     ListSelectOpt,
@@ -204,6 +225,108 @@ async def test_mbox_resync_auto_pack(
     assert len(mbox.msg_keys) == len(mbox.uids)
 
 
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mbox_resync_scan(
+    bunch_of_email_in_folder: Callable[..., Path],
+    imap_user_server: IMAPUserServer,
+) -> None:
+    """
+    GIVEN: An active mailbox
+    WHEN:  Messages are appended to or removed from its folder
+    THEN:  Resyncs find appended messages without diffing every key, skip
+           scanning a folder whose mtime shows nothing changed, and fall back
+           to a full diff when messages were removed.
+    """
+    NAME = "inbox"
+    bunch_of_email_in_folder(folder=NAME)
+    mbox = await imap_user_server.get_mailbox(NAME)
+    path = mbox.mailbox._path
+    RESYNC_SCANS.clear()
+
+    bunch_of_email_in_folder(folder=NAME, num_emails=2)
+    msg_keys = [int(x) for x in mbox.mailbox.keys()]
+    await mbox.check_new_msgs_and_flags(optional=False)
+    assert mbox.msg_keys == msg_keys
+    assert mbox.sequences["Recent"] == set(msg_keys)
+    assert RESYNC_SCANS == {"append": 1}
+
+    # A folder modified just now can not be trusted to not have changed in
+    # the same tick. Once it is old enough it is not scanned.
+    #
+    await mbox.check_new_msgs_and_flags(optional=False)
+    assert RESYNC_SCANS == {"append": 2}
+    os.utime(path, (time.time() - 60, time.time() - 60))
+    await mbox.check_new_msgs_and_flags(optional=False)
+    await mbox.check_new_msgs_and_flags(optional=False)
+    assert RESYNC_SCANS == {"append": 3, "unchanged": 1}
+    assert mbox.msg_keys == msg_keys
+
+    os.remove(os.path.join(path, str(msg_keys[3])))
+    await mbox.check_new_msgs_and_flags(optional=False)
+    assert RESYNC_SCANS["full"] == 1
+    assert mbox.msg_keys == msg_keys[:3] + msg_keys[4:]
+    assert len(mbox.uids) == len(mbox.msg_keys)
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mbox_resync_own_writes(
+    bunch_of_email_in_folder: Callable[..., Path],
+    imap_user_server: IMAPUserServer,
+    email_factory: EmailFactoryType,
+    mocker: MockerFixture,
+) -> None:
+    """
+    GIVEN: An active mailbox
+    WHEN:  Its folder is changed by our own STORE and EXPUNGE, and then by
+           something else
+    THEN:  Resyncs after our own writes are suppressed, and resyncs after
+           other changes are not.
+    """
+    NAME = "inbox"
+    bunch_of_email_in_folder(folder=NAME)
+    mbox = await imap_user_server.get_mailbox(NAME)
+    msg_keys = [int(x) for x in mbox.mailbox.keys()]
+    RESYNCS.clear()
+
+    await mbox.store([1], StoreAction.ADD_FLAGS, [r"\Seen"])
+    mbox.folder_changed()
+    assert not await mbox.check_new_msgs_and_flags()
+    assert RESYNCS == {"suppressed": 1}
+
+    await mbox.store([2], StoreAction.ADD_FLAGS, [r"\Deleted"])
+    keys = mocker.spy(mbox.mailbox, "keys")
+    await mbox.expunge()
+    keys.assert_not_called()
+    assert mbox.optional_resync
+    mbox.folder_changed()
+    assert not await mbox.check_new_msgs_and_flags()
+    assert RESYNCS == {"suppressed": 2}
+    assert mbox.msg_keys == msg_keys[:1] + msg_keys[2:]
+
+    # Something else delivering a message, or changing the sequences, is
+    # noticed. The folder is not diffed against every key since the expunge
+    # recorded what it left behind.
+    #
+    RESYNC_SCANS.clear()
+    mbox.mailbox.add(email_factory())
+    mbox.folder_changed()
+    assert await mbox.check_new_msgs_and_flags()
+    assert RESYNC_SCANS == {"append": 1}
+    assert mbox.num_msgs == len(msg_keys)
+    assert RESYNCS == {"suppressed": 2, "real": 1}
+
+    seqs = mbox.mailbox.get_sequences()
+    seqs["flagged"] = [msg_keys[0]]
+    mbox.mailbox.set_sequences(seqs)
+    mbox.folder_changed()
+    await mbox.check_new_msgs_and_flags()
+    assert RESYNCS == {"suppressed": 2, "real": 2}
+
+
 ####################################################################
 #
 @pytest.mark.asyncio
@@ -426,6 +549,66 @@ async def test_mailbox_search(mailbox_with_bunch_of_email: Mailbox) -> None:
     assert results == msg_keys
 
 
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_msg_cache(mailbox_with_bunch_of_email: Mailbox) -> None:
+    """
+    Parsed messages are served from the mailbox's message cache until the
+    message file changes or the message is expunged.
+    """
+    mbox = mailbox_with_bunch_of_email
+    mbox.msg_cache.clear()
+    mbox.msg_cache.reset_stats()
+    msg_key = mbox.msg_keys[0]
+
+    msg = mbox.get_msg(msg_key)
+    assert mbox.get_msg(msg_key) is msg
+    assert mbox.msg_cache.hits == 1
+    assert mbox.msg_cache.misses == 1
+
+    # Re-writing the message file means we parse it again.
+    #
+    msg_path = mbox.mailbox.get_message_path(msg_key)
+    msg_path.write_bytes(msg_path.read_bytes() + b"\nmore text\n")
+    new_msg = mbox.get_msg(msg_key)
+    assert new_msg is not msg
+    assert mbox.msg_cache.misses == 2
+
+    mbox.sequences["Deleted"].add(msg_key)
+    await mbox.expunge()
+    assert msg_key not in mbox.msg_cache
+
+
+####################################################################
+#
+@pytest.mark.parametrize(
+    "mbox_fixture",
+    ["mailbox_with_bunch_of_email", "mailbox_with_problematic_email"],
+)
+def test_mailbox_get_msg_headers(
+    mbox_fixture: str, request: pytest.FixtureRequest
+) -> None:
+    """
+    Loading just the headers of a message gives the same headers as parsing
+    the entire message.
+    """
+    mbox = request.getfixturevalue(mbox_fixture)
+    mbox.msg_cache.clear()
+    for msg_key in mbox.msg_keys:
+        headers = mbox.get_msg_headers(msg_key)
+        assert not headers.get_payload()
+        msg = mbox.get_msg(msg_key)
+        assert list(headers.raw_items()) == list(msg.raw_items())
+
+        # If the entire message is already parsed we get that.
+        #
+        assert mbox.get_msg_headers(msg_key) is msg
+
+    with pytest.raises(KeyError):
+        mbox.get_msg_headers(max(mbox.msg_keys) + 1)
+
+
 ####################################################################
 #
 @pytest.mark.asyncio
@@ -513,6 +696,64 @@ async def test_mailbox_fetch(mailbox_with_bunch_of_email: Mailbox) -> None:
         assert unseen not in msg_sequences
 
 
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_fetch_metadata(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    ENVELOPE, BODYSTRUCTURE, RFC822.SIZE, and INTERNALDATE are persisted the
+    first time they are fetched and after that are served without parsing
+    the message.
+    """
+    mbox = mailbox_with_bunch_of_email
+    msg_set = [1, 2, 3]
+    fetch_ops = [
+        FetchAtt(FetchOp.ENVELOPE),
+        FetchAtt(FetchOp.BODYSTRUCTURE),
+        FetchAtt(FetchOp.BODYSTRUCTURE, ext_data=False, actual_command="BODY"),
+        FetchAtt(FetchOp.RFC822_SIZE),
+        FetchAtt(FetchOp.INTERNALDATE),
+    ]
+    first = [x async for x in mbox.fetch(msg_set, fetch_ops)]
+
+    metadata = await mbox.load_msg_metadata(mbox.uids[:3])
+    for md in metadata.values():
+        assert md.size
+        assert md.internaldate
+        assert md.envelope
+        assert md.body
+        assert md.bodystructure
+
+    get_msg = mocker.spy(mbox, "get_msg")
+    second = [x async for x in mbox.fetch(msg_set, fetch_ops)]
+    assert first == second
+    get_msg.assert_not_called()
+
+    # A message rewritten in place (ie: by `anno`) keeps its UID, but its
+    # metadata is computed again.
+    #
+    msg_key = mbox.msg_keys[1]
+    msg_path = mbox_msg_path(mbox.mailbox, msg_key)
+    msg_path.write_bytes(b"X-Annotated: yes\n" + msg_path.read_bytes())
+    size_op = [FetchAtt(FetchOp.RFC822_SIZE)]
+    old_size = int(first[1][1][3].split()[-1])
+    results = [x async for x in mbox.fetch([2], size_op)]
+    size = int(results[0][1][0].split()[-1])
+    assert size == old_size + len(b"X-Annotated: yes\r\n")
+    metadata = await mbox.load_msg_metadata([mbox.uids[1]])
+    assert metadata[mbox.uids[1]].size == size
+
+    # Expunging messages removes their metadata.
+    #
+    mbox.sequences["Deleted"].add(mbox.msg_keys[0])
+    uid = mbox.uids[0]
+    await mbox.expunge()
+    metadata = await mbox.load_msg_metadata([uid])
+    assert metadata[uid].envelope is None
+
+
 ####################################################################
 #
 @pytest.mark.asyncio
@@ -553,6 +794,161 @@ async def test_mailbox_uid_fetch_no_duplicate_uid(
         assert int(uid_results[0].split()[1]) == mbox.uids[idx - 1]
 
 
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_fetch_offloaded(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    GIVEN: A FETCH that has to read the message files
+    WHEN:  It is run on FETCH threads, and when it is run on the event loop
+    THEN:  The results are the same, in the same order
+    """
+    mbox = mailbox_with_bunch_of_email
+    msg_set = list(range(mbox.num_msgs, 0, -1))
+    fetch_ops = [
+        FetchAtt(FetchOp.FLAGS),
+        FetchAtt(FetchOp.BODY, section=[], peek=True),
+        FetchAtt(FetchOp.BODY, section=[["HEADER.FIELDS", ["Subject"]]]),
+    ]
+
+    EXECUTOR_COUNTS.clear()
+    offloaded = [x async for x in mbox.fetch(msg_set, fetch_ops, uid_cmd=True)]
+    assert EXECUTOR_COUNTS["thread"] == len(msg_set)
+    assert [idx for idx, _ in offloaded] == msg_set
+
+    # The first FETCH marked the messages as seen and not recent.
+    #
+    mocker.patch("asimap.executor.FETCH_THREADS", 0)
+    inline = [x async for x in mbox.fetch(msg_set, fetch_ops, uid_cmd=True)]
+    assert EXECUTOR_COUNTS["thread"] == len(msg_set)
+    for (_, offloaded_result), (_, inline_result) in zip(
+        offloaded, inline, strict=True
+    ):
+        assert offloaded_result[1:] == inline_result[1:]
+        assert b"\\Recent" in offloaded_result[0]
+        assert b"\\Seen" in inline_result[0]
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_fetch_render_processes(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    GIVEN: A server with FETCH render processes
+    WHEN:  A large FETCH is done
+    THEN:  The results are the same, in the same order, as when the FETCH
+           is rendered by the user server, and the metadata computed by the
+           render processes is persisted.
+    """
+    mbox = mailbox_with_bunch_of_email
+    mocker.patch("asimap.mbox.FETCH_RENDER_MIN_MSGS", 2)
+    mocker.patch("asimap.mbox.FETCH_RENDER_BATCH_SIZE", 3)
+    msg_set = list(range(mbox.num_msgs, 0, -1))
+    fetch_ops = [
+        FetchAtt(FetchOp.RFC822_SIZE),
+        FetchAtt(FetchOp.ENVELOPE),
+        FetchAtt(FetchOp.BODY, section=[], peek=True),
+    ]
+    expected = [x async for x in mbox.fetch(msg_set, fetch_ops, uid_cmd=True)]
+    await mbox.server.db.execute("DELETE FROM msg_metadata", commit=True)
+
+    mbox.server.render_processes = 2
+    EXECUTOR_COUNTS.clear()
+    try:
+        results = [
+            x async for x in mbox.fetch(msg_set, fetch_ops, uid_cmd=True)
+        ]
+    finally:
+        shutdown_executors()
+    assert results == expected
+    assert EXECUTOR_COUNTS["render"] == len(msg_set)
+
+    metadata = await mbox.load_msg_metadata(mbox.uids)
+    for md in metadata.values():
+        assert md.size
+        assert md.envelope
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_fetch_render_window(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    GIVEN: A server with one FETCH render process
+    WHEN:  A large FETCH is done and the client reads its responses slowly
+    THEN:  At most `FETCH_RENDER_WINDOW` batches are rendered ahead of what
+           the client has read
+    """
+    mbox = mailbox_with_bunch_of_email
+    mbox.server.render_processes = 1
+    mocker.patch("asimap.mbox.FETCH_RENDER_MIN_MSGS", 2)
+    mocker.patch("asimap.mbox.FETCH_RENDER_BATCH_SIZE", 2)
+    pool = ThreadPoolExecutor(max_workers=1)
+    mocker.patch("asimap.mbox.render_pool", return_value=pool)
+    render = mocker.patch(
+        "asimap.mbox.render_fetch_batch", side_effect=render_fetch_batch
+    )
+
+    msg_set = list(range(1, mbox.num_msgs + 1))
+    fetch_ops = [FetchAtt(FetchOp.BODY, section=["HEADER"], peek=True)]
+    num_results = 0
+    async for idx, _ in mbox.fetch(msg_set, fetch_ops):
+        assert idx == msg_set[num_results]
+        num_results += 1
+        batches_read = (num_results + 1) // 2
+        assert render.call_count <= batches_read + FETCH_RENDER_WINDOW
+    assert num_results == len(msg_set)
+    pool.shutdown()
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_fetch_flags_from_state(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    GIVEN: A UID FETCH of just FLAGS (a client's sync loop)
+    WHEN:  The fetch is executed
+    THEN:  It is answered without looking at any message files and gives the
+           same answer as going through a SearchContext does.
+    """
+    mbox = mailbox_with_bunch_of_email
+    msg_set = list(range(1, mbox.num_msgs + 1))
+    mbox.sequences["flagged"].add(mbox.msg_keys[1])
+
+    # FETCH FLAGS clears `\\Recent`, so start without any to keep the two
+    # fetches comparable.
+    #
+    mbox.sequences["Recent"] = set()
+
+    # The expected results, computed by way of a SearchContext (adding a
+    # RFC822.SIZE makes this something that is not just flags & uids.)
+    #
+    fetch_ops = [FetchAtt(FetchOp.FLAGS), FetchAtt(FetchOp.RFC822_SIZE)]
+    expected = [
+        (idx, [result[0], result[2]])
+        async for idx, result in mbox.fetch(msg_set, fetch_ops, uid_cmd=True)
+    ]
+
+    search_ctx = mocker.patch("asimap.mbox.SearchContext")
+    get_msg = mocker.spy(mbox, "get_msg")
+    stat = mocker.spy(os, "stat")
+    fetch_ops = [FetchAtt(FetchOp.FLAGS)]
+    results = [x async for x in mbox.fetch(msg_set, fetch_ops, uid_cmd=True)]
+    assert results == expected
+    assert b"\\Flagged" in results[1][1][0]
+    search_ctx.assert_not_called()
+    get_msg.assert_not_called()
+    stat.assert_not_called()
+
+
 ####################################################################
 #
 @pytest.mark.asyncio
@@ -1874,3 +2270,196 @@ async def test_msg_set_to_msg_seq_set(
     mbox._rebuild_index_dicts()
     msg_set_as_set = mbox.msg_set_to_msg_seq_set(sequence_set, uid_cmd)
     assert msg_set_as_set == expected
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_search_from_state(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    Searches on flags, UID's and message sequence numbers do not look at
+    the messages. Other parts of a search are only matched against the
+    messages the in-memory part selects.
+    """
+    mbox = mailbox_with_bunch_of_email
+    mbox.sequences["flagged"] = set(mbox.msg_keys[3:6])
+    flagged = IMAPSearch("keyword", keyword=r"\Flagged")
+    ctx_spy = mocker.patch(
+        "asimap.mbox.SearchContext", wraps=asimap_mbox.SearchContext
+    )
+
+    results = await mbox.search(flagged, uid_cmd=False)
+    assert results == [4, 5, 6]
+    results = await mbox.search(
+        IMAPSearch(
+            "and",
+            search_key=[
+                IMAPSearch("not", search_key=flagged),
+                IMAPSearch("uid", msg_set=[(2, 5)]),
+            ],
+        ),
+        uid_cmd=True,
+    )
+    assert results == [mbox.uids[1], mbox.uids[2]]
+    assert ctx_spy.call_count == 0
+
+    search = IMAPSearch(
+        "and",
+        search_key=[flagged, IMAPSearch("header", header="date", string="")],
+    )
+    results = await mbox.search(search, uid_cmd=True)
+    assert results == mbox.uids[3:6]
+    assert ctx_spy.call_count == 3
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_search_cache(
+    mailbox_with_bunch_of_email: Mailbox,
+    email_factory: EmailFactoryType,
+    mocker: MockerFixture,
+) -> None:
+    """
+    A repeated search is answered from the search cache until something
+    changes the mailbox's generation.
+    """
+    mbox = mailbox_with_bunch_of_email
+    run_search = mocker.spy(mbox, "_run_search")
+    flagged = IMAPSearch("keyword", keyword=r"\Flagged")
+
+    assert await mbox.search(flagged) == []
+    assert await mbox.search(flagged) == []
+    assert run_search.call_count == 1
+    assert mbox.search_cache.hits == 1
+
+    # A UID SEARCH is cached separately from a SEARCH.
+    #
+    assert await mbox.search(flagged, uid_cmd=True) == []
+    assert run_search.call_count == 2
+
+    await mbox.store([2, 4], StoreAction.ADD_FLAGS, [r"\Flagged"])
+    assert await mbox.search(flagged) == [2, 4]
+    assert await mbox.search(flagged, uid_cmd=True) == [
+        mbox.uids[1],
+        mbox.uids[3],
+    ]
+    assert run_search.call_count == 4
+
+    uid = await mbox.append(email_factory(), flags=[r"\Flagged"])
+    assert await mbox.search(flagged, uid_cmd=True) == [
+        mbox.uids[1],
+        mbox.uids[3],
+        uid,
+    ]
+
+    mbox.sequences["Deleted"].add(mbox.msg_keys[1])
+    await mbox.expunge()
+    results = await mbox.search(flagged)
+    assert results == [3, mbox.num_msgs]
+
+    # Changing the results we are given does not change the cached ones.
+    #
+    results.clear()
+    assert await mbox.search(flagged) == [3, mbox.num_msgs]
+    assert run_search.call_count == 6
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_search_processes(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    GIVEN: A server with SEARCH processes
+    WHEN:  A search that looks at the text of the messages is done
+    THEN:  The results are the same, in the same order, as when the search
+           is run by the user server, and the command's timeout is extended
+           while the SEARCH processes work on it.
+    """
+    mbox = mailbox_with_bunch_of_email
+    await mbox.store([2, 4, 7], StoreAction.ADD_FLAGS, [r"\Flagged"])
+    word = mbox.get_search_text(mbox.msg_keys[3])[1].split()[0]
+    searches = [
+        IMAPSearch("body", string=word),
+        IMAPSearch(
+            "or",
+            search_key=[
+                IMAPSearch("keyword", keyword=r"\Flagged"),
+                IMAPSearch("text", string=word),
+            ],
+        ),
+    ]
+    expected = [await mbox.search(x, uid_cmd=True) for x in searches]
+    assert expected[0]
+    mbox.search_cache.clear()
+
+    extend = mocker.spy(mbox, "_maybe_extend_timeout")
+    set_search_processes(processes=2, chunk_size=3, min_msgs=2)
+    EXECUTOR_COUNTS.clear()
+    try:
+        results = [await mbox.search(x, uid_cmd=True) for x in searches]
+    finally:
+        set_search_processes(
+            processes=0,
+            chunk_size=SEARCH_PROCESS_CHUNK_SIZE,
+            min_msgs=SEARCH_PROCESS_MIN_MSGS,
+        )
+    assert results == expected
+    assert EXECUTOR_COUNTS["search"] == 2 * mbox.num_msgs
+    assert extend.call_count >= 1
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_mailbox_search_summary(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    search_summary() gives the min, max, and count of the matching messages
+    without building the list of them.
+    """
+    mbox = mailbox_with_bunch_of_email
+    run_search = mocker.spy(mbox, "_run_search")
+    flagged = IMAPSearch("keyword", keyword=r"\Flagged")
+    every = IMAPSearch("all")
+
+    assert await mbox.search_summary(flagged) == (None, None, 0)
+    assert await mbox.search_summary(every) == (1, mbox.num_msgs, mbox.num_msgs)
+    assert await mbox.search_summary(every, uid_cmd=True) == (
+        mbox.uids[0],
+        mbox.uids[-1],
+        mbox.num_msgs,
+    )
+
+    await mbox.store([2, 4, 7], StoreAction.ADD_FLAGS, [r"\Flagged"])
+    assert await mbox.search_summary(flagged) == (2, 7, 3)
+    assert await mbox.search_summary(flagged, uid_cmd=True) == (
+        mbox.uids[1],
+        mbox.uids[6],
+        3,
+    )
+
+    # A search that has to look at each message gives the same answer.
+    #
+    subject = IMAPSearch("header", header="subject", string="")
+    assert await mbox.search_summary(subject) == (
+        1,
+        mbox.num_msgs,
+        mbox.num_msgs,
+    )
+    assert run_search.call_count == 0
+
+    # If the full results are already cached they are used.
+    #
+    results = await mbox.search(flagged)
+    assert await mbox.search_summary(flagged) == (
+        results[0],
+        results[-1],
+        len(results),
+    )
+    assert run_search.call_count == 1
@@ -0,0 +1,72 @@
+"""
+Test the byte-budgeted LRU cache of parsed messages.
+"""
+
+# System imports
+#
+from email.message import EmailMessage
+
+# Project imports
+#
+from ..msg_cache import MessageCache
+
+
+####################################################################
+#
+def test_msg_cache_hit_miss() -> None:
+    cache = MessageCache(max_bytes=1000)
+    msg = EmailMessage()
+
+    assert cache.get(1, 100, 10) is None
+    cache.put(1, 100, 10, msg)
+    assert cache.get(1, 100, 10) is msg
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.num_bytes == 10
+
+    # A different mtime or size means the message file has changed and the
+    # cached entry is dropped.
+    #
+    assert cache.get(1, 101, 10) is None
+    assert 1 not in cache
+    assert cache.num_bytes == 0
+    cache.put(1, 100, 10, msg)
+    assert cache.get(1, 100, 11) is None
+    assert 1 not in cache
+    assert cache.misses == 3
+
+    cache.reset_stats()
+    assert cache.hits == 0
+    assert cache.misses == 0
+
+
+####################################################################
+#
+def test_msg_cache_lru_eviction() -> None:
+    cache = MessageCache(max_bytes=300)
+    msgs = {k: EmailMessage() for k in range(1, 5)}
+
+    for k in (1, 2, 3):
+        cache.put(k, 0, 100, msgs[k])
+    assert cache.num_bytes == 300
+
+    # Touch 1 so 2 becomes the least recently used entry.
+    #
+    assert cache.get(1, 0, 100) is msgs[1]
+    cache.put(4, 0, 100, msgs[4])
+    assert 2 not in cache
+    assert {1, 3, 4} == {k for k in range(1, 5) if k in cache}
+    assert cache.evictions == 1
+    assert cache.num_bytes == 300
+
+    # Messages larger than the whole budget are never cached.
+    #
+    cache.put(5, 0, 301, EmailMessage())
+    assert 5 not in cache
+    assert len(cache) == 3
+
+    cache.invalidate(3)
+    assert cache.num_bytes == 200
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.num_bytes == 0
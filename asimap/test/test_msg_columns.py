@@ -0,0 +1,161 @@
+"""
+Test the columns of internal dates, sizes and sent dates used by SEARCH.
+"""
+
+# system imports
+#
+import os
+from datetime import UTC, date, datetime, timedelta
+
+# 3rd party imports
+#
+import pytest
+from pytest_mock import MockerFixture
+
+# Project imports
+#
+from ..mbox import Mailbox
+from ..msg_columns import UNKNOWN_SIZE, MsgColumns
+from ..search import IMAPSearch, SearchContext
+from .conftest import EmailFactoryType
+
+
+####################################################################
+#
+async def _scan(mbox: Mailbox, search: IMAPSearch) -> list[int]:
+    """
+    The message sequence numbers of the messages that match `search` when
+    it is matched against each message.
+    """
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+    results = []
+    for idx, msg_key in enumerate(mbox.msg_keys):
+        ctx = SearchContext(mbox, msg_key, idx + 1, seq_max, uid_max)
+        if await search.match(ctx):
+            results.append(idx + 1)
+    return results
+
+
+####################################################################
+#
+def _spread_internal_dates(mbox: Mailbox) -> None:
+    """
+    Give the messages of the mailbox internal dates a day apart, so date
+    searches have something to tell apart.
+    """
+    start = datetime(2025, 12, 20, 18, 30, tzinfo=UTC).timestamp()
+    for i, msg_key in enumerate(mbox.msg_keys):
+        mtime = start + i * 86400
+        os.utime(mbox.mailbox.get_message_path(msg_key), (mtime, mtime))
+
+
+####################################################################
+#
+@pytest.mark.parametrize(
+    "op,offset",
+    [
+        ("before", 0),
+        ("before", 1),
+        ("on", 0),
+        ("since", 0),
+        ("since", -1),
+        ("larger", 0),
+        ("larger", -1),
+        ("smaller", 0),
+        ("smaller", 1),
+        ("sentbefore", 0),
+        ("senton", 0),
+        ("sentsince", 0),
+        ("sentsince", 1),
+    ],
+)
+@pytest.mark.asyncio
+async def test_msg_columns_search(
+    mailbox_with_bunch_of_email: Mailbox, op: str, offset: int
+) -> None:
+    """
+    Date and size searches match the same messages from the columns as they
+    do matching each message, and once the columns are filled in no message
+    is looked at.
+    """
+    mbox = mailbox_with_bunch_of_email
+    _spread_internal_dates(mbox)
+    ctx = SearchContext(mbox, mbox.msg_keys[7], 8, mbox.num_msgs, 0)
+    match op:
+        case "before" | "on" | "since":
+            day = ctx.internal_date().date() + timedelta(days=offset)
+            search = IMAPSearch(op, date=day)
+        case "larger" | "smaller":
+            search = IMAPSearch(op, n=ctx.msg_size() + offset)
+        case _:
+            sent = ctx.sent_date()
+            assert sent is not None
+            search = IMAPSearch(op, date=sent + timedelta(days=offset))
+
+    expected = await _scan(mbox, search)
+    assert await mbox.search(search) == expected
+    assert search.match_set(mbox) is not None
+    assert await mbox.search(search) == expected
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_msg_columns_persist_and_realign(
+    mailbox_with_bunch_of_email: Mailbox,
+    email_factory: EmailFactoryType,
+    mocker: MockerFixture,
+) -> None:
+    """
+    Values computed for the columns are written to the db, and the columns
+    stay in line with the mailbox's messages as they are expunged and
+    appended.
+    """
+    mbox = mailbox_with_bunch_of_email
+    _spread_internal_dates(mbox)
+    search = IMAPSearch(
+        "and",
+        search_key=[
+            IMAPSearch("since", date=date(2026, 1, 1)),
+            IMAPSearch("larger", n=0),
+            IMAPSearch("sentbefore", date=date(3000, 1, 1)),
+        ],
+    )
+    expected = await _scan(mbox, search)
+    assert await mbox.search(search) == expected
+    by_uid = {
+        uid: (mbox.columns.internal_dates[i], mbox.columns.sizes[i])
+        for i, uid in enumerate(mbox.uids)
+    }
+
+    # A fresh set of columns (ie: the user server restarted) is filled in
+    # from the db without looking at any message.
+    #
+    mbox.columns = MsgColumns(mbox)
+    mbox._rebuild_index_dicts()
+    assert mbox.columns.sizes.tolist() == [UNKNOWN_SIZE] * mbox.num_msgs
+    compute = mocker.spy(mbox.columns, "_compute")
+    assert await mbox.search(search) == expected
+    compute.assert_not_called()
+
+    # Expunge some messages in the middle and append one.
+    #
+    for msg_key in mbox.msg_keys[3:6]:
+        mbox.sequences["Deleted"].add(msg_key)
+    await mbox.expunge()
+    uid = await mbox.append(
+        email_factory(), date_time=datetime(2026, 3, 1, tzinfo=UTC)
+    )
+    assert len(mbox.columns.sizes) == mbox.num_msgs
+    assert await mbox.search(search) == await _scan(mbox, search)
+    compute.assert_called_once()
+    for i, msg_uid in enumerate(mbox.uids[:-1]):
+        assert (
+            mbox.columns.internal_dates[i],
+            mbox.columns.sizes[i],
+        ) == by_uid[msg_uid]
+    assert mbox.uids[-1] == uid
+    assert await mbox.search(IMAPSearch("on", date=date(2026, 3, 1))) == [
+        mbox.num_msgs
+    ]
@@ -16,6 +16,7 @@ from ..parse import (
     IMAPClientCommand,
     ListReturnOpt,
     ListSelectOpt,
+    SearchReturnOpt,
     StatusAtt,
 )
 
@@ -37,7 +38,7 @@ IMAP_MESSAGES = [
     ),
     pytest.param(
         "A999 UID SEARCH 1:100 UID 443:557\r\n",
-        "A999 UID SEARCH IMAPSearch('and', [IMAPSearch('message_set', msg_set = [(1, 100)]), IMAPSearch('uid')])",
+        "A999 UID SEARCH IMAPSearch('and', [IMAPSearch('message_set', msg_set = [(1, 100)]), IMAPSearch('uid', msg_set = [(443, 557)])])",
         id="UID SEARCH",
     ),
     pytest.param(
@@ -135,6 +136,16 @@ IMAP_MESSAGES = [
         "A282 SEARCH IMAPSearch('and', [IMAPSearch('or', [IMAPSearch('keyword', keyword = \"\\Flagged\"), IMAPSearch('message_set', msg_set = [(1, 3), 4, 5, 6])]), IMAPSearch('since', date = \"1994-02-01\"), IMAPSearch('not', search_key = IMAPSearch('header', header = \"from\", string = \"smith\"))])",
         id="SEARCH 03",
     ),
+    pytest.param(
+        "A282 SEARCH RETURN (COUNT MIN) FLAGGED\r\n",
+        "A282 SEARCH RETURN (MIN COUNT) IMAPSearch('and', [IMAPSearch('keyword', keyword = \"\\Flagged\")])",
+        id="ESEARCH",
+    ),
+    pytest.param(
+        "A283 UID SEARCH RETURN () CHARSET UTF-8 UNSEEN\r\n",
+        "A283 UID SEARCH RETURN (ALL) IMAPSearch('and', [IMAPSearch('not', search_key = IMAPSearch('keyword', keyword = \"\\Seen\"))])",
+        id="ESEARCH empty return",
+    ),
     pytest.param("a002 noop\r\n", "a002 NOOP", id="NOOP"),
     pytest.param("A202 EXPUNGE\r\n", "A202 EXPUNGE", id="EXPUNGE"),
     pytest.param(
@@ -663,3 +674,55 @@ def test_list_extended_bad_syntax(received: str) -> None:
     with pytest.raises(BadSyntax):
         p = IMAPClientCommand(received)
         p.parse()
+
+
+####################################################################
+#
+def test_search_return_opts() -> None:
+    """
+    GIVEN: SEARCH commands with and without ESEARCH RETURN options
+    WHEN:  parsed
+    THEN:  search_return_opts is None for a plain SEARCH, the set of options
+           asked for otherwise, and an unknown option is a BadSyntax
+    """
+    p = IMAPClientCommand("A01 SEARCH UNSEEN\r\n")
+    p.parse()
+    assert p.search_return_opts is None
+
+    p = IMAPClientCommand("A01 SEARCH RETURN (MAX ALL) UNSEEN\r\n")
+    p.parse()
+    assert p.search_return_opts == {SearchReturnOpt.MAX, SearchReturnOpt.ALL}
+
+    p = IMAPClientCommand("A01 UID SEARCH RETURN () UNSEEN\r\n")
+    p.parse()
+    assert p.search_return_opts == {SearchReturnOpt.ALL}
+
+    with pytest.raises(BadSyntax):
+        p = IMAPClientCommand("A01 SEARCH RETURN (BOGUS) UNSEEN\r\n")
+        p.parse()
+
+
+####################################################################
+#
+def test_saved_result_msg_set() -> None:
+    """
+    GIVEN: commands that use `$` (rfc5182) as a message set
+    WHEN:  parsed
+    THEN:  every `$` is the command's one saved_result
+    """
+    p = IMAPClientCommand("A01 SEARCH RETURN (SAVE) UNSEEN\r\n")
+    p.parse()
+    assert p.search_return_opts == {SearchReturnOpt.SAVE}
+    assert p.saved_result is None
+
+    p = IMAPClientCommand("A01 UID FETCH $ (FLAGS)\r\n")
+    p.parse()
+    assert p.saved_result is not None
+    assert p.msg_set is p.saved_result
+    assert str(p) == "A01 UID FETCH $ (FLAGS)"
+
+    p = IMAPClientCommand("A01 SEARCH OR $ UID $ DELETED\r\n")
+    p.parse()
+    search_or = p.search_key.args["search_key"][0]
+    assert search_or.args["search_key"][0].args["msg_set"] is p.saved_result
+    assert search_or.args["search_key"][1].args["msg_set"] is p.saved_result
@@ -9,21 +9,29 @@ import random
 from collections import Counter, defaultdict
 from collections.abc import Callable
 from datetime import UTC, date
+from email.message import EmailMessage
 from typing import Any
 
 # 3rd party imports
 #
 import pytest
 from dirty_equals import IsNow
+from pytest_mock import MockerFixture
 
 # Project imports
 #
 from ..constants import REV_SYSTEM_FLAG_MAP, SYSTEM_FLAGS
-from ..generator import get_msg_size, msg_as_string
+from ..generator import msg_as_string
 from ..mbox import Mailbox
-from ..search import IMAPSearch, SearchContext
+from ..search import (
+    SEARCH_TEXT_COUNTS,
+    IMAPSearch,
+    SearchContext,
+    SearchCost,
+    SearchOp,
+)
 from ..utils import parsedate, utime
-from .conftest import assert_email_equal
+from .conftest import assert_email_equal, expected_msg_size
 
 
 ####################################################################
@@ -55,7 +63,7 @@ async def test_search_context(mailbox_instance: Callable[..., Any]) -> None:
         assert_email_equal(msg, ctx.msg())
         assert uid == ctx.uid()
         assert uid_vv == ctx.uid_vv()
-        assert get_msg_size(msg) == ctx.msg_size()
+        assert expected_msg_size(mbox, msg_key) == ctx.msg_size()
 
 
 ####################################################################
@@ -90,7 +98,7 @@ async def test_search_context_with_mimekit_email(
         assert_email_equal(msg, ctx.msg())
         assert uid == ctx.uid()
         assert uid_vv == ctx.uid_vv()
-        assert get_msg_size(msg) == ctx.msg_size()
+        assert expected_msg_size(mbox, msg_key) == ctx.msg_size()
 
 
 ####################################################################
@@ -165,7 +173,9 @@ async def test_search_all(mailbox_with_bunch_of_email: Mailbox) -> None:
 ####################################################################
 #
 @pytest.mark.asyncio
-async def test_search_headers(mailbox_with_bunch_of_email: Mailbox) -> None:
+async def test_search_headers(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
     mbox = mailbox_with_bunch_of_email
     msg_keys = [int(k) for k in mbox.mailbox.keys()]
     seq_max = len(msg_keys)
@@ -173,13 +183,17 @@ async def test_search_headers(mailbox_with_bunch_of_email: Mailbox) -> None:
     assert uid_max
 
     # First, searching on an empty string matches messages that have the header.
+    # Header searches only load the message headers.
     #
+    mbox.msg_cache.clear()
+    get_msg = mocker.spy(mbox, "get_msg")
     search_op = IMAPSearch("header", header="subject", string="")
     for msg_idx, msg_key in enumerate(msg_keys):
         msg_idx += 1
         ctx = SearchContext(mbox, msg_key, msg_idx, seq_max, uid_max)
         if not await search_op.match(ctx):
             raise AssertionError()
+    get_msg.assert_not_called()
 
     # Go through the messages and find the most common words in the subject.
     # Those will be what we test header search on.
@@ -386,6 +400,73 @@ async def test_search_body(mailbox_with_bunch_of_email: Mailbox) -> None:
                 assert word not in body.lower()
 
 
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_search_text_cache(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    BODY and TEXT searches get the text of messages from the mailbox's
+    search text cache, so a second content search does not parse or
+    decode any messages again.
+    """
+    mbox = mailbox_with_bunch_of_email
+    SEARCH_TEXT_COUNTS.clear()
+    get_msg = mocker.spy(mbox, "get_msg")
+
+    await mbox.search(IMAPSearch("body", string="nothing-will-match-this"))
+    assert get_msg.call_count == mbox.num_msgs
+    assert len(mbox.search_text_cache) == mbox.num_msgs
+    decoded = mbox.search_text_decoded
+    assert decoded > 0
+    assert SEARCH_TEXT_COUNTS == {"searches": 1, "decoded": decoded}
+
+    await mbox.search(IMAPSearch("text", string="nor-will-this"))
+    assert get_msg.call_count == mbox.num_msgs
+    assert mbox.search_text_decoded == decoded
+    assert mbox.search_text_cache.hits == mbox.num_msgs
+    assert SEARCH_TEXT_COUNTS == {"searches": 2, "decoded": decoded}
+
+    # A message that is rewritten is read again.
+    #
+    msg_key = mbox.msg_keys[0]
+    path = mbox.mailbox.get_message_path(msg_key)
+    with open(path, "a") as f:
+        f.write("one more line\n")
+    mbox.get_search_text(msg_key)
+    assert mbox.search_text_decoded > decoded
+    assert get_msg.call_count == mbox.num_msgs + 1
+    SEARCH_TEXT_COUNTS.clear()
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_search_text_mime_headers(
+    mailbox_with_bunch_of_email: Mailbox,
+) -> None:
+    """
+    TEXT matches the headers of a message's MIME parts, such as the
+    filename of an attachment.
+    """
+    mbox = mailbox_with_bunch_of_email
+    msg = EmailMessage()
+    msg["From"] = "alice@example.com"
+    msg["Subject"] = "The report"
+    msg.set_content("It is attached.\n")
+    msg.add_attachment(
+        b"%PDF-1.4\n",
+        maintype="application",
+        subtype="pdf",
+        filename="q3-report.pdf",
+    )
+    uid = await mbox.append(msg)
+
+    search = IMAPSearch("text", string="q3-report.pdf")
+    assert await mbox.search(search, uid_cmd=True) == [uid]
+
+
 ####################################################################
 #
 @pytest.mark.asyncio
@@ -457,8 +538,7 @@ async def test_search_larger_smaller(
     #
     sizes: list[tuple[int, int]] = []
     for msg_key in msg_keys:
-        msg = mbox.get_msg(msg_key)
-        msg_size = get_msg_size(msg)
+        msg_size = expected_msg_size(mbox, msg_key)
         sizes.append((msg_size, msg_key))
 
     sizes = sorted(sizes, key=lambda x: x[0])
@@ -589,3 +669,177 @@ async def test_search_and_or(mailbox_with_bunch_of_email: Mailbox) -> None:
             assert msg_key in expected_2
         else:
             assert msg_key not in expected_2
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_search_match_set(mailbox_with_bunch_of_email: Mailbox) -> None:
+    """
+    Searches on flags, UID's and message sequence numbers answered from the
+    mailbox's in-memory state match the same messages as they do when
+    matched against each message.
+    """
+    mbox = mailbox_with_bunch_of_email
+    mbox.sequences["flagged"] = set(mbox.msg_keys[2:8])
+    mbox.sequences["Seen"] = set(mbox.msg_keys[5:12])
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+
+    flagged = IMAPSearch("keyword", keyword=r"\Flagged")
+    seen = IMAPSearch("keyword", keyword=r"\Seen")
+    msg_set = IMAPSearch("message_set", msg_set=(1, (7, 10), (19, "*")))
+    uids = IMAPSearch("uid", msg_set=(2, (5, 9), (18, "*"), "*"))
+    searches = [
+        IMAPSearch("all"),
+        flagged,
+        IMAPSearch("not", search_key=flagged),
+        IMAPSearch("and", search_key=[flagged, seen]),
+        IMAPSearch("or", search_key=[flagged, msg_set]),
+        IMAPSearch(
+            "and", search_key=[uids, IMAPSearch("not", search_key=seen)]
+        ),
+        IMAPSearch("uid", msg_set=[(10, 4)]),
+        msg_set,
+        uids,
+    ]
+    for search in searches:
+        expected = set()
+        for idx, msg_key in enumerate(mbox.msg_keys):
+            ctx = SearchContext(mbox, msg_key, idx + 1, seq_max, uid_max)
+            if await search.match(ctx):
+                expected.add(idx)
+        assert search.match_set(mbox) == expected, str(search)
+        assert search.split(mbox) == (expected, None)
+
+    # Searches that need to look at the messages can not be answered from
+    # the in-memory state.
+    #
+    larger = IMAPSearch("larger", n=1_000)
+    assert larger.match_set(mbox) is None
+    assert (
+        IMAPSearch("or", search_key=[flagged, larger]).match_set(mbox) is None
+    )
+    assert larger.split(mbox) == (None, larger)
+
+    # But the parts of an `and` that can be narrow down the messages the
+    # rest of the search is matched against.
+    #
+    candidates, residual = IMAPSearch(
+        "and", search_key=[flagged, larger, seen]
+    ).split(mbox)
+    flagged_set = flagged.match_set(mbox)
+    seen_set = seen.match_set(mbox)
+    assert flagged_set is not None and seen_set is not None
+    assert candidates == flagged_set & seen_set
+    assert residual is larger
+
+
+####################################################################
+#
+def test_search_plan() -> None:
+    """
+    Planning flattens nested AND's and OR's, drops ALL and double NOT's and
+    orders search keys cheapest first.
+    """
+    body = IMAPSearch("body", string="invoice")
+    header = IMAPSearch("header", header="subject", string="invoice")
+    larger = IMAPSearch("larger", n=1_000)
+    seen = IMAPSearch("keyword", keyword=r"\Seen")
+    search = IMAPSearch(
+        "and",
+        search_key=[
+            IMAPSearch("all"),
+            body,
+            IMAPSearch("and", search_key=[header, larger]),
+            IMAPSearch("not", search_key=IMAPSearch("not", search_key=seen)),
+        ],
+    )
+    planned = search.plan()
+    assert [x.op.value for x in planned.args["search_key"]] == [
+        "keyword",
+        "larger",
+        "header",
+        "body",
+    ]
+    assert planned.cost() == SearchCost.CONTENT
+    assert planned.args["search_key"][0] is not seen
+
+    # The original search is left as it was.
+    #
+    assert [x.op.value for x in search.args["search_key"]] == [
+        "all",
+        "body",
+        "and",
+        "not",
+    ]
+
+    search = IMAPSearch(
+        "or",
+        search_key=[body, IMAPSearch("or", search_key=[larger, seen])],
+    )
+    planned = search.plan()
+    assert planned.op == SearchOp.OR
+    assert [x.op.value for x in planned.args["search_key"]] == [
+        "keyword",
+        "larger",
+        "body",
+    ]
+    assert IMAPSearch("or", search_key=[body, IMAPSearch("all")]).plan().op == (
+        SearchOp.ALL
+    )
+    assert IMAPSearch("and", search_key=[IMAPSearch("all")]).plan().op == (
+        SearchOp.ALL
+    )
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_search_short_circuit(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    `UNSEEN BODY "invoice"` only looks at the bodies of unseen messages,
+    and `OR FLAGGED BODY "invoice"` only at those that are not flagged.
+    """
+    mbox = mailbox_with_bunch_of_email
+    mbox.sequences["Seen"] = set(mbox.msg_keys[:15])
+    mbox.sequences["flagged"] = set(mbox.msg_keys[10:])
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+    body = IMAPSearch("body", string="invoice")
+
+    for search, num_body_evals in (
+        (
+            IMAPSearch(
+                "and",
+                search_key=[
+                    body,
+                    IMAPSearch(
+                        "not",
+                        search_key=IMAPSearch("keyword", keyword=r"\Seen"),
+                    ),
+                ],
+            ),
+            5,
+        ),
+        (
+            IMAPSearch(
+                "or",
+                search_key=[body, IMAPSearch("keyword", keyword=r"\Flagged")],
+            ),
+            10,
+        ),
+    ):
+        planned = search.plan()
+        for idx, msg_key in enumerate(mbox.msg_keys):
+            ctx = SearchContext(mbox, msg_key, idx + 1, seq_max, uid_max)
+            await planned.match(ctx)
+
+        assert planned.num_evals == seq_max
+        planned_body = planned.args["search_key"][-1]
+        assert planned_body.op == SearchOp.BODY
+        assert planned_body.num_evals == num_body_evals
+        assert body.num_evals == 0
+        assert f"evals: {num_body_evals}," in planned.explain()
@@ -0,0 +1,167 @@
+"""
+Test the full text index used by SEARCH BODY and TEXT.
+"""
+
+# system imports
+#
+from collections import Counter
+
+# 3rd party imports
+#
+import pytest
+from pytest_mock import MockerFixture
+
+# Project imports
+#
+from ..generator import msg_search_text
+from ..mbox import Mailbox
+from ..search import IMAPSearch, SearchContext
+from ..text_index import TEXT_INDEX_COUNTS, TextIndex
+
+
+####################################################################
+#
+async def _enable_text_index(
+    mbox: Mailbox, max_bytes: int = 2**30
+) -> TextIndex:
+    """
+    Turn on the text index of the mailbox's user server and index the
+    mailbox.
+    """
+    text_index = mbox.server.text_index
+    text_index.max_bytes = max_bytes
+    await text_index.setup()
+    assert text_index.enabled
+    await text_index.index_mailbox(mbox)
+    return text_index
+
+
+####################################################################
+#
+async def _scan(mbox: Mailbox, search: IMAPSearch) -> list[int]:
+    """
+    The message sequence numbers of the messages that match `search` when
+    it is matched against each message.
+    """
+    seq_max = mbox.num_msgs
+    uid_max = mbox.uids[-1]
+    results = []
+    for idx, msg_key in enumerate(mbox.msg_keys):
+        ctx = SearchContext(mbox, msg_key, idx + 1, seq_max, uid_max)
+        if await search.match(ctx):
+            results.append(idx + 1)
+    return results
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_text_index_search(
+    mailbox_with_bunch_of_email: Mailbox, mocker: MockerFixture
+) -> None:
+    """
+    BODY and TEXT searches answered from the index match the same messages
+    as they do matched against each message, without reading any message.
+    """
+    mbox = mailbox_with_bunch_of_email
+    assert mbox.id is not None
+    text_index = await _enable_text_index(mbox)
+    assert text_index.num_bytes > 0
+    assert text_index.uids[mbox.id] == set(mbox.uids)
+
+    words: Counter[str] = Counter()
+    for msg_key in mbox.msg_keys:
+        headers, body = msg_search_text(mbox.get_msg(msg_key))
+        words.update(w for w in body.split() if w.isalpha() and len(w) > 3)
+        words.update(w for w in headers.split() if w.isalpha() and len(w) > 3)
+    strings = [w for w, _ in words.most_common(4)] + ["zzyzx", 'a "quote']
+
+    for op in ("body", "text"):
+        for string in strings:
+            search = IMAPSearch(op, string=string)
+            expected = await _scan(mbox, search)
+            get_msg = mocker.spy(mbox, "get_msg")
+            TEXT_INDEX_COUNTS.clear()
+            assert await mbox.search(search) == expected, (op, string)
+            assert TEXT_INDEX_COUNTS["searches"] == 1
+            get_msg.assert_not_called()
+            mocker.stop(get_msg)
+
+    # Strings too short for a trigram index are matched against the
+    # messages.
+    #
+    TEXT_INDEX_COUNTS.clear()
+    search = IMAPSearch("body", string="e")
+    assert await mbox.search(search) == await _scan(mbox, search)
+    assert TEXT_INDEX_COUNTS["scanned"] == 1
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_text_index_update(mailbox_with_bunch_of_email: Mailbox) -> None:
+    """
+    Expunged messages are removed from the index. A mailbox that is not
+    completely indexed is matched against its messages and queued to be
+    indexed.
+    """
+    mbox = mailbox_with_bunch_of_email
+    assert mbox.id is not None
+    text_index = await _enable_text_index(mbox)
+    num_bytes = text_index.num_bytes
+    search = IMAPSearch("text", string="subject")
+    assert len(await mbox.search(search)) == mbox.num_msgs
+
+    uid = mbox.uids[0]
+    mbox.sequences["Deleted"].add(mbox.msg_keys[0])
+    await mbox.expunge()
+    assert uid not in text_index.uids[mbox.id]
+    assert 0 < text_index.num_bytes < num_bytes
+    row = await mbox.server.db.fetchone(
+        "SELECT count(*) FROM msg_text WHERE mailbox_id=?", (mbox.id,)
+    )
+    assert row is not None and row[0] == mbox.num_msgs
+    assert len(await mbox.search(search)) == mbox.num_msgs
+
+    # Take a message out of the index. The mailbox is searched without the
+    # index and queued to be indexed. (The mailbox has not changed, so the
+    # search cache is cleared to have the search run again.)
+    #
+    await text_index.remove(mbox, [mbox.uids[-1]])
+    TEXT_INDEX_COUNTS.clear()
+    mbox.search_cache.clear()
+    assert len(await mbox.search(search)) == mbox.num_msgs
+    assert TEXT_INDEX_COUNTS["scanned"] == 1
+    assert mbox.name in text_index.queued
+    await text_index.index_mailbox(mbox)
+    TEXT_INDEX_COUNTS.clear()
+    mbox.search_cache.clear()
+    assert len(await mbox.search(search)) == mbox.num_msgs
+    assert TEXT_INDEX_COUNTS["searches"] == 1
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_text_index_cap_and_rebuild(
+    mailbox_with_bunch_of_email: Mailbox,
+) -> None:
+    """
+    No more messages are indexed once the index is full. Rebuilding the
+    index starts it over.
+    """
+    mbox = mailbox_with_bunch_of_email
+    assert mbox.id is not None
+    text_index = await _enable_text_index(mbox, max_bytes=1)
+    assert len(text_index.uids[mbox.id]) == 1
+    assert await text_index.search(mbox, "subject", body_only=False) is None
+
+    text_index.max_bytes = 2**30
+    await text_index.rebuild()
+    assert text_index.num_bytes == 0
+    assert text_index.uids == {}
+    assert mbox.name in text_index.queued
+    await text_index.index_mailbox(mbox)
+    assert text_index.uids[mbox.id] == set(mbox.uids)
+    matches = await text_index.search(mbox, "subject", body_only=False)
+    assert matches == set(range(mbox.num_msgs))
@@ -4,7 +4,9 @@ Test the user server.
 
 # system imports
 #
-from collections.abc import Callable
+import asyncio
+import os
+from collections.abc import Callable, Iterator
 from mailbox import MH
 from pathlib import Path
 
@@ -12,14 +14,21 @@ from pathlib import Path
 #
 import pytest
 from faker import Faker
+from pytest_mock import MockerFixture
 
 # Project imports
 #
 from ..client import Authenticated
 from ..constants import SPECIAL_USE_ATTRS
-from ..mbox import Mailbox, NoSuchMailbox
+from ..fetch import FetchLiteral
+from ..mbox import Mailbox, NoSuchMailbox, folder_mtimes
 from ..parse import IMAPClientCommand
-from ..user_server import IMAPClientProxy, IMAPUserServer
+from ..user_server import (
+    PUSH_BUFFER_BYTES,
+    WRITE_BUFFER_HIGH_WATER,
+    IMAPClientProxy,
+    IMAPUserServer,
+)
 
 
 ####################################################################
@@ -226,3 +235,152 @@ async def test_check_all_folders(
     # And stop idling on the inbox.
     #
     await client_handler.do_done()
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_check_all_folders_only_changed(
+    mocker: MockerFixture,
+    imap_user_server: IMAPUserServer,
+) -> None:
+    """
+    GIVEN: A number of folders that are not active
+    WHEN:  One of them changes and all of the folders are checked
+    THEN:  The walk of the mail directory finds the same mtimes as
+           `get_actual_mtime()`, and only the changed folder is checked
+    """
+    server = imap_user_server
+    for name in ("archive", "archive/2024", "lists"):
+        await Mailbox.create(name, server)
+
+    async def deactivate() -> None:
+        for name, mbox in list(server.active_mailboxes.items()):
+            await mbox.shutdown()
+            del server.active_mailboxes[name]
+
+    # Make sure what is in the db matches what is on disk for all folders.
+    #
+    await deactivate()
+    await server.check_all_folders()
+    await deactivate()
+
+    mtimes = folder_mtimes(server.maildir)
+    assert {"inbox", "archive", "archive/2024", "lists"} <= set(mtimes)
+    for name, mtime in mtimes.items():
+        assert mtime == await Mailbox.get_actual_mtime(server.mailbox, name)
+
+    path = server.maildir / "archive" / "2024"
+    (path / "1").write_text("Subject: hi\n\nhi\n")
+    future = os.stat(path).st_mtime + 10
+    os.utime(path, (future, future))
+
+    check_folder = mocker.spy(server, "check_folder")
+    await server.check_all_folders()
+    assert [x.args[0] for x in check_folder.call_args_list if x.args[0]] == [
+        "archive/2024"
+    ]
+    assert "archive/2024" in server.active_mailboxes
+
+
+####################################################################
+#
+async def _pipe_client(
+    server: IMAPUserServer,
+) -> tuple[IMAPClientProxy, asyncio.StreamReader]:
+    """
+    Make an IMAPClientProxy that writes to a pipe, and a stream reader that
+    reads what it writes.
+    """
+    loop = asyncio.get_running_loop()
+    read_fd, write_fd = os.pipe()
+    reader = asyncio.StreamReader()
+    await loop.connect_read_pipe(
+        lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, "rb")
+    )
+    transport, protocol = await loop.connect_write_pipe(
+        lambda: asyncio.streams.FlowControlMixin(loop=loop),
+        os.fdopen(write_fd, "wb"),
+    )
+    writer = asyncio.StreamWriter(transport, protocol, None, loop)
+    client = IMAPClientProxy(
+        server, "test", 1, "127.0.0.1", 1234, asyncio.StreamReader(), writer
+    )
+    return client, reader
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_push_coalesces_untagged_responses(
+    imap_user_server: IMAPUserServer,
+) -> None:
+    """
+    Untagged responses are buffered until a tagged response, the buffer
+    filling up, or the flush interval passing.
+    """
+    client, reader = await _pipe_client(imap_user_server)
+
+    untagged = [
+        b"* %d FETCH (FLAGS (\\Seen) UID %d)\r\n" % (i, i)
+        for i in range(1, 101)
+    ]
+    for response in untagged:
+        await client.push(response)
+    assert client.num_flushes.total() == 0
+    await client.push("A001 OK FETCH command completed\r\n")
+    assert client.num_flushes == {"tagged": 1}
+
+    expected = b"".join(untagged) + b"A001 OK FETCH command completed\r\n"
+    assert await reader.readexactly(len(expected)) == expected
+    assert client.flushed_bytes == len(expected)
+
+    # Lots of untagged responses are flushed when the buffer fills up.
+    #
+    response = b"* 1 FETCH (BODY[] {1024}\r\n" + b"x" * 1024 + b")\r\n"
+    num = PUSH_BUFFER_BYTES // len(response) + 1
+    read_task = asyncio.create_task(reader.readexactly(len(response) * num))
+    for _ in range(num):
+        await client.push(response)
+    assert client.num_flushes["size"] == 1
+    assert await read_task == response * num
+
+    # An untagged response on its own (ie: while the client is IDLE'ing) is
+    # flushed after a short time.
+    #
+    await client.push("* 23 EXISTS\r\n")
+    assert await reader.readexactly(13) == b"* 23 EXISTS\r\n"
+    assert client.num_flushes["timer"] == 1
+    client.writer.close()
+
+
+####################################################################
+#
+@pytest.mark.asyncio
+async def test_push_literal(imap_user_server: IMAPUserServer) -> None:
+    """
+    A streamed literal is written to the client a chunk at a time, with the
+    writer never buffering much more than its high water mark.
+    """
+    client, reader = await _pipe_client(imap_user_server)
+    transport = client.writer.transport
+
+    chunk = b"x" * 65536
+    num_chunks = 64
+    max_buffered = 0
+
+    def chunks() -> Iterator[bytes]:
+        nonlocal max_buffered
+        for _ in range(num_chunks):
+            max_buffered = max(max_buffered, transport.get_write_buffer_size())
+            yield chunk
+
+    length = len(chunk) * num_chunks
+    literal = FetchLiteral(b"BODY[] {%d}\r\n" % length, length, chunks())
+    read_task = asyncio.create_task(reader.readexactly(len(literal)))
+    await client.push_literal(literal)
+    data = await read_task
+    client.writer.close()
+
+    assert data == literal.prefix + chunk * num_chunks
+    assert max_buffered <= WRITE_BUFFER_HIGH_WATER + len(chunk)
@@ -20,6 +20,7 @@ from faker import Faker
 from ..exceptions import Bad
 from ..utils import (
     UID_HDR,
+    SavedResult,
     UpgradeableReadWriteLock,
     compact_sequence,
     expand_sequence,
@@ -662,3 +663,33 @@ def test_compact_expand_sequences(data: list[int], expected: str) -> None:
     compact = compact_sequence(data)
     assert compact == expected
     assert expand_sequence(compact) == data
+
+
+####################################################################
+#
+def test_saved_result() -> None:
+    """
+    A SavedResult keeps its UIDs as ranges, can have UIDs removed, and maps
+    to ranges of indices in to a mailbox's list of UIDs.
+    """
+    saved = SavedResult([9, 1, 2, 3, 5, 7, 8, 3])
+    assert saved.ranges == [(1, 3), (5, 5), (7, 9)]
+    assert str(saved) == "1:3,5,7:9"
+    assert len(saved) == 7
+    assert 1 in saved and 5 in saved and 9 in saved
+    assert 4 not in saved and 10 not in saved
+
+    saved.discard([1, 5, 8, 100])
+    assert saved.ranges == [(2, 3), (7, 7), (9, 9)]
+
+    # UIDs that are not in the mailbox are skipped.
+    #
+    uids = [2, 3, 4, 8, 9, 10]
+    assert list(saved.index_ranges(uids)) == [range(0, 2), range(4, 5)]
+
+    copy = SavedResult()
+    assert not copy
+    copy.replace(saved)
+    assert copy.ranges == saved.ranges
+    copy.discard([2])
+    assert saved.ranges == [(2, 3), (7, 7), (9, 9)]
@@ -0,0 +1,516 @@
+"""
+An optional full text index, using sqlite's FTS5, of the text that SEARCH
+BODY and TEXT look in.
+
+Without it every BODY or TEXT search reads, parses and decodes every
+message it is matched against. With it a search is a single FTS5 query.
+
+What is indexed for each message is what `generator.msg_search_text()`
+returns for it: its decoded headers (including those of its MIME parts)
+and the decoded content of its text parts. The index uses FTS5's trigram
+tokenizer so a query matches any substring, the same as matching against the
+message does. Strings of fewer than three characters can not be looked up in
+a trigram index and are matched against the messages.
+
+The index is built in the background: a mailbox is queued for indexing
+whenever a resync finds new messages in it (and when a search finds it is
+not fully indexed.) Only a mailbox whose messages are all in the index has
+its BODY and TEXT searches answered from it. The total size of the text in
+the index for a user is capped (see `TEXT_INDEX_BYTES`.) Once the cap is
+reached no more messages are indexed until messages are expunged or the
+index is rebuilt.
+
+The index is off unless the user server is configured with a size cap. An
+administrator can have a user server rebuild its index from scratch by
+sending it SIGUSR2.
+"""
+
+# system imports
+#
+import asyncio
+import logging
+import sqlite3
+from collections import Counter
+from typing import TYPE_CHECKING
+
+# Project imports
+#
+from .executor import run_in_thread
+from .generator import msg_search_text
+from .msg_files import parse_msg_file
+from .search import IMAPSearch, SearchOp
+
+if TYPE_CHECKING:
+    from .mbox import Mailbox
+    from .user_server import IMAPUserServer
+
+logger = logging.getLogger("asimap.text_index")
+
+# The maximum size, in characters of text, of a user's text index. 0 means
+# there is no text index. Can be changed via `set_text_index_bytes()`.
+#
+TEXT_INDEX_BYTES: int = 0
+
+# Messages are read and decoded this many at a time off of the event loop,
+# and written to the index together.
+#
+TEXT_INDEX_BATCH_SIZE = 50
+
+# The trigram tokenizer can only look up strings at least this long.
+#
+TEXT_INDEX_MIN_STRING = 3
+
+# Counts of the work done by text indexes: "indexed" for messages added to
+# the index, "searches" for BODY and TEXT searches answered from the index,
+# and "scanned" for those that were matched against the messages instead.
+# Logged and cleared by the user server when it dumps its metrics.
+#
+TEXT_INDEX_COUNTS: Counter[str] = Counter()
+
+
+####################################################################
+#
+def set_text_index_bytes(num_bytes: int) -> None:
+    """
+    Set the maximum size of a user's text index. 0 disables the index.
+    This only affects user servers created after it is called.
+    """
+    global TEXT_INDEX_BYTES
+    TEXT_INDEX_BYTES = num_bytes
+
+
+####################################################################
+#
+def _fts_phrase(string: str) -> str:
+    """
+    `string` as an FTS5 phrase, so that none of it is interpreted as query
+    syntax.
+    """
+    return '"' + string.replace('"', '""') + '"'
+
+
+########################################################################
+########################################################################
+#
+class TextIndex:
+    """
+    The full text index of all of a user's mailboxes.
+    """
+
+    ####################################################################
+    #
+    def __init__(self, server: "IMAPUserServer"):
+        """
+        Arguments:
+        - `server`: The user server whose mailboxes we index
+        """
+        self.server = server
+        self.max_bytes = TEXT_INDEX_BYTES
+        self.enabled = False
+
+        # The total size of the text in the index.
+        #
+        self.num_bytes = 0
+
+        # The UID's of the messages in the index, by mailbox id. A mailbox's
+        # entry is loaded from the db the first time it is needed.
+        #
+        self.uids: dict[int, set[int]] = {}
+
+        # The mailboxes waiting to be indexed, in order, and by name so a
+        # mailbox is only queued once.
+        #
+        self.queue: asyncio.Queue[Mailbox] = asyncio.Queue()
+        self.queued: set[str] = set()
+
+        self.task: asyncio.Task | None = None
+        self.rebuild_task: asyncio.Task | None = None
+
+    ####################################################################
+    #
+    async def setup(self) -> None:
+        """
+        Create the FTS5 table if the index is enabled and it does not exist
+        yet. If this sqlite does not have FTS5 (or its trigram tokenizer)
+        the index stays disabled.
+        """
+        if self.max_bytes <= 0:
+            return
+        try:
+            await self.server.db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS msg_text_fts USING "
+                "fts5(headers, body, tokenize='trigram')",
+                commit=True,
+            )
+        except sqlite3.OperationalError as exc:
+            logger.warning("Not using a text index: %s", exc)
+            return
+
+        row = await self.server.db.fetchone("SELECT total(size) FROM msg_text")
+        self.num_bytes = int(row[0]) if row else 0
+        self.enabled = True
+
+    ####################################################################
+    #
+    def start(self) -> None:
+        """
+        Start the task that indexes queued mailboxes.
+        """
+        if self.enabled and self.task is None:
+            self.task = asyncio.create_task(self.run(), name="text_indexer")
+
+    ####################################################################
+    #
+    async def shutdown(self) -> None:
+        """
+        Stop the indexing (and any rebuild) task.
+        """
+        for task in (self.task, self.rebuild_task):
+            if task and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self.task = None
+        self.rebuild_task = None
+
+    ####################################################################
+    #
+    def schedule(self, mbox: "Mailbox") -> None:
+        """
+        Queue a mailbox to have the messages that are not in the index yet
+        added to it.
+        """
+        if not self.enabled or mbox.name in self.queued:
+            return
+        self.queued.add(mbox.name)
+        self.queue.put_nowait(mbox)
+
+    ####################################################################
+    #
+    async def run(self) -> None:
+        """
+        Index queued mailboxes until cancelled.
+        """
+        while True:
+            mbox = await self.queue.get()
+            self.queued.discard(mbox.name)
+            if mbox.deleted:
+                continue
+            try:
+                await self.index_mailbox(mbox)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                logger.exception(
+                    "Mailbox: '%s', unable to update text index: %s",
+                    mbox.name,
+                    exc,
+                )
+
+    ####################################################################
+    #
+    async def _indexed_uids(self, mbox: "Mailbox") -> set[int]:
+        """
+        The UID's of the messages of `mbox` that are in the index, loaded
+        from the db the first time. Rows for messages that are no longer in
+        the mailbox are removed when they are loaded.
+        """
+        assert mbox.id is not None
+        uids = self.uids.get(mbox.id)
+        if uids is not None:
+            return uids
+
+        uids = set()
+        stale = []
+        mbox_uids = set(mbox.uids)
+        async with mbox.db_lock:
+            async for uid_vv, uid in self.server.db.query(
+                "SELECT uid_vv, uid FROM msg_text WHERE mailbox_id=?",
+                (mbox.id,),
+            ):
+                if uid_vv == mbox.uid_vv and uid in mbox_uids:
+                    uids.add(uid)
+                else:
+                    stale.append(uid)
+        self.uids[mbox.id] = uids
+        if stale:
+            await self.remove(mbox, stale)
+        return uids
+
+    ####################################################################
+    #
+    def _read_text(
+        self, mbox: "Mailbox", msgs: list[tuple[int, int]]
+    ) -> list[tuple[int, int, str, str]]:
+        """
+        Read and decode the text of the given messages. Runs off of the
+        event loop.
+
+        Arguments:
+        - `mbox`: The mailbox the messages are in
+        - `msgs`: (msg_key, uid) of the messages to read
+
+        Returns (msg_key, uid, headers, body) for each message that is
+        still in the mailbox.
+        """
+        results = []
+        for msg_key, uid in msgs:
+            try:
+                msg = parse_msg_file(mbox.mailbox.get_message_path(msg_key))
+            except FileNotFoundError:
+                continue
+            headers, body = msg_search_text(msg)
+            results.append((msg_key, uid, headers, body))
+        return results
+
+    ####################################################################
+    #
+    async def index_mailbox(self, mbox: "Mailbox") -> None:
+        """
+        Add the messages of `mbox` that are not in the index to it, until
+        they are all in it or the index is full.
+        """
+        indexed = await self._indexed_uids(mbox)
+        missing = [
+            (msg_key, uid)
+            for msg_key, uid in zip(mbox.msg_keys, mbox.uids, strict=True)
+            if uid not in indexed
+        ]
+        if missing:
+            logger.info(
+                "Mailbox: '%s', adding %d messages to the text index",
+                mbox.name,
+                len(missing),
+            )
+
+        for i in range(0, len(missing), TEXT_INDEX_BATCH_SIZE):
+            if self._full(mbox):
+                return
+            batch = missing[i : i + TEXT_INDEX_BATCH_SIZE]
+            rows = await run_in_thread(self._read_text, mbox, batch)
+
+            async with mbox.db_lock:
+                for msg_key, uid, headers, body in rows:
+                    # The mailbox may have been expunged or packed while we
+                    # were reading the messages.
+                    #
+                    idx = mbox._uid_to_idx.get(uid)
+                    if idx is None or mbox.msg_keys[idx] != msg_key:
+                        continue
+                    if uid in indexed:
+                        continue
+                    if self.num_bytes >= self.max_bytes:
+                        break
+                    size = len(headers) + len(body)
+                    await self.server.db.execute(
+                        "INSERT INTO msg_text (mailbox_id, uid_vv, uid, size) "
+                        "VALUES (?,?,?,?)",
+                        (mbox.id, mbox.uid_vv, uid, size),
+                    )
+                    await self.server.db.execute(
+                        "INSERT INTO msg_text_fts (rowid, headers, body) "
+                        "VALUES (last_insert_rowid(), ?, ?)",
+                        (headers, body),
+                    )
+                    indexed.add(uid)
+                    self.num_bytes += size
+                    TEXT_INDEX_COUNTS["indexed"] += 1
+                await self.server.db.commit()
+
+        if len(indexed) < mbox.num_msgs:
+            self._full(mbox)
+
+    ####################################################################
+    #
+    def _full(self, mbox: "Mailbox") -> bool:
+        """
+        True, and log that `mbox` is not completely indexed, if the index
+        has reached its maximum size.
+        """
+        if self.num_bytes < self.max_bytes:
+            return False
+        logger.warning(
+            "Text index is full (%d bytes). Mailbox '%s' is not completely "
+            "indexed.",
+            self.num_bytes,
+            mbox.name,
+        )
+        return True
+
+    ####################################################################
+    #
+    async def remove(self, mbox: "Mailbox", uids: list[int]) -> None:
+        """
+        Remove expunged messages of `mbox` from the index.
+        """
+        if not self.enabled or not uids:
+            return
+        async with mbox.db_lock:
+            for i in range(0, len(uids), TEXT_INDEX_BATCH_SIZE):
+                batch = uids[i : i + TEXT_INDEX_BATCH_SIZE]
+                qms = ",".join(["?"] * len(batch))
+                where = f"mailbox_id=? AND uid IN ({qms})"
+                row = await self.server.db.fetchone(
+                    f"SELECT total(size) FROM msg_text WHERE {where}",
+                    (mbox.id, *batch),
+                )
+                self.num_bytes -= int(row[0]) if row else 0
+                await self.server.db.execute(
+                    "DELETE FROM msg_text_fts WHERE rowid IN "
+                    f"(SELECT id FROM msg_text WHERE {where})",
+                    (mbox.id, *batch),
+                )
+                await self.server.db.execute(
+                    f"DELETE FROM msg_text WHERE {where}", (mbox.id, *batch)
+                )
+            await self.server.db.commit()
+        if mbox.id is not None and mbox.id in self.uids:
+            self.uids[mbox.id].difference_update(uids)
+
+    ####################################################################
+    #
+    async def remove_mailbox(self, mbox: "Mailbox") -> None:
+        """
+        Remove all of the messages of a mailbox from the index (it was
+        deleted, or all of its messages were moved out of it.)
+        """
+        if not self.enabled or mbox.id is None:
+            return
+        async with mbox.db_lock:
+            row = await self.server.db.fetchone(
+                "SELECT total(size) FROM msg_text WHERE mailbox_id=?",
+                (mbox.id,),
+            )
+            self.num_bytes -= int(row[0]) if row else 0
+            await self.server.db.execute(
+                "DELETE FROM msg_text_fts WHERE rowid IN "
+                "(SELECT id FROM msg_text WHERE mailbox_id=?)",
+                (mbox.id,),
+            )
+            await self.server.db.execute(
+                "DELETE FROM msg_text WHERE mailbox_id=?", (mbox.id,)
+            )
+            await self.server.db.commit()
+        self.uids.pop(mbox.id, None)
+
+    ####################################################################
+    #
+    async def search(
+        self, mbox: "Mailbox", string: str, body_only: bool
+    ) -> set[int] | None:
+        """
+        The indices (message sequence number - 1) of the messages of `mbox`
+        whose text contains `string`. None if the index can not answer this
+        search: it is disabled, the string is too short, or the mailbox is
+        not completely indexed (in which case it is queued to be.)
+
+        Arguments:
+        - `mbox`: The mailbox being searched
+        - `string`: The lowercased string to look for
+        - `body_only`: If True only the text of the messages' bodies is
+          searched (BODY), otherwise their headers are as well (TEXT)
+        """
+        if not self.enabled or len(string) < TEXT_INDEX_MIN_STRING:
+            return None
+        indexed = await self._indexed_uids(mbox)
+        if len(indexed) < mbox.num_msgs or not indexed.issuperset(mbox.uids):
+            self.schedule(mbox)
+            return None
+
+        query = _fts_phrase(string)
+        if body_only:
+            query = f"body : {query}"
+        uid_to_idx = mbox._uid_to_idx
+        result = set()
+        async with mbox.db_lock:
+            async for row in self.server.db.query(
+                "SELECT msg_text.uid FROM msg_text_fts JOIN msg_text "
+                "ON msg_text.id = msg_text_fts.rowid "
+                "WHERE msg_text_fts MATCH ? AND msg_text.mailbox_id=? "
+                "AND msg_text.uid_vv=?",
+                (query, mbox.id, mbox.uid_vv),
+            ):
+                if row[0] in uid_to_idx:
+                    result.add(uid_to_idx[row[0]])
+        return result
+
+    ####################################################################
+    #
+    async def resolve(self, mbox: "Mailbox", search: IMAPSearch) -> None:
+        """
+        Look up the messages matched by each BODY and TEXT search key in
+        `search` in the index, if it can answer them. Those search keys
+        then match from that set instead of reading each message (see
+        `IMAPSearch.index_matches`)
+
+        Arguments:
+        - `mbox`: The mailbox being searched
+        - `search`: A planned search (see `IMAPSearch.plan()`). Its search
+          keys are modified.
+        """
+        for search_key in search.walk():
+            if search_key.op not in (SearchOp.BODY, SearchOp.TEXT):
+                continue
+            matches = await self.search(
+                mbox,
+                search_key.args["string"],
+                body_only=search_key.op == SearchOp.BODY,
+            )
+            TEXT_INDEX_COUNTS[
+                "searches" if matches is not None else "scanned"
+            ] += 1
+            search_key.index_matches = matches
+
+    ####################################################################
+    #
+    def request_rebuild(self) -> None:
+        """
+        Start rebuilding the index from scratch, unless a rebuild is
+        already running. This is what the user server does when it gets a
+        SIGUSR2.
+        """
+        if not self.enabled:
+            logger.warning("Asked to rebuild text index, but it is disabled")
+            return
+        if self.rebuild_task and not self.rebuild_task.done():
+            return
+        self.rebuild_task = asyncio.create_task(
+            self.rebuild(), name="text_index_rebuild"
+        )
+
+    ####################################################################
+    #
+    async def rebuild(self) -> None:
+        """
+        Throw away the index and queue all of the active mailboxes to be
+        indexed again. Other mailboxes are indexed again as they are
+        resynced or searched.
+        """
+        logger.info("Rebuilding text index (was %d bytes)", self.num_bytes)
+
+        # Stop indexing while we throw the index away.
+        #
+        indexing = self.task is not None
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+        self.queue = asyncio.Queue()
+        self.queued = set()
+
+        await self.server.db.execute("DELETE FROM msg_text")
+        await self.server.db.execute("DROP TABLE IF EXISTS msg_text_fts")
+        await self.server.db.commit()
+        self.uids = {}
+        self.num_bytes = 0
+        self.enabled = False
+        await self.setup()
+        for mbox in list(self.server.active_mailboxes.values()):
+            self.schedule(mbox)
+        if indexing:
+            self.start()
@@ -42,9 +42,26 @@ from .client import Authenticated
 from .constants import MAX_INPUT_SIZE, SPECIAL_USE_ATTRS
 from .db import Database
 from .exceptions import MailboxInconsistency
-from .mbox import Mailbox, NoSuchMailbox
+from .executor import (
+    EXECUTOR_COUNTS,
+    LoopLagMonitor,
+    run_in_thread,
+    shutdown_executors,
+)
+from .fetch import FETCH_BODY_PATHS, FETCH_PLAN_KINDS, FetchLiteral
+from .folder_watcher import WATCHER_COUNTS, FolderWatcher
+from .header_index import HEADER_INDEX_TASKS
+from .mbox import (
+    RESYNC_SCANS,
+    RESYNCS,
+    Mailbox,
+    NoSuchMailbox,
+    folder_mtimes,
+)
 from .mh import MH
 from .parse import BadCommand, IMAPClientCommand
+from .search import SEARCH_TEXT_COUNTS
+from .text_index import TEXT_INDEX_COUNTS, TextIndex
 from .trace import toggle_trace, trace
 
 if TYPE_CHECKING:
@@ -69,6 +86,28 @@ TIME_BETWEEN_FULL_FOLDER_SCANS = 120
 TIME_BETWEEN_METRIC_DUMPS = 60
 TIME_BETWEEN_FOLDER_SCANS = 90
 
+# Flow control for what we send to IMAP clients. When more than the high water
+# mark is buffered for a client we wait until it is drained below the low
+# water mark before writing more. A client whose buffer makes no progress at
+# all for PUSH_STALL_TIMEOUT seconds is assumed to be gone and is
+# disconnected (a slow client that is still reading is not.)
+#
+WRITE_BUFFER_HIGH_WATER = 256 * 1024
+WRITE_BUFFER_LOW_WATER = 64 * 1024
+PUSH_STALL_TIMEOUT = 2
+
+# While a client is reading a streamed literal we keep pushing the timeout of
+# the command it is for out to at least this many seconds from now.
+#
+LITERAL_TIMEOUT_EXTEND = 10.0
+
+# Untagged responses to a client are buffered until there are this many octets
+# of them, or it has been this many seconds since the first one was buffered,
+# or we send a tagged response (see `IMAPClientProxy.push()`)
+#
+PUSH_BUFFER_BYTES = 64 * 1024
+PUSH_FLUSH_INTERVAL = 0.02
+
 
 ####################################################################
 #
@@ -138,11 +177,23 @@ class IMAPClientProxy:
         #     it on to the subprocess like it should pass on the original
         #     source ip & port.
         self.cmd_processor = Authenticated(self, self.server)
+        self.writer.transport.set_write_buffer_limits(
+            high=WRITE_BUFFER_HIGH_WATER, low=WRITE_BUFFER_LOW_WATER
+        )
 
         # used by the `run()` to continue reading from the client.
         #
         self.client_connected = False
 
+        # Our output buffer (see `push()`), the timer that will flush it,
+        # and counters for our metrics.
+        #
+        self._out_buf: list[bytes] = []
+        self._out_buf_size = 0
+        self._flush_handle: asyncio.TimerHandle | None = None
+        self.num_flushes: Counter[str] = Counter()
+        self.flushed_bytes = 0
+
     ####################################################################
     #
     async def close(self, cancel_reader: bool = True) -> None:
@@ -151,6 +202,7 @@ class IMAPClientProxy:
         """
         self.client_connected = False
         try:
+            self._flush("close")
             if not self.writer.is_closing():
                 self.writer.close()
             await self.writer.wait_closed()
@@ -393,7 +445,16 @@ class IMAPClientProxy:
         """
         Write data to the IMAP client by sending it up to the main process,
         which in turn sends it to the IMAP client.
+
+        Untagged responses are collected in an output buffer that is only
+        written to the client when it reaches PUSH_BUFFER_BYTES, or
+        PUSH_FLUSH_INTERVAL seconds after the first response was added to
+        it. Anything else (a tagged response, a continuation request, the
+        end of a streamed FETCH response) flushes the buffer immediately. So
+        a `FETCH 1:* (FLAGS UID)` on 200k messages costs one write and drain
+        per PUSH_BUFFER_BYTES, not per message.
         """
+        untagged = True
         for d in data:
             try:
                 d = d.encode("latin-1") if isinstance(d, str) else d
@@ -407,42 +468,139 @@ class IMAPClientProxy:
                 #
                 logger.warning("Unable to encode string using `latin-1`: %s", d)
                 d = d.encode("utf-8", "replace") if isinstance(d, str) else d
+            untagged = untagged and d.startswith(b"* ")
+            self._out_buf.append(d)
+            self._out_buf_size += len(d)
+
+        if not untagged:
+            self._flush("tagged")
+            await self._drain()
+        elif self._out_buf_size >= PUSH_BUFFER_BYTES:
+            self._flush("size")
+            await self._drain()
+        elif self._flush_handle is None and self._out_buf:
+            self._flush_handle = asyncio.get_running_loop().call_later(
+                PUSH_FLUSH_INTERVAL, self._flush, "timer"
+            )
+
+        if asimap.trace.TRACE_ENABLED:
+            try:
+                for d in data:
+                    msg = str(d, "latin-1") if isinstance(d, bytes) else d
+                    self.trace("SEND", {"data": msg})
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.exception("Error sending trace: %s", e)
+
+    ####################################################################
+    #
+    async def push_literal(
+        self,
+        literal: FetchLiteral,
+        timeout_cm: asyncio.Timeout | None = None,
+    ) -> None:
+        """
+        Write a `FetchLiteral` to the IMAP client a chunk at a time, waiting
+        for the client to catch up whenever we have more than
+        WRITE_BUFFER_HIGH_WATER octets buffered for it. This way sending a
+        25mb message never needs more than one chunk of it in memory.
+
+        NOTE: Once we have started sending a literal we have to send all of
+              it. If the client goes away part way through we just stop.
+
+        Args:
+            literal: The literal to send
+            timeout_cm: The timeout of the command we are sending this for.
+                As long as the client keeps reading the literal we keep
+                pushing this timeout out so a slow link does not time out
+                the command.
+        """
+        await self.push(literal.prefix)
+        async for chunk in literal.chunks():
+            if self.writer.is_closing():
+                break
             try:
-                self.writer.write(d)
+                self.writer.write(chunk)
             except asyncio.CancelledError:
                 raise
             except Exception as exc:
                 raise ConnectionError(
                     f"unable to write message: {exc!r}"
                 ) from exc
+            await self._drain()
 
-        if not self.writer.is_closing():
-            # If the drain takes more than 2 seconds something has likely gone
-            # wrong. Exit out. This blocking can hold on to locks too long.
-            #
+            if timeout_cm is not None and not timeout_cm.expired():
+                when = (
+                    asyncio.get_running_loop().time() + LITERAL_TIMEOUT_EXTEND
+                )
+                timeout_cm.reschedule(max(timeout_cm.when() or when, when))
+
+        if asimap.trace.TRACE_ENABLED:
+            self.trace("SEND", {"data": f"<literal: {literal.length} octets>"})
+
+    ####################################################################
+    #
+    def _flush(self, reason: str) -> None:
+        """
+        Write everything in our output buffer to the IMAP client.
+
+        Args:
+            reason: Why we are flushing ("tagged", "size", "timer", or
+                "close"). Counted in `self.num_flushes` for our metrics.
+        """
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._out_buf:
+            return
+
+        data = b"".join(self._out_buf)
+        self._out_buf = []
+        self._out_buf_size = 0
+        self.num_flushes[reason] += 1
+        self.flushed_bytes += len(data)
+        if self.writer.is_closing():
+            return
+        try:
+            self.writer.write(data)
+        except asyncio.CancelledError:
+            raise
+        except Exception as exc:
+            raise ConnectionError(f"unable to write message: {exc!r}") from exc
+
+    ####################################################################
+    #
+    async def _drain(self) -> None:
+        """
+        Wait until what we have written to the IMAP client has drained below
+        the writer's low water mark.
+
+        A slow client can take as long as it needs, as long as it is making
+        progress. If nothing drains for PUSH_STALL_TIMEOUT seconds the client
+        is likely gone and we close the connection, otherwise we would hold on
+        to mailbox locks for too long.
+        """
+        transport = self.writer.transport
+        while not self.writer.is_closing():
+            buffered = transport.get_write_buffer_size()
             try:
-                async with asyncio.timeout(2):
+                async with asyncio.timeout(PUSH_STALL_TIMEOUT):
                     await self.writer.drain()
+                return
             except TimeoutError as exc:
+                if transport.get_write_buffer_size() < buffered:
+                    continue
                 logger.warning(
-                    "Closing writer stream for %s, %s, reason: timed out "
-                    "attempting push: %s",
+                    "Closing writer stream for %s, %s, reason: no progress "
+                    "draining %d octets: %s",
                     self.name,
                     self.rem_addr,
+                    buffered,
                     exc,
                 )
                 self.writer.close()
 
-        if asimap.trace.TRACE_ENABLED:
-            try:
-                for d in data:
-                    msg = str(d, "latin-1") if isinstance(d, bytes) else d
-                    self.trace("SEND", {"data": msg})
-            except asyncio.CancelledError:
-                raise
-            except Exception as e:
-                logger.exception("Error sending trace: %s", e)
-
     ##################################################################
     #
     def log_string(self) -> str:
@@ -470,6 +628,7 @@ class IMAPUserServer:
         self,
         maildir: Path,
         debug: bool | None = False,
+        render_processes: int = 0,
     ):
         """
         Setup our dispatcher.. listen on a port we are supposed to accept
@@ -479,9 +638,13 @@ class IMAPUserServer:
         Args:
         options: The options set on the command line
         maildir: The directory our mailspool and database are in
+        render_processes: The number of FETCH render processes large
+            FETCH's are rendered in (see `asimap.fetch_worker`). 0, the
+            default, renders all FETCH's in this process.
         """
         self.maildir = maildir
         self.debug = debug
+        self.render_processes = render_processes
 
         self.log = logging.getLogger(f"{__name__}.{self.__class__.__name__}")
 
@@ -548,6 +711,30 @@ class IMAPUserServer:
 
         self.management_task: asyncio.Task | None = None
 
+        # Measures how late the event loop runs things (anything that blocks
+        # it, like rendering messages on it, shows up here.) Its numbers are
+        # part of our metrics.
+        #
+        self.loop_lag = LoopLagMonitor()
+        self.loop_lag_task: asyncio.Task | None = None
+
+        # The optional full text index of BODY and TEXT searches, built in
+        # the background.
+        #
+        self.text_index = TextIndex(self)
+
+        # Limits how many mailboxes add new messages to their header index
+        # at once (see `HeaderIndex.schedule()`)
+        #
+        self.header_index_limit = asyncio.Semaphore(HEADER_INDEX_TASKS)
+
+        # Tells us, through `folders_changed()`, when something changes a
+        # folder so mailboxes do not have to keep polling their folders. If
+        # inotify is not available it is never started and mailboxes poll.
+        #
+        self.folder_watcher = FolderWatcher(self.maildir, self.folders_changed)
+        self.folder_watcher_tasks: set[asyncio.Task] = set()
+
         # Statistics for the `check_all_folders` function
         # key is mbox name, value is a time duration in seconds.
         #
@@ -612,14 +799,18 @@ class IMAPUserServer:
         cls,
         maildir: Path,
         debug: bool | None = False,
+        render_processes: int = 0,
     ) -> "IMAPUserServer":
-        user_server = cls(maildir, debug=debug)
+        user_server = cls(
+            maildir, debug=debug, render_processes=render_processes
+        )
 
         # A handle to the sqlite3 database where we store our persistent
         # information.
         #
         user_server.db = await Database.new(maildir)
         await user_server._restore_from_db()
+        await user_server.text_index.setup()
         return user_server
 
     ####################################################################
@@ -631,6 +822,16 @@ class IMAPUserServer:
         if self.management_task and not self.management_task.done():
             self.management_task.cancel()
             await self.management_task
+        if self.loop_lag_task and not self.loop_lag_task.done():
+            self.loop_lag_task.cancel()
+            try:
+                await self.loop_lag_task
+            except asyncio.CancelledError:
+                pass
+        await self.text_index.shutdown()
+        self.folder_watcher.close()
+        for task in list(self.folder_watcher_tasks):
+            task.cancel()
 
         # Close all client connections
         #
@@ -653,6 +854,7 @@ class IMAPUserServer:
         await self.db.commit()
         await self.db.close()
         self.mailbox.close()
+        shutdown_executors()
 
     ####################################################################
     #
@@ -690,6 +892,10 @@ class IMAPUserServer:
         loop = asyncio.get_event_loop()
         loop.add_signal_handler(signal.SIGUSR1, toggle_trace)
 
+        # And SIGUSR2 to rebuild the text index
+        #
+        loop.add_signal_handler(signal.SIGUSR2, self.text_index.request_rebuild)
+
         # Listen on localhost for connections from the main server process.
         #
         self.asyncio_server = await asyncio.start_server(
@@ -701,8 +907,9 @@ class IMAPUserServer:
 
         try:
             # Before we tell the main server process what port we are listening
-            # on we will do a find all the folders.
+            # on we will do a find all the folders (and start watching them.)
             #
+            self.folder_watcher.start()
             await self.find_all_folders()
 
             # Start the task that checks all folders
@@ -711,6 +918,10 @@ class IMAPUserServer:
                 self.user_server_management_task(),
                 name="user_server_management_task",
             )
+            self.loop_lag_task = asyncio.create_task(
+                self.loop_lag.run(), name="loop_lag_monitor"
+            )
+            self.text_index.start()
 
             # Let the initial folder scan begin before we accept any clients to
             # give it a head start.
@@ -796,6 +1007,128 @@ class IMAPUserServer:
             len(self.active_mailboxes),
         )
         logger.info("Number of clients: %d", len(self.clients))
+
+        # Message and search cache stats, summed across all active mailboxes.
+        #
+        for name, cache_attr in (
+            ("Message cache", "msg_cache"),
+            ("Raw index cache", "raw_index_cache"),
+            ("Section cache", "section_cache"),
+            ("Search cache", "search_cache"),
+            ("Search text cache", "search_text_cache"),
+        ):
+            cache_hits = cache_misses = cache_evictions = cache_bytes = 0
+            for mbox in self.active_mailboxes.values():
+                cache = getattr(mbox, cache_attr)
+                cache_hits += cache.hits
+                cache_misses += cache.misses
+                cache_evictions += cache.evictions
+                cache_bytes += cache.num_bytes
+                cache.reset_stats()
+            lookups = cache_hits + cache_misses
+            logger.info(
+                "%s: hits: %d, misses: %d, hit ratio: %.2f, "
+                "evictions: %d, bytes: %d",
+                name,
+                cache_hits,
+                cache_misses,
+                cache_hits / lookups if lookups else 0.0,
+                cache_evictions,
+                cache_bytes,
+            )
+
+        # Output buffer flushes, summed across all IMAP clients.
+        #
+        num_flushes: Counter[str] = Counter()
+        flushed_bytes = 0
+        for client in self.clients.values():
+            if isinstance(client, IMAPClientProxy):
+                num_flushes.update(client.num_flushes)
+                flushed_bytes += client.flushed_bytes
+                client.num_flushes.clear()
+                client.flushed_bytes = 0
+        total_flushes = num_flushes.total()
+        if total_flushes:
+            logger.info(
+                "Output flushes: %d (%s), bytes: %d, bytes per flush: %.1f",
+                total_flushes,
+                ", ".join(f"{x}: {y}" for x, y in num_flushes.most_common()),
+                flushed_bytes,
+                flushed_bytes / total_flushes,
+            )
+
+        body_paths = ", ".join(
+            f"{x}: {y}" for x, y in FETCH_BODY_PATHS.most_common()
+        )
+        if body_paths:
+            logger.info("FETCH of entire messages by path: %s", body_paths)
+        FETCH_BODY_PATHS.clear()
+        plan_kinds = ", ".join(
+            f"{x}: {y}" for x, y in FETCH_PLAN_KINDS.most_common()
+        )
+        if plan_kinds:
+            logger.info("FETCH commands by plan: %s", plan_kinds)
+        FETCH_PLAN_KINDS.clear()
+
+        # How much work we did off of the event loop, and how late the event
+        # loop was in running things.
+        #
+        executor_counts = ", ".join(
+            f"{x}: {y}" for x, y in EXECUTOR_COUNTS.most_common()
+        )
+        if executor_counts:
+            logger.info("Work run off the event loop: %s", executor_counts)
+        EXECUTOR_COUNTS.clear()
+        if self.text_index.enabled:
+            logger.info(
+                "Text index: bytes: %d, queued mailboxes: %d, %s",
+                self.text_index.num_bytes,
+                len(self.text_index.queued),
+                ", ".join(
+                    f"{x}: {y}" for x, y in TEXT_INDEX_COUNTS.most_common()
+                ),
+            )
+        TEXT_INDEX_COUNTS.clear()
+        if self.folder_watcher.enabled:
+            logger.info(
+                "Folder watcher: watched folders: %d, %s",
+                len(self.folder_watcher.names),
+                ", ".join(f"{x}: {y}" for x, y in WATCHER_COUNTS.most_common()),
+            )
+        WATCHER_COUNTS.clear()
+        resync_scans = ", ".join(
+            f"{x}: {y}" for x, y in RESYNC_SCANS.most_common()
+        )
+        if resync_scans:
+            logger.info("Resync folder scans: %s", resync_scans)
+        RESYNC_SCANS.clear()
+        if RESYNCS:
+            logger.info(
+                "Resyncs: real: %d, suppressed (only our own writes): %d",
+                RESYNCS["real"],
+                RESYNCS["suppressed"],
+            )
+        RESYNCS.clear()
+        if searches := SEARCH_TEXT_COUNTS["searches"]:
+            logger.info(
+                "Searches of message text: %d, text decoded: %d, "
+                "text decoded per search: %.1f",
+                searches,
+                SEARCH_TEXT_COUNTS["decoded"],
+                SEARCH_TEXT_COUNTS["decoded"] / searches,
+            )
+        SEARCH_TEXT_COUNTS.clear()
+        lag = self.loop_lag
+        if lag.num_samples:
+            logger.info(
+                "Event loop lag: samples: %d, mean: %.1fms, max: %.1fms, "
+                "stalls: %d",
+                lag.num_samples,
+                lag.total_lag / lag.num_samples * 1000,
+                lag.max_lag * 1000,
+                lag.num_stalls,
+            )
+        lag.reset_stats()
         total_times = []
         for cmd in sorted(self.command_durations.keys()):
             if not self.command_durations[cmd]:
@@ -1064,6 +1397,7 @@ class IMAPUserServer:
             for root, dirs, _files in self.maildir.walk(follow_symlinks=True):
                 for dir in dirs:
                     dirname = str(root / dir)[maildir_root_len:]
+                    self.folder_watcher.watch(dirname)
                     if dirname not in extant_mboxes:
                         found_folders += 1
                         tg.create_task(self.get_mailbox(dirname))
@@ -1085,6 +1419,46 @@ class IMAPUserServer:
             time.monotonic() - start_time,
         )
 
+    ##################################################################
+    #
+    def folders_changed(self, names: set[str]) -> None:
+        """
+        Called by our `FolderWatcher` with the names of the folders that
+        something changed.
+
+        Active mailboxes are told so their management task does a resync
+        now. Other folders are activated, which resyncs them, the same as
+        `check_folder()` does when a folder's mtime has changed.
+        """
+        for name in names:
+            if mbox := self.active_mailboxes.get(name):
+                mbox.folder_changed()
+            elif name not in self.activating_mailboxes:
+                task = asyncio.create_task(
+                    self._activate_changed_folder(name),
+                    name=f"activate changed folder '{name}'",
+                )
+                self.folder_watcher_tasks.add(task)
+                task.add_done_callback(self.folder_watcher_tasks.discard)
+
+    ##################################################################
+    #
+    async def _activate_changed_folder(self, name: str) -> None:
+        """
+        Activate a folder that our `FolderWatcher` saw change.
+        """
+        try:
+            await self.get_mailbox(name)
+        except NoSuchMailbox:
+            # It was deleted or renamed out from under the watcher. Finding
+            # and checking folders deals with that.
+            #
+            pass
+        except MailboxInconsistency as e:
+            logger.warning("skipping '%s' due to: %s", name, str(e))
+        except Exception as e:
+            logger.exception("Problem checking folder '%s': %s", name, e)
+
     ##################################################################
     #
     async def _remove_stale_mailbox(self, mbox_name: str) -> None:
@@ -1099,6 +1473,11 @@ class IMAPUserServer:
             "(SELECT id FROM mailboxes WHERE name = ?)",
             (mbox_name,),
         )
+        await self.db.execute(
+            "DELETE FROM msg_metadata WHERE mailbox_id IN "
+            "(SELECT id FROM mailboxes WHERE name = ?)",
+            (mbox_name,),
+        )
         await self.db.execute(
             "DELETE FROM mailboxes WHERE name = ?",
             (mbox_name,),
@@ -1187,6 +1566,10 @@ class IMAPUserServer:
         The folder's \Marked and \Unmarked attributes maybe set in
         the process of this run.
 
+        The mtimes on disk are gathered in one walk of the mail directory
+        (see `folder_mtimes()`) so only the folders that changed are handed
+        to the workers.
+
         - `force` : If True this will force a full resync on all
                     mailbox regardless of their mtimes.
         """
@@ -1209,9 +1592,7 @@ class IMAPUserServer:
                         continue
 
                     try:
-                        await self.check_folder(
-                            mbox_name, mtime, force=self.initial_folder_scan
-                        )
+                        await self.check_folder(mbox_name, mtime, force=force)
                     except asyncio.CancelledError:
                         logger.info("Cancelled")
                         raise
@@ -1223,12 +1604,20 @@ class IMAPUserServer:
                     queue.task_done()
 
         start_time = time.time()
+        force = force or self.initial_folder_scan
+
+        # Get the mtimes of all the folders on disk in one walk of the mail
+        # directory, on a thread.
+        #
+        folder_mtimes_on_disk = await run_in_thread(folder_mtimes, self.maildir)
 
         # Go through all of the folders and mtimes we know about from the
-        # sqlite db. Put each non-active folder on to our worker queue for the
+        # sqlite db. Put each non-active folder whose mtime on disk is newer
+        # (or that we did not find on disk) on to our worker queue for the
         # workers process.
         #
         kount = 0
+        changed = 0
         queue: asyncio.Queue[tuple[str, float]] = asyncio.Queue()
         async for mbox_name, mtime in self.db.query(
             "SELECT name, mtime FROM mailboxes WHERE attributes "
@@ -1240,6 +1629,10 @@ class IMAPUserServer:
             if mbox_name in self.active_mailboxes:
                 continue
             kount += 1
+            fmtime = folder_mtimes_on_disk.get(mbox_name)
+            if not force and fmtime is not None and fmtime <= mtime:
+                continue
+            changed += 1
             queue.put_nowait((mbox_name, mtime))
 
         self.folder_check_durations = {}
@@ -1264,9 +1657,10 @@ class IMAPUserServer:
         # NOTE: In the future we might submit these as metrics.
         #
         logger.info(
-            "Finished, Took %.3f seconds to check %d folders",
+            "Finished, Took %.3f seconds to check %d folders, %d changed",
             (time.time() - start_time),
             kount,
+            changed,
         )
         scan_durations = list(self.folder_check_durations.values())
         if self.debug and len(scan_durations) > 1:
@@ -21,6 +21,7 @@ import re
 import stat
 import sys
 import time
+from bisect import bisect_left, bisect_right
 from collections.abc import AsyncIterator, Callable, Iterable, Iterator
 from contextlib import asynccontextmanager
 from datetime import UTC, datetime
@@ -46,7 +47,7 @@ from .exceptions import Bad
 if TYPE_CHECKING:
     from _typeshed import StrPath
 
-type MsgSet = list | set | tuple
+type MsgSet = list | set | tuple | SavedResult
 
 LOG_DIR = Path("/opt/asimap/logs")
 
@@ -531,7 +532,7 @@ def parsedate(datetime_str: str) -> datetime:
 #       empty.
 #
 def sequence_set_to_list(
-    seq_set: MsgSet,
+    seq_set: list | set | tuple,
     seq_max: int,
     uid_cmd: bool = False,
 ) -> list[int]:
@@ -798,3 +799,118 @@ def expand_sequence(contents: str) -> list[int]:
             keys.update(range(start, stop + 1))
 
     return sorted(keys)
+
+
+##################################################################
+##################################################################
+#
+class SavedResult:
+    """
+    The result of a `SEARCH RETURN (SAVE)` (rfc5182) that a client refers to
+    as `$` in place of a message set.
+
+    It is kept as the UIDs of the messages that were found, as sorted,
+    non-overlapping, inclusive `(start, end)` ranges. Since a message's UID
+    does not change when messages before it are expunged `$` keeps referring
+    to the same messages. Using it never expands it in to a list of every
+    message in it.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, uids: Iterable[int] = ()) -> None:
+        self.ranges: list[tuple[int, int]] = []
+        self.replace(uids)
+
+    ##################################################################
+    #
+    def replace(self, uids: "Iterable[int] | SavedResult") -> None:
+        """
+        Make this saved result the given UIDs (or a copy of the given saved
+        result.)
+        """
+        if isinstance(uids, SavedResult):
+            self.ranges = list(uids.ranges)
+            return
+
+        self.ranges = []
+        for uid in sorted(uids):
+            if self.ranges and uid <= self.ranges[-1][1] + 1:
+                self.ranges[-1] = (
+                    self.ranges[-1][0],
+                    max(uid, self.ranges[-1][1]),
+                )
+            else:
+                self.ranges.append((uid, uid))
+
+    ##################################################################
+    #
+    def discard(self, uids: Iterable[int]) -> None:
+        """
+        Remove the given UIDs (for instance, of expunged messages) from
+        this saved result.
+        """
+        for uid in uids:
+            idx = self._range_index(uid)
+            if idx is None:
+                continue
+            start, end = self.ranges[idx]
+            pieces = [
+                (a, b) for a, b in ((start, uid - 1), (uid + 1, end)) if a <= b
+            ]
+            self.ranges[idx : idx + 1] = pieces
+
+    ##################################################################
+    #
+    def index_ranges(self, uids: list[int]) -> Iterator[range]:
+        """
+        Given the ascending list of a mailbox's UIDs, the ranges of indices
+        in to that list of the messages in this saved result. UIDs that are
+        not in the mailbox are skipped.
+        """
+        for start, end in self.ranges:
+            idxs = range(bisect_left(uids, start), bisect_right(uids, end))
+            if idxs:
+                yield idxs
+
+    ##################################################################
+    #
+    def _range_index(self, uid: int) -> int | None:
+        """
+        The index of the range that contains the given UID, None if no
+        range does.
+        """
+        idx = bisect_right(self.ranges, uid, key=lambda r: r[0]) - 1
+        if idx < 0 or self.ranges[idx][1] < uid:
+            return None
+        return idx
+
+    ##################################################################
+    #
+    def __contains__(self, uid: object) -> bool:
+        if not isinstance(uid, int):
+            return False
+        return self._range_index(uid) is not None
+
+    ##################################################################
+    #
+    def __len__(self) -> int:
+        return sum(end - start + 1 for start, end in self.ranges)
+
+    ##################################################################
+    #
+    def __bool__(self) -> bool:
+        return bool(self.ranges)
+
+    ##################################################################
+    #
+    def __str__(self) -> str:
+        return ",".join(
+            f"{start}:{end}" if start != end else str(start)
+            for start, end in self.ranges
+        )
+
+    ##################################################################
+    #
+    def __repr__(self) -> str:
+        return f"SavedResult('{self}')"